@@ -521,6 +521,9 @@ definitions = {
         ("vsync", "vertical sync", 0),
         ("viewMode", "View Mode", "Camera"),
         ("undoLimit", "Undo Limit", 20),
+        ("undoMemoryLimit", "Undo Memory Limit", 512),
+        ("undoDiskLimit", "Undo Disk Limit", 4096),
+        ("parallelRelight", "Parallel Relight", False),
         ("recentWorlds", "Recent Worlds", ['']),
         ("resourcePack", "Resource Pack", u"Default"),
         ("maxCopies", "Copy stack size", 32),
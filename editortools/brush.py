@@ -46,6 +46,7 @@ from pymclevel import  BoundingBox, blockrotation
 import pymclevel
 from pymclevel.mclevelbase import exhaust
 from pymclevel.entity import TileEntity
+from pymclevel.block_fill import tileEntitiesForMask
 import types
 from pymclevel.materials import Block
 from locale import getdefaultlocale
@@ -1157,10 +1158,7 @@ def createTileEntities(block, box, chunk, defsIds=None):
         return
 
     tileEntity = TileEntity.stringNames[block.stringID]
-    for (x, y, z) in box.positions:
-        if chunk.world.blockAt(x, y, z) == block.ID:
-            if chunk.tileEntityAt(x, y, z):
-                chunk.removeTileEntitiesInBox(BoundingBox((x, y, z), (1, 1, 1)))
-            tileEntityObject = TileEntity.Create(tileEntity, (x, y, z), defsIds=defsIds)
-            chunk.TileEntities.append(tileEntityObject)
-            chunk._fakeEntities = None
+    template = TileEntity.Create(tileEntity, defsIds=defsIds)
+    _, slices = chunk.getChunkSlicesForBox(box)
+    mask = chunk.Blocks[slices] == block.ID
+    chunk.addTileEntities(tileEntitiesForMask(template, chunk, slices, mask, mask.shape))
@@ -285,8 +285,11 @@ class ChunkTool(EditorTool):
     @alertException
     def relightChunks(self):
 
+        # The parallel engine forks this process, display and OpenGL context included, so it is opt-in.
+        engine = "parallel" if config.settings.parallelRelight.get() else None
+
         def _relightChunks():
-            for i in self.editor.level.generateLightsIter(self.selectedChunks()):
+            for i in self.editor.level.generateLightsIter(self.selectedChunks(), engine=engine):
                 yield i
 
         with setWindowCaption("RELIGHTING - "):
@@ -25,6 +25,7 @@ from glbackground import Panel
 from glutils import Texture
 from mceutils import alertException, setWindowCaption
 from operation import Operation
+from pymclevel.block_fill import blockRemapTable
 from pymclevel.blockrotation import Roll, RotateLeft, FlipVertical, FlipEastWest, FlipNorthSouth
 
 from config import config
@@ -55,7 +56,11 @@ class BlockFillOperation(Operation):
         if self.level.bounds == self.destBox:
             destBox = None
 
-        fill = self.level.fillBlocksIter(destBox, self.blockInfo, blocksToReplace=self.blocksToReplace, noData=self.noData)
+        if self.blocksToReplace:
+            table = blockRemapTable([(b, self.blockInfo) for b in self.blocksToReplace], noData=self.noData)
+            fill = self.level.remapBlocksIter(destBox, table)
+        else:
+            fill = self.level.fillBlocksIter(destBox, self.blockInfo, noData=self.noData)
         showProgress("Replacing blocks...", fill, cancel=True)
         self.canUndo = True
 
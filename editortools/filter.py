@@ -893,6 +893,12 @@ class FilterToolPanel(Panel):
             self.filterOptionsPanel.confirm(self.tool)
 
 
+def invalidateEntityIndexes(level):
+    """ Filters may move entities by writing their positions directly. """
+    if hasattr(level, "invalidateEntityIndexes"):
+        level.invalidateEntityIndexes()
+
+
 class FilterOperation(Operation):
     def __init__(self, editor, level, box, filter, options):
         super(FilterOperation, self).__init__(editor, level)
@@ -917,6 +923,7 @@ class FilterOperation(Operation):
         self.filter.MCEDIT_DEFS = self.level.defsIds.mcedit_defs
         self.filter.MCEDIT_IDS = self.level.defsIds.mcedit_ids
         self.filter.perform(self.level, BoundingBox(self.box), self.options)
+        invalidateEntityIndexes(self.level)
 
         self.canUndo = True
 
@@ -940,6 +947,7 @@ class MacroOperation(Operation):
 
         for o, f in zip(self.options, self.filters):
             f.perform(self.level, BoundingBox(self._box), o)
+            invalidateEntityIndexes(self.level)
         self.canUndo = True
 
     def dirtyBox(self):
@@ -22,7 +22,7 @@ from albow.translate import _, getLang
 from glbackground import Panel
 from pymclevel.nbt import load, TAG_Byte, TAG_Short, TAG_Int, TAG_Long, TAG_Float, \
     TAG_Double, TAG_String, TAG_Byte_Array, TAG_List, TAG_Compound, TAG_Int_Array, \
-    TAG_Short_Array, littleEndianNBT, NBTFormatError, TAG_BYTE, TAG_SHORT, TAG_INT, \
+    TAG_Short_Array, LITTLE_ENDIAN, NBTFormatError, TAG_BYTE, TAG_SHORT, TAG_INT, \
     TAG_LONG, TAG_FLOAT, TAG_DOUBLE, TAG_STRING, TAG_BYTE_ARRAY, TAG_LIST, TAG_COMPOUND, \
     TAG_INT_ARRAY, TAG_SHORT_ARRAY
 from numpy import array
@@ -1230,8 +1230,7 @@ def loadFile(fName):
             magic = _magic
             if struct.Struct('<i').unpack(data[4:8])[0] != len(data[8:]):
                 raise NBTFormatError()
-            with littleEndianNBT():
-                nbtObject = load(buf=data[8:])
+            nbtObject = load(buf=data[8:], codec=LITTLE_ENDIAN)
             savePolicy = 1
         elif struct.Struct('<i').unpack(data[:4])[0] in (1, 2):
             alert(_("Old PE level.dat, unsupported at the moment."))
@@ -1287,11 +1286,10 @@ def saveFile(fName, data, savePolicy, magic):
             if savePolicy <= 0:
                 data.save(fName)
             elif savePolicy == 1:
-                with littleEndianNBT():
-                    # Here we have a PE data file. Just strip out the 
-                    toSave = data.save(compressed=False)
-                    toSave = struct.Struct('<i').pack(magic) + struct.Struct('<i').pack(len(toSave)) + toSave
-                    with open(fName, 'wb') as f:
-                        f.write(toSave)
+                # Here we have a PE data file. Just strip out the 
+                toSave = data.save(compressed=False, codec=LITTLE_ENDIAN)
+                toSave = struct.Struct('<i').pack(magic) + struct.Struct('<i').pack(len(toSave)) + toSave
+                with open(fName, 'wb') as f:
+                    f.write(toSave)
         else:
             alert("The selected object is not a file.\nCan't save it.")
@@ -3,14 +3,13 @@ import atexit
 import os
 import shutil
 import tempfile
-import albow
-from albow.translate import _
 from pymclevel import BoundingBox
 import numpy
 from albow.root import Cancel
 import pymclevel
 from albow import showProgress
 from pymclevel.mclevelbase import exhaust
+from pymclevel.undo_journal import UndoJournal
 
 undo_folder = os.path.join(tempfile.gettempdir(), "mcedit_undo", str(os.getpid()))
 
@@ -25,6 +24,17 @@ def mkundotemp():
 atexit.register(shutil.rmtree, undo_folder, True)
 
 
+def folderSize(path):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return size
+
+
 class Operation(object):
     changedLevel = True
     undoLevel = None
@@ -49,31 +59,21 @@ class Operation(object):
 
             return self.extractUndoSchematic(level, box)
 
-        undoLevel = pymclevel.MCInfdevOldLevel(mkundotemp(), create=True)
-        if not chunkCount:
-            try:
-                chunkCount = len(chunks)
-            except TypeError:
-                chunkCount = -1
-
-        def _extractUndo():
-            yield 0, 0, "Recording undo..."
-            for i, (cx, cz) in enumerate(chunks):
-                undoLevel.copyChunkFrom(level, cx, cz)
-                yield i, chunkCount, _("Copying chunk %s...") % ((cx, cz),)
-            undoLevel.saveInPlace()
-
-        if chunkCount > 25 or chunkCount < 1:
-            if "Canceled" == showProgress("Recording undo...", _extractUndo(), cancel=True):
-                if albow.ask("Continue with undo disabled?", ["Continue", "Cancel"]) == "Cancel":
-                    raise Cancel
-                else:
-                    return None
-        else:
-            exhaust(_extractUndo())
-
+        undoLevel = UndoJournal(level)
+        undoLevel.captureInBackground(chunks)
         return undoLevel
 
+    def finishUndo(self):
+        """ Called once the operation has been performed, so its undo journal can stop capturing and keep only
+        what the operation changed. """
+        undoLevel = self.undoLevel
+        if isinstance(undoLevel, UndoJournal) and not undoLevel.finished:
+            undoLevel.stopCapture()
+            if undoLevel.capturedCount > 25:
+                showProgress("Recording undo...", undoLevel.finishIter())
+            else:
+                undoLevel.finish()
+
     @staticmethod
     def extractUndoSchematic(level, box):
         if box.volume > 131072:
@@ -96,8 +96,18 @@ class Operation(object):
             Default implementation copies all chunks in undoLevel back into level. Non-chunk-based operations
             should override this."""
 
-        if self.undoLevel:
-            self.redoLevel = self.extractUndo(self.level, self.dirtyBox())
+        if isinstance(self.undoLevel, UndoJournal):
+            # The journal holds the new blocks as well as the old, so redo() applies it the other way.
+            self.finishUndo()
+            self._applyJournal(self.undoLevel, "Undoing...")
+
+        elif self.undoLevel:
+            if isinstance(self.level, pymclevel.MCInfdevOldLevel):
+                # copyChunkFrom doesn't go through getChunk, so the redo has to be captured before it runs.
+                self.redoLevel = UndoJournal(self.level)
+                exhaust(self.redoLevel.captureIter(self.dirtyBox().chunkPositions))
+            else:
+                self.redoLevel = self.extractUndo(self.level, self.dirtyBox())
 
             def _undo():
                 yield 0, 0, "Undoing..."
@@ -117,8 +127,24 @@ class Operation(object):
 
             self.editor.invalidateChunks(self.undoLevel.allChunks)
 
+            if isinstance(self.redoLevel, UndoJournal):
+                self.redoLevel.finish()
+
+    def _applyJournal(self, journal, title, redo=False):
+        if journal.chunkCount > 25:
+            showProgress(title, journal.applyIter(redo))
+        else:
+            journal.apply(redo)
+        self.editor.invalidateChunks(journal.allChunks)
+
     def redo(self):
-        if self.redoLevel:
+        if isinstance(self.undoLevel, UndoJournal):
+            self._applyJournal(self.undoLevel, "Redoing...", redo=True)
+
+        elif isinstance(self.redoLevel, UndoJournal):
+            self._applyJournal(self.redoLevel, "Redoing...")
+
+        elif self.redoLevel:
             def _redo():
                 yield 0, 0, "Redoing..."
                 if hasattr(self.level, 'copyChunkFrom'):
@@ -135,6 +161,58 @@ class Operation(object):
             else:
                 exhaust(_redo())
 
+    def undoSize(self):
+        """ Returns the bytes in memory and the bytes on disk held by the operation's undo and redo. """
+        memory = disk = 0
+        for undoLevel in (self.undoLevel, self.redoLevel):
+            if isinstance(undoLevel, UndoJournal):
+                memory += undoLevel.memorySize
+                disk += undoLevel.diskSize
+            elif isinstance(undoLevel, pymclevel.MCInfdevOldLevel):
+                disk += self._undoFolderSize(undoLevel.worldFolder.filename)
+            elif isinstance(undoLevel, pymclevel.MCSchematic):
+                memory += undoLevel.Blocks.nbytes + undoLevel.Data.nbytes
+        return memory, disk
+
+    _undoFolderSizes = None
+
+    def _undoFolderSize(self, path):
+        """ Bytes in an undo world's folder. An undo world is only read once it has been recorded, so its
+        folder is measured the first time it is asked for instead of on every trim of the undo stack. """
+        if self._undoFolderSizes is None:
+            self._undoFolderSizes = {}
+        if path not in self._undoFolderSizes:
+            self._undoFolderSizes[path] = folderSize(path)
+        return self._undoFolderSizes[path]
+
+    def compressUndo(self):
+        for undoLevel in (self.undoLevel, self.redoLevel):
+            if isinstance(undoLevel, UndoJournal) and undoLevel.finished:
+                undoLevel.compress()
+
+    def spillUndo(self):
+        """ Moves the operation's undo and redo journals out of memory into the undo folder. """
+        for undoLevel in (self.undoLevel, self.redoLevel):
+            if isinstance(undoLevel, UndoJournal) and undoLevel.finished:
+                if not os.path.exists(undo_folder):
+                    os.makedirs(undo_folder)
+                undoLevel.spill(undo_folder)
+
+    def discardUndo(self):
+        """ Throws away the operation's undo and redo, deleting their temporary files. The operation can't be
+        undone or redone afterward. """
+        for undoLevel in (self.undoLevel, self.redoLevel):
+            if isinstance(undoLevel, UndoJournal):
+                undoLevel.stopCapture()
+                undoLevel.discard()
+            elif isinstance(undoLevel, pymclevel.MCInfdevOldLevel):
+                path = undoLevel.worldFolder.filename
+                if isinstance(undoLevel, pymclevel.ZipSchematic) or path.startswith(undo_folder):
+                    undoLevel.close()
+                    shutil.rmtree(path, True)
+        self.undoLevel = self.redoLevel = None
+        self._undoFolderSizes = None
+
     def dirtyBox(self):
         """ The region modified by the operation.
         Return None to indicate no blocks were changed.
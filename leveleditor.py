@@ -168,6 +168,7 @@ class LevelEditor(GLViewport):
 
         self.unsavedEdits = 0
         self.undoStack = []
+        self.afterSaveUndoStack = []
         self.redoStack = []
         self.copyStack = []
 
@@ -324,6 +325,8 @@ class LevelEditor(GLViewport):
 
         config.settings.viewMode.addObserver(self)
         config.settings.undoLimit.addObserver(self)
+        config.settings.undoMemoryLimit.addObserver(self)
+        config.settings.undoDiskLimit.addObserver(self)
 
         self.reloadToolbar()
 
@@ -1317,6 +1320,7 @@ class LevelEditor(GLViewport):
         self.freezeStatus(_("Loading ") + filename)
         if self.level:
             self.selectionTool.endSelection()
+            self.stopLightingWorker()
             self.level.close()
 
         try:
@@ -1386,6 +1390,7 @@ class LevelEditor(GLViewport):
         """
         Called to load a level, world, or dimension into the editor and display it in the viewport.
         """
+        self.stopLightingWorker()
         self.level = level
         if hasattr(level, 'acquireSessionLock'):
             level.acquireSessionLock()
@@ -1401,6 +1406,8 @@ class LevelEditor(GLViewport):
         self.recordUndo = True
 
         if not saveChanges:
+            for op in self.afterSaveUndoStack + self.undoStack + self.redoStack:
+                op.discardUndo()
             self.undoStack = []
             self.afterSaveUndoStack = []
             self.redoStack = []
@@ -1556,6 +1563,8 @@ class LevelEditor(GLViewport):
                 if hasattr(level, 'dimensions'):
                     for level in itertools.chain(level.dimensions.itervalues(), [level]):
 
+                        if "Canceled" == showProgress("Lighting chunks", level.generatePendingLightsIter(), cancel=True):
+                            return
                         if "Canceled" == showProgress("Lighting chunks", level.generateLightsIter(), cancel=True):
                             return
 
@@ -1568,6 +1577,8 @@ class LevelEditor(GLViewport):
                             #xxx change MCInfdevOldLevel to monitor changes since last call
                             self.invalidateChunks(needsRefresh)
                 else:
+                    if "Canceled" == showProgress("Lighting chunks", level.generatePendingLightsIter(), cancel=True):
+                        return
                     if "Canceled" == showProgress("Lighting chunks", level.generateLightsIter(), cancel=True):
                         return
 
@@ -2157,6 +2168,7 @@ class LevelEditor(GLViewport):
         self.root.fix_sticky_ctrl()
         self.selectionTool.endSelection()
         self.mainViewport.mouseLookOff()
+        self.stopLightingWorker()
         if self.level:
             self.level.close()
             self.level = None
@@ -2223,6 +2235,7 @@ class LevelEditor(GLViewport):
             self.root.fix_sticky_ctrl()
             self.selectionTool.endSelection()
             self.mainViewport.mouseLookOff()
+            self.stopLightingWorker()
             if self.level:
                 self.level.close()
                 self.level = None
@@ -2882,12 +2895,12 @@ class LevelEditor(GLViewport):
 
             if self.recordUndo:
                 self.redoStack.append(op)
-                if len(self.redoStack) > self.undoLimit:
-                    self.redoStack.pop(0)
             op.undo()
+            self.trimUndoStack()
             changedBox = op.dirtyBox()
             if changedBox is not None:
                 self.invalidateBox(changedBox)
+            self.queueLighting(op)
             if not self.selectionBox() and wasSelectionBox:
                 self.toolbar.selectTool(0)
                 self.toolbar.tools[0].currentCorner = 1
@@ -2908,12 +2921,12 @@ class LevelEditor(GLViewport):
 
             if self.recordUndo:
                 self.undoStack.append(op)
-                if len(self.undoStack) > self.undoLimit:
-                    self.undoStack.pop(0)
             op.redo()
+            self.trimUndoStack()
             changedBox = op.dirtyBox()
             if changedBox is not None:
                 self.invalidateBox(changedBox)
+            self.queueLighting(op)
             if op.changedLevel:
                 self.addUnsavedEdit()
 
@@ -3002,6 +3015,10 @@ class LevelEditor(GLViewport):
                 dl=len(glutils.DisplayList.allLists), dlcount=glutils.gl.listCount,
                 t=len(glutils.Texture.allTextures), g=len(gc.garbage))
 
+            self.debugString += _("Undo: {n} ({m:0.1f} MB, {d:0.1f} MB on disk), ").format(
+                n=len(self.afterSaveUndoStack) + len(self.undoStack) + len(self.redoStack),
+                m=self.undoStackSize[0] / 1048576., d=self.undoStackSize[1] / 1048576.)
+
             if self.renderer:
                 self.renderer.addDebugInfo(self.addDebugString)
 
@@ -3119,20 +3136,108 @@ class LevelEditor(GLViewport):
 
     def addOperation(self, op):
         self.performWithRetry(op)
+        self.queueLighting(op)
 
         if self.recordUndo and op.canUndo:
             self.undoStack.append(op)
-            if len(self.undoStack) > self.undoLimit:
-                self.undoStack.pop(0)
+            self.trimUndoStack()
 
     recordUndo = True
+    undoStackSize = (0, 0)
+
+    def trimUndoStack(self):
+        """ Keeps the undo history within the undo limit and the undo memory and disk budgets. The undo of every
+        operation but the latest on each stack is compressed. While over the memory budget, the oldest are
+        moved to disk, and while still over it or over the disk budget, the oldest are discarded. """
+        for stack in (self.undoStack, self.redoStack):
+            while len(stack) > self.undoLimit:
+                stack.pop(0).discardUndo()
+
+        latest = [stack[-1] for stack in (self.undoStack, self.redoStack) if stack]
+        history = [op for op in self.afterSaveUndoStack + self.undoStack + self.redoStack if op not in latest]
+        for op in history:
+            op.compressUndo()
+
+        sizes = [op.undoSize() for op in self.afterSaveUndoStack + self.undoStack + self.redoStack]
+        memory = sum(m for m, d in sizes)
+        disk = sum(d for m, d in sizes)
+        memoryLimit = self.undoMemoryLimit << 20
+        diskLimit = self.undoDiskLimit << 20
+
+        for op in history:
+            if memory <= memoryLimit:
+                break
+            oldMemory, oldDisk = op.undoSize()
+            op.spillUndo()
+            newMemory, newDisk = op.undoSize()
+            memory += newMemory - oldMemory
+            disk += newDisk - oldDisk
+
+        for op in history:
+            if memory <= memoryLimit and disk <= diskLimit:
+                break
+            opMemory, opDisk = op.undoSize()
+            for stack in (self.afterSaveUndoStack, self.undoStack, self.redoStack):
+                if op in stack:
+                    stack.remove(op)
+            op.discardUndo()
+            memory -= opMemory
+            disk -= opDisk
+
+        self.undoStackSize = (memory, disk)
+
+    lightingWorker = None
+    lastEditTime = datetime.now()
+
+    def queueLighting(self, op):
+        """ Queues the area changed by op to be relit once the editor has been idle for a second. """
+        changedBox = op.dirtyBox()
+        level = getattr(op, "level", None)
+        if not op.changedLevel or changedBox is None or not hasattr(level, "queueLighting"):
+            return
+
+        level.queueLighting(changedBox)
+        self.lastEditTime = datetime.now()
+        if self.lightingWorker not in self.workers:
+            self.lightingWorker = self.pendingLightingWorker(level)
+            self.addWorker(self.lightingWorker)
+
+    def stopLightingWorker(self):
+        """ Stops relighting the level being closed or replaced. Boxes still queued on it are relit
+        when it is saved. """
+        if self.lightingWorker is not None:
+            self.removeWorker(self.lightingWorker)
+            self.lightingWorker.close()
+            self.lightingWorker = None
+
+    def pendingLightingWorker(self, level):
+        while level.pendingLightingBoxes and level is self.level:
+            if level.saving or datetime.now() - self.lastEditTime < timedelta(0, 1):
+                yield
+                continue
+
+            boxes = level.pendingLightingBoxes
+            try:
+                for _ in level.generatePendingLightsIter():
+                    yield
+            except GeneratorExit:
+                # Stopped partway, so relight the whole boxes again when the level is saved.
+                for box in boxes:
+                    level.queueLighting(box)
+                raise
+
+            for box in boxes:
+                self.invalidateBox(box.expand(15, 0, 15))
 
     def performWithRetry(self, op):
         try:
             op.perform(self.recordUndo)
         except MemoryError:
+            op.finishUndo()
             self.invalidateAllChunks()
             op.perform(self.recordUndo)
+        finally:
+            op.finishUndo()
 
     def quit(self):
         if config.settings.savePositionOnClose.get():
@@ -5,6 +5,7 @@ import pymclevel.materials
 import pymclevel.infiniteworld
 import sys
 import os
+from pymclevel import block_fill
 from pymclevel.box import BoundingBox, Vector
 import numpy
 from numpy import zeros, bincount
@@ -426,10 +427,11 @@ class mce(object):
 
         print "Replacing {0} with {1}".format(blockInfo.name, newBlockInfo.name)
 
-        self.level.fillBlocks(box, newBlockInfo, blocksToReplace=[blockInfo])
+        table = block_fill.blockRemapTable([(blockInfo, newBlockInfo)])
+        changedCounts = self.level.remapBlocks(box, table)
 
         self.needsSave = True
-        print "Done."
+        print "Replaced {0} blocks.".format(sum(changedCounts.values()))
 
     def _createchest(self, command):
         """
@@ -954,7 +956,7 @@ class mce(object):
         else:
             chunks = self.level.allChunks
 
-        self.level.generateLights(chunks)
+        self.level.generateLights(chunks, engine="parallel")
 
         print "Relit 0 chunks."
         self.needsSave = True
@@ -1011,15 +1013,10 @@ class mce(object):
 
         print "Removing grief matter and surface lava above height {0}...".format(box.miny)
 
-        self.level.fillBlocks(box,
-                              self.level.materials.Air,
-                              blocksToReplace=[self.level.materials.Bedrock,
-                                               self.level.materials.Obsidian,
-                                               self.level.materials.Fire,
-                                               self.level.materials.LavaActive,
-                                               self.level.materials.Lava,
-                              ]
-        )
+        materials = self.level.materials
+        griefBlocks = [materials.Bedrock, materials.Obsidian, materials.Fire, materials.LavaActive, materials.Lava]
+        table = block_fill.blockRemapTable([(block, materials.Air) for block in griefBlocks])
+        self.level.remapBlocks(box, table)
         self.needsSave = True
 
     def _time(self, command):
@@ -35,6 +35,9 @@ class OptionsPanel(Dialog):
             config.controls.cameraBrakingSpeed:               config.controls.cameraBrakingSpeed.get(),
             config.controls.mouseSpeed:                       config.controls.mouseSpeed.get(),
             config.settings.undoLimit:                        config.settings.undoLimit.get(),
+            config.settings.undoMemoryLimit:                  config.settings.undoMemoryLimit.get(),
+            config.settings.undoDiskLimit:                    config.settings.undoDiskLimit.get(),
+            config.settings.parallelRelight:                  config.settings.parallelRelight.get(),
             config.settings.maxCopies:                        config.settings.maxCopies.get(),
             config.controls.invertMousePitch:                 config.controls.invertMousePitch.get(),
             config.settings.spaceHeight:                      config.settings.spaceHeight.get(),
@@ -89,6 +92,14 @@ class OptionsPanel(Dialog):
         undoLimitRow = albow.IntInputRow("Undo Limit: ",
                                             ref=config.settings.undoLimit, width=100, min=0)
 
+        undoMemoryLimitRow = albow.IntInputRow("Undo Memory (MB): ",
+                                                  ref=config.settings.undoMemoryLimit, width=100, min=0,
+                                                  tooltipText="Older undo steps are moved to disk past this size.")
+
+        undoDiskLimitRow = albow.IntInputRow("Undo Disk (MB): ",
+                                                ref=config.settings.undoDiskLimit, width=100, min=0,
+                                                tooltipText="The oldest undo steps are forgotten past this size.")
+
         maxCopiesRow = albow.IntInputRow("Copy Stack Size: ",
                                             ref=config.settings.maxCopies, width=100, min=0,
                                             tooltipText="Maximum number of copied objects.")
@@ -135,6 +146,10 @@ class OptionsPanel(Dialog):
                                                 ref=config.settings.superSecretSettings,
                                                 tooltipText="Weird stuff happen!")
 
+        parallelRelightRow = albow.CheckBoxLabel("Parallel Relight",
+                                                    ref=config.settings.parallelRelight,
+                                                    tooltipText="Relight chunks in several worker processes. Faster on large selections,\nbut starts a copy of MCEdit for each processor.")
+
         longDistanceRow = albow.CheckBoxLabel("Long-Distance Mode",
                                                  ref=config.settings.longDistanceMode,
                                                  tooltipText="Always target the farthest block under the cursor, even in mouselook mode.")
@@ -184,6 +199,8 @@ class OptionsPanel(Dialog):
             blockBufferRow,
             mouseSpeedRow,
             undoLimitRow,
+            undoMemoryLimitRow,
+            undoDiskLimitRow,
             maxCopiesRow,
             compassSizeRow,
             fontProportion,
@@ -201,6 +218,7 @@ class OptionsPanel(Dialog):
                     compassToggleRow,
                     showCommandsRow,
                     cancelCommandBlockOffset,
+                    parallelRelightRow,
                     langButtonRow,
                     ) + (
                         ((sys.platform == "win32" and pygame.version.vernum == (1, 9, 1)) and (windowSizeRow,) or ())
@@ -20,5 +20,5 @@ from mclevel import fromFile, loadWorld, loadWorldNumber
 from nbt import load, gunzip, TAG_Byte, TAG_Byte_Array, TAG_Compound, TAG_Double, TAG_Float, TAG_Int, TAG_Int_Array, \
     TAG_List, TAG_Long, TAG_Short, TAG_String
 import pocket
-from schematic import INVEditChest, MCSchematic, ZipSchematic
+from schematic import DiskBackedSchematic, INVEditChest, MCSchematic, ZipSchematic
 saveFileDir = minecraftSaveFileDir
@@ -46,6 +46,7 @@ from cStringIO import StringIO
 from cpython cimport PyTypeObject, PyUnicode_DecodeUTF8, PyList_Append, PyString_FromStringAndSize
 from contextlib import contextmanager
 import numpy
+import threading
 import logging
 logger = logging.getLogger(__name__)
 
@@ -98,6 +99,38 @@ ID_MAX = _ID_MAX
 class NBTFormatError (ValueError):
     """Indicates the NBT format is invalid."""
 
+
+cdef class NBTCodec:
+    """
+    Byte order used to read and write NBT data. Java edition NBT is big endian, Pocket edition NBT is
+    little endian. Pass one of the BIG_ENDIAN or LITTLE_ENDIAN instances to load() and save() instead of
+    changing module state, so both formats can be handled at the same time from any thread.
+    """
+    cdef readonly bint big_endian
+    cdef readonly object byteorder
+
+    def __init__(self, byteorder):
+        self.byteorder = byteorder
+        self.big_endian = byteorder == ">"
+
+    def __repr__(self):
+        return "NBTCodec(%r)" % self.byteorder
+
+
+BIG_ENDIAN = NBTCodec(">")
+LITTLE_ENDIAN = NBTCodec("<")
+
+_codec_state = threading.local()
+
+
+def current_codec():
+    """
+    The codec used by load() and save() when none is passed: BIG_ENDIAN, unless the calling thread is
+    inside a littleEndianNBT() block.
+    """
+    return getattr(_codec_state, "codec", BIG_ENDIAN)
+
+
 # NBT spec requires the data to be gzipped.
 # If gunzipping fails, for compatibility we assume the data is unzipped and try again.
 
@@ -154,6 +187,9 @@ cdef class TAG_Value:
     def copy(self):
         return self.__class__(self.value, self.name)
 
+    def __deepcopy__(self, memo):
+        return self.copy()
+
     def isList(self):
         return False
 
@@ -164,7 +200,7 @@ cdef class TAG_Value:
 cdef class TAG_Byte(TAG_Value):
     cdef public char value
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf, bint swap):
         save_byte(self.value, buf)
 
     def __init__(self, char value=0, name=""):
@@ -176,8 +212,8 @@ cdef class TAG_Byte(TAG_Value):
 cdef class TAG_Short(TAG_Value):
     cdef public short value
 
-    cdef void save_value(self, buf):
-        save_short(self.value, buf)
+    cdef void save_value(self, buf, bint swap):
+        save_short(self.value, buf, swap)
 
     def __init__(self, short value=0, name=""):
         self.value = value
@@ -188,8 +224,8 @@ cdef class TAG_Short(TAG_Value):
 cdef class TAG_Int(TAG_Value):
     cdef public int value
 
-    cdef void save_value(self, buf):
-        save_int(self.value, buf)
+    cdef void save_value(self, buf, bint swap):
+        save_int(self.value, buf, swap)
 
     def __init__(self, int value=0, name=""):
         self.value = value
@@ -200,8 +236,8 @@ cdef class TAG_Int(TAG_Value):
 cdef class TAG_Long(TAG_Value):
     cdef public long long value
 
-    cdef void save_value(self, buf):
-        save_long(self.value, buf)
+    cdef void save_value(self, buf, bint swap):
+        save_long(self.value, buf, swap)
 
     def __init__(self, long long value=0, name=""):
         self.value = value
@@ -212,8 +248,8 @@ cdef class TAG_Long(TAG_Value):
 cdef class TAG_Float(TAG_Value):
     cdef public float value
 
-    cdef void save_value(self, buf):
-        save_float(self.value, buf)
+    cdef void save_value(self, buf, bint swap):
+        save_float(self.value, buf, swap)
 
     def __init__(self, float value=0., name=""):
         self.value = value
@@ -224,8 +260,8 @@ cdef class TAG_Float(TAG_Value):
 cdef class TAG_Double(TAG_Value):
     cdef public double value
 
-    cdef void save_value(self, buf):
-        save_double(self.value, buf)
+    cdef void save_value(self, buf, bint swap):
+        save_double(self.value, buf, swap)
 
     def __init__(self, double value=0., name=""):
         self.value = value
@@ -234,7 +270,9 @@ cdef class TAG_Double(TAG_Value):
 
 
 cdef class TAG_Byte_Array(TAG_Value):
-    cdef public object value
+    cdef object _value
+    cdef bint _shared
+    cdef bint _exposed
     dtype = numpy.dtype('u1')
 
     def __init__(self, value=None, name=""):
@@ -245,11 +283,25 @@ cdef class TAG_Byte_Array(TAG_Value):
         self.name = name
         self.tagID = _ID_BYTE_ARRAY
 
-    cdef void save_value(self, buf):
-        save_array(self.value, buf, 1)
+    property value:
+        def __get__(self):
+            if self._shared:
+                self._value = self._value.copy()
+                self._shared = False
+            self._exposed = True
+            return self._value
+
+        def __set__(self, value):
+            # The caller keeps a reference to value.
+            self._value = value
+            self._shared = False
+            self._exposed = True
+
+    cdef void save_value(self, buf, bint swap):
+        save_array(self._value, buf, 1, swap)
 
     def __repr__(self):
-        return "<%s name=%r length=%d>" % (self.__class__.__name__, self.name, len(self.value))
+        return "<%s name=%r length=%d>" % (self.__class__.__name__, self.name, len(self._value))
 
     def __richcmp__(self, other, type):
         if type == 2: # __eq__
@@ -259,10 +311,25 @@ cdef class TAG_Byte_Array(TAG_Value):
         return NotImplemented
 
     def copy(self):
-        return TAG_Byte_Array(numpy.array(self.value), self.name)
+        """
+        The copy shares the array with this tag until the value of either one is accessed. If the array was
+        already handed out through value, it is copied at once instead.
+        """
+        cdef TAG_Byte_Array tag = TAG_Byte_Array.__new__(TAG_Byte_Array)
+        tag._name = self._name
+        tag.tagID = self.tagID
+        if self._exposed:
+            # Whoever holds the array may still write to it, so the copy can't share it.
+            tag._value = self._value.copy()
+        else:
+            tag._value = self._value
+            tag._shared = self._shared = True
+        return tag
 
 cdef class TAG_Int_Array(TAG_Value):
-    cdef public object value
+    cdef object _value
+    cdef bint _shared
+    cdef bint _exposed
     dtype = numpy.dtype('>u4')
 
     def __init__(self, value=None, name=""):
@@ -273,11 +340,25 @@ cdef class TAG_Int_Array(TAG_Value):
         self.name = name
         self.tagID = _ID_INT_ARRAY
 
-    cdef void save_value(self, buf):
-        save_array(self.value, buf, 4)
+    property value:
+        def __get__(self):
+            if self._shared:
+                self._value = self._value.copy()
+                self._shared = False
+            self._exposed = True
+            return self._value
+
+        def __set__(self, value):
+            # The caller keeps a reference to value.
+            self._value = value
+            self._shared = False
+            self._exposed = True
+
+    cdef void save_value(self, buf, bint swap):
+        save_array(self._value, buf, 4, swap)
 
     def __repr__(self):
-        return "<%s name=%r length=%d>" % (self.__class__.__name__, self.name, len(self.value))
+        return "<%s name=%r length=%d>" % (self.__class__.__name__, self.name, len(self._value))
 
     def __richcmp__(self, other, type):
         if type == 2: # __eq__
@@ -287,10 +368,25 @@ cdef class TAG_Int_Array(TAG_Value):
         return NotImplemented
 
     def copy(self):
-        return TAG_Int_Array(numpy.array(self.value), self.name)
+        """
+        The copy shares the array with this tag until the value of either one is accessed. If the array was
+        already handed out through value, it is copied at once instead.
+        """
+        cdef TAG_Int_Array tag = TAG_Int_Array.__new__(TAG_Int_Array)
+        tag._name = self._name
+        tag.tagID = self.tagID
+        if self._exposed:
+            # Whoever holds the array may still write to it, so the copy can't share it.
+            tag._value = self._value.copy()
+        else:
+            tag._value = self._value
+            tag._shared = self._shared = True
+        return tag
 
 cdef class TAG_Long_Array(TAG_Value):
-    cdef public object value
+    cdef object _value
+    cdef bint _shared
+    cdef bint _exposed
     dtype = numpy.dtype('>q')
 
     def __init__(self, value=None, name=""):
@@ -301,11 +397,25 @@ cdef class TAG_Long_Array(TAG_Value):
         self.name = name
         self.tagID = _ID_LONG_ARRAY
 
-    cdef void save_value(self, buf):
-        save_array(self.value, buf, 8)
+    property value:
+        def __get__(self):
+            if self._shared:
+                self._value = self._value.copy()
+                self._shared = False
+            self._exposed = True
+            return self._value
+
+        def __set__(self, value):
+            # The caller keeps a reference to value.
+            self._value = value
+            self._shared = False
+            self._exposed = True
+
+    cdef void save_value(self, buf, bint swap):
+        save_array(self._value, buf, 8, swap)
 
     def __repr__(self):
-        return "<%s name=%r length=%d>" % (self.__class__.__name__, self.name, len(self.value))
+        return "<%s name=%r length=%d>" % (self.__class__.__name__, self.name, len(self._value))
 
     def __richcmp__(self, other, type):
         if type == 2: # __eq__
@@ -315,27 +425,54 @@ cdef class TAG_Long_Array(TAG_Value):
         return NotImplemented
 
     def copy(self):
-        return TAG_Long_Array(numpy.array(self.value), self.name)
+        """
+        The copy shares the array with this tag until the value of either one is accessed. If the array was
+        already handed out through value, it is copied at once instead.
+        """
+        cdef TAG_Long_Array tag = TAG_Long_Array.__new__(TAG_Long_Array)
+        tag._name = self._name
+        tag.tagID = self.tagID
+        if self._exposed:
+            # Whoever holds the array may still write to it, so the copy can't share it.
+            tag._value = self._value.copy()
+        else:
+            tag._value = self._value
+            tag._shared = self._shared = True
+        return tag
 
 cdef class TAG_Short_Array(TAG_Value):
-    cdef public object value
+    cdef object _value
+    cdef bint _shared
+    cdef bint _exposed
     dtype = numpy.dtype('>u2')
 
     def __init__(self, value=None, name=""):
         if value is None:
-            if _BIG_ENDIAN:
-                value = numpy.zeros((0,), )
             value = numpy.zeros((0,), self.dtype)
 
         self.value = value
         self.name = name
         self.tagID = _ID_SHORT_ARRAY
 
-    cdef void save_value(self, buf):
-        save_array(self.value, buf, 2)
+    property value:
+        def __get__(self):
+            if self._shared:
+                self._value = self._value.copy()
+                self._shared = False
+            self._exposed = True
+            return self._value
+
+        def __set__(self, value):
+            # The caller keeps a reference to value.
+            self._value = value
+            self._shared = False
+            self._exposed = True
+
+    cdef void save_value(self, buf, bint swap):
+        save_array(self._value, buf, 2, swap)
 
     def __repr__(self):
-        return "<%s name=%r length=%d>" % (self.__class__.__name__, self.name, len(self.value))
+        return "<%s name=%r length=%d>" % (self.__class__.__name__, self.name, len(self._value))
 
     def __richcmp__(self, other, type):
         if type == 2: # __eq__
@@ -345,7 +482,20 @@ cdef class TAG_Short_Array(TAG_Value):
         return NotImplemented
 
     def copy(self):
-        return TAG_Short_Array(numpy.array(self.value), self.name)
+        """
+        The copy shares the array with this tag until the value of either one is accessed. If the array was
+        already handed out through value, it is copied at once instead.
+        """
+        cdef TAG_Short_Array tag = TAG_Short_Array.__new__(TAG_Short_Array)
+        tag._name = self._name
+        tag.tagID = self.tagID
+        if self._exposed:
+            # Whoever holds the array may still write to it, so the copy can't share it.
+            tag._value = self._value.copy()
+        else:
+            tag._value = self._value
+            tag._shared = self._shared = True
+        return tag
 
 cdef class TAG_String(TAG_Value):
     cdef unicode _value
@@ -364,8 +514,8 @@ cdef class TAG_String(TAG_Value):
                 value = PyUnicode_DecodeUTF8(value, len(value), "strict")
             self._value = value
 
-    cdef void save_value(self, buf):
-        save_string(self._value.encode('utf-8'), buf)
+    cdef void save_value(self, buf, bint swap) except *:
+        save_string(self._value.encode('utf-8'), buf, swap)
 
 
 cdef class _TAG_List(TAG_Value):
@@ -394,7 +544,7 @@ cdef class _TAG_List(TAG_Value):
             raise TypeError("Invalid type %s for TAG_List(%s)" % (value.__class__, tag_classes[self.list_type]))
 
     def copy(self):
-        return TAG_List([tag.copy() for tag in self.value], self.name)
+        return TAG_List([tag.copy() for tag in self.value], self.name, self.list_type)
 
     # --- collection methods ---
 
@@ -426,19 +576,19 @@ cdef class _TAG_List(TAG_Value):
     def __delitem__(self, key):
         del self.value[key]
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf, bint swap) except *:
         cdef char list_type = self.list_type
         cdef TAG_Value tag
 
         save_tag_id(list_type, buf)
-        save_int(<int>len(self.value), buf)
+        save_int(<int>len(self.value), buf, swap)
 
         cdef TAG_Value subtag
         for subtag in self.value:
             if subtag.tagID != list_type:
                 raise ValueError("Asked to save TAG_List with different types! Found %s and %s" % (subtag.tagID,
                                                                                                    list_type))
-            save_tag_value(subtag, buf)
+            save_tag_value(subtag, buf, swap)
 
     def isList(self):
         return True
@@ -513,23 +663,27 @@ cdef class _TAG_Compound(TAG_Value):
     def get_all(self, key):
         return [v for v in self.value if v.name == key]
 
-    cdef void save_value(self, buf):
+    cdef void save_value(self, buf, bint swap) except *:
         cdef TAG_Value subtag
         for subtag in self.value:
             save_tag_id(subtag.tagID, buf)
-            save_tag_name(subtag, buf)
-            save_tag_value(subtag, buf)
+            save_tag_name(subtag, buf, swap)
+            save_tag_value(subtag, buf, swap)
         save_tag_id(_ID_END, buf)
 
-    def save(self, filename_or_buf=None, compressed=True):
+    def save(self, filename_or_buf=None, compressed=True, NBTCodec codec=None):
         """
         Pass a filename to save the data to a file. Pass a file-like object (with a read() method)
         to write the data to that object. Pass nothing to return the data as a string.
+        Pass LITTLE_ENDIAN as codec to write Pocket edition NBT.
         """
+        if codec is None:
+            codec = current_codec()
+        cdef bint swap = codec.big_endian
         io = StringIO()
         save_tag_id(self.tagID, io)
-        save_tag_name(self, io)
-        save_tag_value(self, io)
+        save_tag_name(self, io, swap)
+        save_tag_value(self, io, swap)
         data = io.getvalue()
         if compressed:
             gzio = StringIO()
@@ -554,29 +708,30 @@ class TAG_Compound(_TAG_Compound, collections.MutableMapping):
     pass
 
 
-_BIG_ENDIAN = 1
-
 @contextmanager
 def littleEndianNBT():
     """
-    Sets the required paramaters to read and/or save NBT in little-endian format.
-    Sets the paramaters back to big-endian format after.
+    Makes load() and save() default to LITTLE_ENDIAN for the calling thread until the block exits.
+    Other threads are not affected; prefer passing codec=LITTLE_ENDIAN explicitly.
     :return: None
     """
-    global _BIG_ENDIAN
-    _BIG_ENDIAN = 0
-    yield
-    _BIG_ENDIAN = 1
+    previous = current_codec()
+    _codec_state.codec = LITTLE_ENDIAN
+    try:
+        yield
+    finally:
+        _codec_state.codec = previous
 
-cdef void swab(void * vbuf, int nbytes):
+cdef void swab(void * vbuf, int nbytes, bint swap):
     """
-    Converts big endian to little endian. If littleEndianNBT is enabled,
-    this should do nothing.
+    Converts big endian to little endian. Does nothing if swap is false, that is when
+    the data is little endian NBT.
     :param vbuf: pointer to buffer of data to convert
     :param nbytes: pointer to length of the buffer in bytes
+    :param swap: whether the NBT data is big endian
     :return: None
     """
-    if not _BIG_ENDIAN:
+    if not swap:
         return
     cdef unsigned char * buf = <unsigned char *> vbuf
     cdef int i
@@ -588,7 +743,7 @@ cdef void swab(void * vbuf, int nbytes):
 # --- NBT Loading ---
 #
 
-def load(filename="", buf=None):
+def load(filename="", buf=None, NBTCodec codec=None):
     """
     Load an NBT tree from a file and return the root TAG_Compound. The root tag is the only tag that can have a name
     itself without being inside a TAG_Compound.
@@ -597,6 +752,8 @@ def load(filename="", buf=None):
     :type filename: basestring
     :param buf: File-like object to load data from
     :type buf: file-like object | bytes
+    :param codec: Byte order of the data, BIG_ENDIAN or LITTLE_ENDIAN. Defaults to current_codec()
+    :type codec: NBTCodec
     :return: Structured NBT data
     :rtype: TAG_Compound
     """
@@ -608,10 +765,14 @@ def load(filename="", buf=None):
 
     buf = try_gunzip(buf)
 
+    if codec is None:
+        codec = current_codec()
+
     cdef load_ctx ctx = load_ctx()
     ctx.offset = 1
     ctx.buffer = buf
     ctx.size = len(buf)
+    ctx.swap = codec.big_endian
 
     if len(buf) < 1:
         raise NBTFormatError("NBT Stream too short!")
@@ -634,6 +795,7 @@ cdef class load_ctx:
     cdef size_t offset
     cdef char * buffer
     cdef size_t size
+    cdef bint swap
 
 IF UNICODE_CACHE:
     cdef dict u_cache = dict()
@@ -663,7 +825,7 @@ cdef TAG_Short load_short(load_ctx ctx):
     cdef short * ptr = <short *> read(ctx, 2)
     cdef TAG_Short tag = TAG_Short.__new__(TAG_Short)
     tag.value = ptr[0]
-    swab(&tag.value, 2)
+    swab(&tag.value, 2, ctx.swap)
     tag.tagID = _ID_SHORT
     return tag
 
@@ -672,7 +834,7 @@ cdef TAG_Int load_int(load_ctx ctx):
     cdef int * ptr = <int *> read(ctx, 4)
     cdef TAG_Int tag = TAG_Int.__new__(TAG_Int)
     tag.value = (ptr[0])
-    swab(&tag.value, 4)
+    swab(&tag.value, 4, ctx.swap)
     tag.tagID = _ID_INT
     return tag
 
@@ -681,7 +843,7 @@ cdef TAG_Long load_long(load_ctx ctx):
     cdef long long * ptr = <long long *> read(ctx, 8)
     cdef TAG_Long tag = TAG_Long.__new__(TAG_Long)
     tag.value = ptr[0]
-    swab(&tag.value, 8)
+    swab(&tag.value, 8, ctx.swap)
     tag.tagID = _ID_LONG
     return tag
 
@@ -690,7 +852,7 @@ cdef TAG_Float load_float(load_ctx ctx):
     cdef float * ptr = <float *> read(ctx, 4)
     cdef TAG_Float tag = TAG_Float.__new__(TAG_Float)
     tag.value = ptr[0]
-    swab(&tag.value, 4)
+    swab(&tag.value, 4, ctx.swap)
     tag.tagID = _ID_FLOAT
     return tag
 
@@ -699,7 +861,7 @@ cdef TAG_Double load_double(load_ctx ctx):
     cdef double * ptr = <double *> read(ctx, 8)
     cdef TAG_Double tag = TAG_Double.__new__(TAG_Double)
     tag.value = ptr[0]
-    swab(&tag.value, 8)
+    swab(&tag.value, 8, ctx.swap)
     tag.tagID = _ID_DOUBLE
     return tag
 
@@ -732,7 +894,7 @@ cdef load_list(load_ctx ctx):
     cdef char list_type = read(ctx, 1)[0]
     cdef int * ptr = <int *> read(ctx, 4)
     cdef int length = ptr[0]
-    swab(&length, 4)
+    swab(&length, 4, ctx.swap)
 
     cdef _TAG_List tag = TAG_List(list_type=list_type)
     cdef list val = tag.value
@@ -745,7 +907,7 @@ cdef load_list(load_ctx ctx):
 cdef unicode load_string(load_ctx ctx):
     cdef unsigned short * ptr = <unsigned short *> read(ctx, 2)
     cdef unsigned short length = ptr[0]
-    swab(&length, 2)
+    swab(&length, 2, ctx.swap)
     b = read(ctx, length)
     u = PyUnicode_DecodeUTF8(b, length, "strict")
     return u
@@ -757,7 +919,7 @@ IF UNICODE_NAMES:
         """
         cdef unsigned short * ptr = <unsigned short *> read(ctx, 2)
         cdef unsigned short length = ptr[0]
-        swab(&length, 2)
+        swab(&length, 2, ctx.swap)
         b = read(ctx, length)
         IF UNICODE_CACHE:
             s = PyString_FromStringAndSize(b, length)
@@ -775,7 +937,7 @@ ELSE:
         """
         cdef unsigned short *ptr = <unsigned short *> read(ctx, 2)
         cdef unsigned short length = ptr[0]
-        swab(&length, 2)
+        swab(&length, 2, ctx.swap)
 
         return read(ctx, length)[:length]
 
@@ -784,41 +946,49 @@ ELSE:
 cdef TAG_Byte_Array load_byte_array(load_ctx ctx):
     cdef int * ptr = <int *> read(ctx, 4)
     cdef int length = ptr[0]
-    swab(&length, 4)
+    swab(&length, 4, ctx.swap)
 
     byte_length = length
     cdef char *arr = read(ctx, byte_length)
-    return TAG_Byte_Array(numpy.fromstring(arr[:byte_length], dtype=TAG_Byte_Array.dtype, count=length))
+    cdef TAG_Byte_Array tag = TAG_Byte_Array(numpy.fromstring(arr[:byte_length], dtype=TAG_Byte_Array.dtype, count=length))
+    tag._exposed = False  # nothing else holds the new array
+    return tag
 
 cdef TAG_Short_Array load_short_array(load_ctx ctx):
     cdef int * ptr = <int *> read(ctx, 4)
     cdef int length = ptr[0]
-    swab(&length, 4)
+    swab(&length, 4, ctx.swap)
 
     byte_length = length * 2
     cdef char *arr = read(ctx, byte_length)
-    dtype = '>u2' if _BIG_ENDIAN else '<u2'
-    return TAG_Short_Array(numpy.fromstring(arr[:byte_length], dtype=numpy.dtype(dtype), count=length))
+    dtype = '>u2' if ctx.swap else '<u2'
+    cdef TAG_Short_Array tag = TAG_Short_Array(numpy.fromstring(arr[:byte_length], dtype=numpy.dtype(dtype), count=length))
+    tag._exposed = False  # nothing else holds the new array
+    return tag
 
 cdef TAG_Int_Array load_int_array(load_ctx ctx):
     cdef int * ptr = <int *> read(ctx, 4)
     cdef int length = ptr[0]
-    swab(&length, 4)
+    swab(&length, 4, ctx.swap)
 
     byte_length = length * 4
     cdef char *arr = read(ctx, byte_length)
-    dtype = '>u4' if _BIG_ENDIAN else '<u4'
-    return TAG_Int_Array(numpy.fromstring(arr[:byte_length], dtype=numpy.dtype(dtype), count=length))
+    dtype = '>u4' if ctx.swap else '<u4'
+    cdef TAG_Int_Array tag = TAG_Int_Array(numpy.fromstring(arr[:byte_length], dtype=numpy.dtype(dtype), count=length))
+    tag._exposed = False  # nothing else holds the new array
+    return tag
 
 cdef TAG_Long_Array load_long_array(load_ctx ctx):
     cdef int * ptr = <int *> read(ctx, 4)
     cdef int length = ptr[0]
-    swab(&length, 4)
+    swab(&length, 4, ctx.swap)
 
     byte_length = length * 8
     cdef char *arr = read(ctx, byte_length)
-    dtype = '>q' if _BIG_ENDIAN else '<q'
-    return TAG_Long_Array(numpy.fromstring(arr[:byte_length], dtype=numpy.dtype(dtype), count=length))
+    dtype = '>q' if ctx.swap else '<q'
+    cdef TAG_Long_Array tag = TAG_Long_Array(numpy.fromstring(arr[:byte_length], dtype=numpy.dtype(dtype), count=length))
+    tag._exposed = False  # nothing else holds the new array
+    return tag
 
 
 
@@ -888,27 +1058,32 @@ cdef void save_tag_id(char tagID, object buf):
     cwrite(buf, &tagID, 1)
 
 
-cdef save_tag_name(TAG_Value tag, object buf):
+cdef save_tag_name(TAG_Value tag, object buf, bint swap):
     IF UNICODE_NAMES:
         cdef unicode name = tag.name
-        save_string(name.encode('utf-8'), buf)
+        save_string(name.encode('utf-8'), buf, swap)
     ELSE:
-        save_string(tag.name, buf)
+        save_string(tag.name, buf, swap)
 
 
-cdef void save_string(bytes value, object buf):
-    cdef short length = <short>len(value)
+cdef void save_string(bytes value, object buf, bint swap) except *:
+    # The length is unsigned, as in load_string, so strings up to 65535 bytes can be saved.
+    if len(value) > 0xffff:
+        raise ValueError("String of %d bytes is too long for NBT" % len(value))
+    cdef unsigned short length = <unsigned short>len(value)
     cdef char * s = value
-    swab(&length, 2)
+    swab(&length, 2, swap)
     cwrite(buf, <char *> &length, 2)
     cwrite(buf, s, len(value))
 
 
-cdef void save_array(object value, object buf, char size):
+cdef void save_array(object value, object buf, char size, bint swap):
+    if size > 1:
+        value = numpy.asarray(value, value.dtype.newbyteorder('>' if swap else '<'))
     value = value.tostring()
     cdef char * s = value
     cdef int length = <int>len(value) / size
-    swab(&length, 4)
+    swab(&length, 4, swap)
     cwrite(buf, <char *> &length, 4)
     cwrite(buf, s, len(value))
 
@@ -917,71 +1092,71 @@ cdef void save_byte(char value, object buf):
     cwrite(buf, <char *> &value, 1)
 
 
-cdef void save_short(short value, object buf):
-    swab(&value, 2)
+cdef void save_short(short value, object buf, bint swap):
+    swab(&value, 2, swap)
     cwrite(buf, <char *> &value, 2)
 
 
-cdef void save_int(int value, object buf):
-    swab(&value, 4)
+cdef void save_int(int value, object buf, bint swap):
+    swab(&value, 4, swap)
     cwrite(buf, <char *> &value, 4)
 
 
-cdef void save_long(long long value, object buf):
-    swab(&value, 8)
+cdef void save_long(long long value, object buf, bint swap):
+    swab(&value, 8, swap)
     cwrite(buf, <char *> &value, 8)
 
 
-cdef void save_float(float value, object buf):
-    swab(&value, 4)
+cdef void save_float(float value, object buf, bint swap):
+    swab(&value, 4, swap)
     cwrite(buf, <char *> &value, 4)
 
 
-cdef void save_double(double value, object buf):
-    swab(&value, 8)
+cdef void save_double(double value, object buf, bint swap):
+    swab(&value, 8, swap)
     cwrite(buf, <char *> &value, 8)
 
 
-cdef void save_tag_value(TAG_Value tag, object buf):
+cdef void save_tag_value(TAG_Value tag, object buf, bint swap) except *:
     cdef char tagID = tag.tagID
     if tagID == _ID_BYTE:
-        (<TAG_Byte> tag).save_value(buf)
+        (<TAG_Byte> tag).save_value(buf, swap)
 
     if tagID == _ID_SHORT:
-        (<TAG_Short> tag).save_value(buf)
+        (<TAG_Short> tag).save_value(buf, swap)
 
     if tagID == _ID_INT:
-        (<TAG_Int> tag).save_value(buf)
+        (<TAG_Int> tag).save_value(buf, swap)
 
     if tagID == _ID_LONG:
-        (<TAG_Long> tag).save_value(buf)
+        (<TAG_Long> tag).save_value(buf, swap)
 
     if tagID == _ID_FLOAT:
-        (<TAG_Float> tag).save_value(buf)
+        (<TAG_Float> tag).save_value(buf, swap)
 
     if tagID == _ID_DOUBLE:
-        (<TAG_Double> tag).save_value(buf)
+        (<TAG_Double> tag).save_value(buf, swap)
 
     if tagID == _ID_BYTE_ARRAY:
-        (<TAG_Byte_Array> tag).save_value(buf)
+        (<TAG_Byte_Array> tag).save_value(buf, swap)
 
     if tagID == _ID_STRING:
-        (<TAG_String> tag).save_value(buf)
+        (<TAG_String> tag).save_value(buf, swap)
 
     if tagID == _ID_LIST:
-        (<_TAG_List> tag).save_value(buf)
+        (<_TAG_List> tag).save_value(buf, swap)
 
     if tagID == _ID_COMPOUND:
-        (<_TAG_Compound> tag).save_value(buf)
+        (<_TAG_Compound> tag).save_value(buf, swap)
 
     if tagID == _ID_INT_ARRAY:
-        (<TAG_Int_Array> tag).save_value(buf)
+        (<TAG_Int_Array> tag).save_value(buf, swap)
 
     if tagID == _ID_LONG_ARRAY:
-        (<TAG_Long_Array> tag).save_value(buf)
+        (<TAG_Long_Array> tag).save_value(buf, swap)
 
     if tagID == _ID_SHORT_ARRAY:
-        (<TAG_Short_Array> tag).save_value(buf)
+        (<TAG_Short_Array> tag).save_value(buf, swap)
 
 
 tag_classes = {TAG().tagID: TAG for TAG in (TAG_Byte, TAG_Short, TAG_Int, TAG_Long, TAG_Float, TAG_Double, TAG_String,
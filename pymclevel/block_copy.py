@@ -8,7 +8,7 @@ from box import BoundingBox
 from mclevelbase import exhaust
 import materials
 from entity import Entity, TileEntity
-from copy import deepcopy
+import nbt
 
 
 def convertBlocks(destLevel, sourceLevel, blocks, blockData):
@@ -46,11 +46,127 @@ def adjustCopyParameters(destLevel, sourceLevel, sourceBox, destinationPoint):
     return actualSourceBox, actualDestPoint
 
 
+def isChunkAlignedCopy(destLevel, sourceLevel, sourceBox, copyOffset, blocksToCopy):
+    """ Returns True if the copy moves whole chunk columns by whole chunks between levels that store blocks the
+    same way, so each chunk's tag data can be moved without decoding its blocks. """
+    if blocksToCopy is not None:
+        return False
+    if not (hasattr(sourceLevel, "getChunkTagData") and hasattr(destLevel, "replaceChunkTagData")):
+        return False
+    if sourceLevel.materials != destLevel.materials or sourceLevel.Height != destLevel.Height:
+        return False
+    if sourceBox.miny > 0 or sourceBox.maxy < sourceLevel.Height or copyOffset[1] != 0:
+        return False
+    if any(c & 0xf for c in (sourceBox.minx, sourceBox.minz, sourceBox.maxx, sourceBox.maxz, copyOffset[0], copyOffset[2])):
+        return False
+    destBox = BoundingBox([s + o for s, o in zip(sourceBox.origin, copyOffset)], sourceBox.size)
+    if sourceLevel is destLevel and destBox.intersect(sourceBox).volume:
+        return False
+    return True
+
+
+def copyChunkTag(destLevel, sourceLevel, srcCpos, destCpos, sourceBox, copyOffset, entities, biomes, staticCommands,
+                 moveSpawnerPos, regenerateUUID, first, cancelCommandBlockOffset, needsLighting):
+    """ Moves the chunk at srcCpos in sourceLevel to destCpos in destLevel as tag data, rewriting only the
+    positions of its entities, tile entities and tile ticks. Returns the number of each copied, or None if
+    the destination chunk is in use. """
+    root_tag = nbt.load(buf=sourceLevel.getChunkTagData(*srcCpos))
+    levelTag = root_tag["Level"]
+    levelTag["xPos"] = nbt.TAG_Int(destCpos[0])
+    levelTag["zPos"] = nbt.TAG_Int(destCpos[1])
+
+    destLevelTag = None
+    if not (entities and biomes) and destLevel.containsChunk(*destCpos):
+        destLevelTag = nbt.load(buf=destLevel.getChunkTagData(*destCpos))["Level"]
+
+    if entities:
+        ents = [Entity.copyWithOffset(entityTag, copyOffset, regenerateUUID)
+                for entityTag in levelTag.get("Entities", ()) if Entity.pos(entityTag) in sourceBox]
+        levelTag["Entities"] = nbt.TAG_List(ents)
+    else:
+        ents = []
+        levelTag["Entities"] = destLevelTag["Entities"] if destLevelTag is not None else nbt.TAG_List()
+
+    if not biomes:
+        if destLevelTag is not None and "Biomes" in destLevelTag:
+            levelTag["Biomes"] = destLevelTag["Biomes"]
+        elif "Biomes" in levelTag:
+            del levelTag["Biomes"]
+
+    tileEntities = [TileEntity.copyWithOffset(tileEntityTag, copyOffset, staticCommands, moveSpawnerPos, first, cancelCommandBlockOffset)
+                    for tileEntityTag in levelTag.get("TileEntities", ()) if TileEntity.pos(tileEntityTag) in sourceBox]
+    levelTag["TileEntities"] = nbt.TAG_List(tileEntities)
+
+    tileTicksList = []
+    for tileTick in levelTag.get("TileTicks", ()):
+        eTag = tileTick.copy()
+        eTag['x'].value = tileTick['x'].value + copyOffset[0]
+        eTag['z'].value = tileTick['z'].value + copyOffset[2]
+        tileTicksList.append(eTag)
+    levelTag["TileTicks"] = nbt.TAG_List(tileTicksList)
+
+    if not destLevel.replaceChunkTagData(destCpos[0], destCpos[1], root_tag.save(compressed=False), needsLighting):
+        return None
+    return len(ents), len(tileEntities), len(tileTicksList)
+
+
+def planCopy(destLevel, sourceLevel, sourceBox, copyOffset, create=False, sourceChunkPositions=None):
+    """ Splits the part of each source chunk within sourceBox into the pieces that land in
+    different destination chunks.
+
+    Returns a list of (sourceCpos, pieces) in source chunk order, where pieces is a list of
+    (destCpos, sourcePieceBox), and a dict counting the pieces each destination chunk receives.
+    Source chunks missing from sourceLevel are left out, as are pieces whose destination chunk
+    is missing and not to be created. If sourceChunkPositions is given, only those source chunks
+    are planned.
+    """
+    if sourceChunkPositions is None:
+        sourceChunkPositions = sourceBox.chunkPositions
+
+    plan = []
+    pieceCounts = {}
+    for srcCpos in sorted(sourceChunkPositions):
+        if not sourceLevel.containsChunk(*srcCpos):
+            continue
+
+        scx, scz = srcCpos
+        sourceChunkBox = BoundingBox((scx << 4, sourceBox.miny, scz << 4), (16, sourceBox.height, 16)).intersect(sourceBox)
+        sourceChunkBoxInDestLevel = BoundingBox([s + o for o, s in zip(copyOffset, sourceChunkBox.origin)],
+                                                sourceChunkBox.size)
+
+        pieces = []
+        for destCpos in sourceChunkBoxInDestLevel.chunkPositions:
+            if not (create or destLevel.containsChunk(*destCpos)):
+                continue
+
+            cx, cz = destCpos
+            destPiece = BoundingBox((cx << 4, sourceChunkBoxInDestLevel.miny, cz << 4),
+                                    (16, sourceChunkBoxInDestLevel.height, 16)).intersect(sourceChunkBoxInDestLevel)
+            if destPiece.volume == 0:
+                continue
+
+            pieces.append((destCpos, BoundingBox([d - o for o, d in zip(copyOffset, destPiece.origin)], destPiece.size)))
+            pieceCounts[destCpos] = pieceCounts.get(destCpos, 0) + 1
+
+        if pieces:
+            plan.append((srcCpos, pieces))
+
+    return plan, pieceCounts
+
+
 def copyBlocksFromIter(destLevel, sourceLevel, sourceBox, destinationPoint, blocksToCopy=None, entities=True,
-                       create=False, biomes=False, tileTicks=True, staticCommands=False, moveSpawnerPos=False, regenerateUUID=False, first=False, cancelCommandBlockOffset=False):
+                       create=False, biomes=False, tileTicks=True, staticCommands=False, moveSpawnerPos=False, regenerateUUID=False, first=False, cancelCommandBlockOffset=False,
+                       boxLighting=False):
     """ copy blocks between two infinite levels by looping through the
-    destination's chunks. make a sub-box of the source level for each chunk
-    and copy block and entities in the sub box to the dest chunk."""
+    source's chunks. each source chunk is read once and split into the pieces
+    that land in different destination chunks. destination chunks are held
+    until every piece copied into them is done.
+
+    If whole chunk columns are moved by whole chunks (see isChunkAlignedCopy),
+    the chunks are moved as tag data without decoding their blocks.
+
+    If boxLighting is True, the destination box is relit with generateLightsInBoxes
+    once the copy is done, instead of flagging every changed chunk for a full relight."""
 
     (lx, ly, lz) = sourceBox.size
 
@@ -69,44 +185,55 @@ def copyBlocksFromIter(destLevel, sourceLevel, sourceBox, destinationPoint, bloc
 
     copyOffset = [d - s for s, d in zip(sourceBox.origin, destinationPoint)]
 
-    # Visit each chunk in the destination area.
-    # Get the region of the source area corresponding to that chunk
-    #   Visit each chunk of the region of the source area
+    # Visit each chunk in the source area.
+    #   Visit each piece of it that lands in a different destination chunk
     #     Get the slices of the destination chunk
     #     Get the slices of the source chunk
     #     Copy blocks and data
-
-    for destCpos in destBox.chunkPositions:
-        cx, cz = destCpos
-
-        destChunkBox = BoundingBox((cx << 4, 0, cz << 4), (16, destLevel.Height, 16)).intersect(destBox)
-        destChunkBoxInSourceLevel = BoundingBox([d - o for o, d in zip(copyOffset, destChunkBox.origin)],
-                                                destChunkBox.size)
-
-        if not destLevel.containsChunk(*destCpos):
-            if create and any(sourceLevel.containsChunk(*c) for c in destChunkBoxInSourceLevel.chunkPositions):
-                # Only create chunks in the destination level if the source level has chunks covering them.
-                destLevel.createChunk(*destCpos)
-            else:
+    #   Copy the entities of the source chunk
+    #   Commit the destination chunks that received all of their pieces
+
+    sourceChunkPositions = None
+    if isChunkAlignedCopy(destLevel, sourceLevel, sourceBox, copyOffset, blocksToCopy):
+        log.info(u"Chunk aligned copy. Moving chunk tags.")
+        # Chunks in use in the destination level are copied block by block below.
+        sourceChunkPositions = []
+        for srcCpos in sorted(sourceBox.chunkPositions):
+            if not sourceLevel.containsChunk(*srcCpos):
+                continue
+            destCpos = (srcCpos[0] + (copyOffset[0] >> 4), srcCpos[1] + (copyOffset[2] >> 4))
+            if not (create or destLevel.containsChunk(*destCpos)):
                 continue
 
-        destChunk = destLevel.getChunk(*destCpos)
+            copied = copyChunkTag(destLevel, sourceLevel, srcCpos, destCpos, sourceBox, copyOffset, entities, biomes,
+                                  staticCommands, moveSpawnerPos, regenerateUUID, first, cancelCommandBlockOffset,
+                                  not boxLighting)
+            if copied is None:
+                sourceChunkPositions.append(srcCpos)
+                continue
 
-        i += 1
-        yield (i, chunkCount)
-        if i % 100 == 0:
-            log.info("Chunk {0}...".format(i))
+            e += copied[0]
+            t += copied[1]
+            tt += copied[2]
+            i += 1
+            yield (i, chunkCount)
+            if i % 100 == 0:
+                log.info("Chunk {0}...".format(i))
 
-        for srcCpos in destChunkBoxInSourceLevel.chunkPositions:
-            if not sourceLevel.containsChunk(*srcCpos):
-                continue
+    plan, pieceCounts = planCopy(destLevel, sourceLevel, sourceBox, copyOffset, create, sourceChunkPositions)
+    destChunks = {}
 
-            sourceChunk = sourceLevel.getChunk(*srcCpos)
+    for srcCpos, pieces in plan:
+        sourceChunk = sourceLevel.getChunk(*srcCpos)
 
-            sourceChunkBox, sourceSlices = sourceChunk.getChunkSlicesForBox(destChunkBoxInSourceLevel)
-            if sourceChunkBox.volume == 0:
-                continue
+        for destCpos, sourcePieceBox in pieces:
+            destChunk = destChunks.get(destCpos)
+            if destChunk is None:
+                if not destLevel.containsChunk(*destCpos):
+                    destLevel.createChunk(*destCpos)
+                destChunk = destChunks[destCpos] = destLevel.getChunk(*destCpos)
 
+            sourceChunkBox, sourceSlices = sourceChunk.getChunkSlicesForBox(sourcePieceBox)
             sourceChunkBoxInDestLevel = BoundingBox([d + o for o, d in zip(copyOffset, sourceChunkBox.origin)],
                                                     sourceChunkBox.size)
 
@@ -131,45 +258,59 @@ def copyBlocksFromIter(destLevel, sourceLevel, sourceBox, destinationPoint, bloc
 
             if entities:
                 destChunk.removeEntities(copy)
-
-                ents = sourceChunk.getEntitiesInBox(destChunkBoxInSourceLevel)
-                e += len(ents)
-                for entityTag in ents:
-                    eTag = Entity.copyWithOffset(entityTag, copyOffset, regenerateUUID)
-                    destLevel.addEntity(eTag)
-
             destChunk.removeTileEntities(copy)
-
-            tileEntities = sourceChunk.getTileEntitiesInBox(destChunkBoxInSourceLevel)
-            t += len(tileEntities)
-            for tileEntityTag in tileEntities:
-                eTag = TileEntity.copyWithOffset(tileEntityTag, copyOffset, staticCommands, moveSpawnerPos, first, cancelCommandBlockOffset)
-                destLevel.addTileEntity(eTag)
-
             destChunk.removeTileTicks(copy)
 
-            tileTicksList = sourceChunk.getTileTicksInBox(destChunkBoxInSourceLevel)
-            tt += len(tileTicksList)
-            for tileTick in tileTicksList:
-                eTag = deepcopy(tileTick)
-                eTag['x'].value = tileTick['x'].value + copyOffset[0]
-                eTag['y'].value = tileTick['y'].value + copyOffset[1]
-                eTag['z'].value = tileTick['z'].value + copyOffset[2]
-                destLevel.addTileTick(eTag)
-
             if biomes and hasattr(destChunk, 'Biomes') and hasattr(sourceChunk, 'Biomes'):
                 destChunk.Biomes[destSlices[:2]] = sourceChunk.Biomes[sourceSlices[:2]]
 
-        destChunk.chunkChanged()
+        if entities:
+            ents = sourceChunk.getEntitiesInBox(sourceBox)
+            e += len(ents)
+            for entityTag in ents:
+                eTag = Entity.copyWithOffset(entityTag, copyOffset, regenerateUUID)
+                destLevel.addEntity(eTag)
+
+        tileEntities = sourceChunk.getTileEntitiesInBox(sourceBox)
+        t += len(tileEntities)
+        destLevel.addTileEntities([TileEntity.copyWithOffset(tileEntityTag, copyOffset, staticCommands, moveSpawnerPos,
+                                                             first, cancelCommandBlockOffset)
+                                   for tileEntityTag in tileEntities])
+
+        tileTicksList = sourceChunk.getTileTicksInBox(sourceBox)
+        tt += len(tileTicksList)
+        newTileTicks = []
+        for tileTick in tileTicksList:
+            eTag = tileTick.copy()
+            eTag['x'].value = tileTick['x'].value + copyOffset[0]
+            eTag['y'].value = tileTick['y'].value + copyOffset[1]
+            eTag['z'].value = tileTick['z'].value + copyOffset[2]
+            newTileTicks.append(eTag)
+        destLevel.addTileTicks(newTileTicks)
+
+        for destCpos, _ in pieces:
+            pieceCounts[destCpos] -= 1
+            if pieceCounts[destCpos] == 0:
+                destChunks.pop(destCpos).chunkChanged(not boxLighting)
+
+                i += 1
+                yield (i, chunkCount)
+                if i % 100 == 0:
+                    log.info("Chunk {0}...".format(i))
+
+    if boxLighting:
+        destLevel.generateLightsInBoxes([destBox])
 
     log.info("Duration: {0}".format(datetime.now() - startTime))
     log.info("Copied {0} entities and {1} tile entities and {2} tile ticks".format(e, t, tt))
 
 
 def copyBlocksFrom(destLevel, sourceLevel, sourceBox, destinationPoint, blocksToCopy=None, entities=True, create=False,
-                   biomes=False, tileTicks=True, staticCommands=False, moveSpawnerPos=False, first=False, cancelCommandBlockOffset=False):
+                   biomes=False, tileTicks=True, staticCommands=False, moveSpawnerPos=False, first=False, cancelCommandBlockOffset=False,
+                   boxLighting=False):
     return exhaust(
-        copyBlocksFromIter(destLevel, sourceLevel, sourceBox, destinationPoint, blocksToCopy, entities, create, biomes, tileTicks,staticCommands, moveSpawnerPos,first, cancelCommandBlockOffset))
+        copyBlocksFromIter(destLevel, sourceLevel, sourceBox, destinationPoint, blocksToCopy, entities, create, biomes, tileTicks,staticCommands, moveSpawnerPos,first, cancelCommandBlockOffset,
+                           boxLighting=boxLighting))
 
 
 
@@ -18,11 +18,46 @@ def blockReplaceTable(blocksToReplace):
     return blocktable
 
 
-def fillBlocks(level, box, blockInfo, blocksToReplace=(), noData=False):
-    return exhaust(level.fillBlocksIter(box, blockInfo, blocksToReplace, noData=noData))
+def tileEntitiesForMask(template, chunk, slices, mask, shape):
+    """ Returns a copy of template positioned at each block of chunk[slices] selected by mask. """
+    selected = numpy.zeros(shape, dtype='bool')
+    selected[mask] = True
+    xs, zs, ys = selected.nonzero()
+
+    cx, cz = chunk.chunkPosition
+    xs += (cx << 4) + slices[0].start
+    zs += (cz << 4) + slices[1].start
+    ys += slices[2].start
+
+    tileEntities = []
+    for pos in zip(xs.tolist(), ys.tolist(), zs.tolist()):
+        tileEntity = template.copy()
+        TileEntity.setpos(tileEntity, pos)
+        tileEntities.append(tileEntity)
+    return tileEntities
+
+
+def tileEntityTemplateFor(level, blockInfo):
+    """ Returns a new tile entity for blockInfo, or None if it has none. """
+    tileEntity = None
+    if blockInfo.stringID in TileEntity.stringNames.keys():
+        split_ver = level.gameVersion.split('.')
+        if 'Unknown' not in split_ver and "PE" not in split_ver and int(split_ver[0]) >= 1 and int(split_ver[1]) >= 11:
+            tileEntity = "minecraft:{}".format(blockInfo.stringID)
+        else:
+            tileEntity = TileEntity.stringNames[blockInfo.stringID]
+
+    if tileEntity:
+        return TileEntity.Create(tileEntity, defsIds=level.defsIds)
 
 
-def fillBlocksIter(level, box, blockInfo, blocksToReplace=(), noData=False):
+def fillBlocks(level, box, blockInfo, blocksToReplace=(), noData=False, boxLighting=False):
+    return exhaust(level.fillBlocksIter(box, blockInfo, blocksToReplace, noData=noData, boxLighting=boxLighting))
+
+
+def fillBlocksIter(level, box, blockInfo, blocksToReplace=(), noData=False, boxLighting=False):
+    """ If boxLighting is True, the filled box is relit with generateLightsInBoxes once the fill is
+    done, instead of flagging every changed chunk for a full relight. """
     if box is None:
         chunkIterator = level.getAllChunkSlices()
         box = level.bounds
@@ -49,29 +84,12 @@ def fillBlocksIter(level, box, blockInfo, blocksToReplace=(), noData=False):
             if a != newEmission:
                 changesLighting = True
 
-    tileEntity = None
-    if blockInfo.stringID in TileEntity.stringNames.keys():
-        split_ver = level.gameVersion.split('.')
-        if 'Unknown' not in split_ver and "PE" not in split_ver and int(split_ver[0]) >= 1 and int(split_ver[1]) >= 11:
-            tileEntity = "minecraft:{}".format(blockInfo.stringID)
-        else:
-            tileEntity = TileEntity.stringNames[blockInfo.stringID]
-
-    blocksIdToReplace = [block.ID for block in blocksToReplace]
-
-    blocksList = []
-    append = blocksList.append
-    defsIds = level.defsIds
-    if tileEntity and box is not None:
-        for (boxX, boxY, boxZ) in box.positions:
-            if blocktable is None or level.blockAt(boxX, boxY, boxZ) in blocksIdToReplace:
-                tileEntityObject = TileEntity.Create(tileEntity, defsIds=defsIds)
-                TileEntity.setpos(tileEntityObject, (boxX, boxY, boxZ))
-                append(tileEntityObject)
+    tileEntityTemplate = tileEntityTemplateFor(level, blockInfo)
 
     i = 0
     skipped = 0
     replaced = 0
+    relight = False
 
     for (chunk, slices, point) in chunkIterator:
         i += 1
@@ -113,15 +131,116 @@ def fillBlocksIter(level, box, blockInfo, blocksToReplace=(), noData=False):
                 data[:] = blockInfo.blockData
             chunk.removeTileEntitiesInBox(box)
 
-        chunkBounds = chunk.bounds
-        smallBoxSize = (1, 1, 1)
-        tileEntitiesToEdit = [t for t in blocksList if chunkBounds.intersect(BoundingBox(TileEntity.pos(t), smallBoxSize)).volume > 0]
+        if tileEntityTemplate is not None:
+            # The tile entities of the replaced blocks were removed above, so the new ones are
+            # appended without looking for duplicates.
+            chunk.TileEntities.extend(tileEntitiesForMask(tileEntityTemplate, chunk, slices, mask, blocks.shape))
 
-        for tileEntityObject in tileEntitiesToEdit:
-            chunk.addTileEntity(tileEntityObject)
-            blocksList.remove(tileEntityObject)
-        
-        chunk.chunkChanged(needsLighting)
+        chunk.chunkChanged(needsLighting and not boxLighting)
+        relight = relight or needsLighting
 
     if len(blocksToReplace):
         log.info(u"Replace: Skipped {0} chunks, replaced {1} blocks".format(skipped, replaced))
+
+    if boxLighting and relight:
+        level.generateLightsInBoxes([box])
+
+
+def blockRemapTable(mapping=(), noData=False):
+    """ Returns a (id_limit, 16) table holding ID << 4 | data for each (ID, data) pair, mapping every
+    block to itself except the source of each (source, dest) pair of blocks in mapping, which maps to
+    dest. With noData, only the IDs are remapped. """
+    table = numpy.arange(materials.id_limit * 16, dtype='uint16').reshape(materials.id_limit, 16)
+    for source, dest in mapping:
+        table[source.ID, source.blockData] = dest.ID << 4 | (source.blockData if noData else dest.blockData)
+    return table
+
+
+def remapBlocks(level, box, table, boxLighting=False):
+    changedCounts = {}
+    exhaust(level.remapBlocksIter(box, table, boxLighting=boxLighting, changedCounts=changedCounts))
+    return changedCounts
+
+
+def remapBlocksIter(level, box, table, boxLighting=False, changedCounts=None):
+    """ Replaces every block in box with the block the table from blockRemapTable maps it to, with
+    one lookup per chunk however many blocks are remapped. The number of blocks changed in each chunk
+    is stored in changedCounts, if given, by chunk position.
+
+    Only chunks where a block was changed to one absorbing or emitting a different amount of light
+    are relit. If boxLighting is True, the changed parts of those chunks are relit with
+    generateLightsInBoxes once the remap is done, instead of flagging the chunks for a full relight.
+    """
+    if box is None:
+        chunkIterator = level.getAllChunkSlices()
+        box = level.bounds
+    else:
+        chunkIterator = level.getChunkSlices(box)
+
+    lookup = table.ravel()
+    ids = numpy.arange(materials.id_limit)[:, numpy.newaxis]
+    newIDs = table >> 4
+    absorption = level.materials.lightAbsorption
+    emission = level.materials.lightEmission
+    # True for each (ID, data) pair remapped to a block with different lighting
+    relightTable = ((absorption[newIDs] != absorption[ids]) | (emission[newIDs] != emission[ids])).ravel()
+    changesLighting = relightTable.any()
+
+    templates = {}
+    for newID in numpy.unique(newIDs[newIDs != ids]):
+        template = tileEntityTemplateFor(level, level.materials.blockWithID(newID))
+        if template is not None:
+            templates[newID] = template
+
+    i = 0
+    replaced = 0
+    relightBoxes = []
+
+    for (chunk, slices, point) in chunkIterator:
+        i += 1
+        if i % 100 == 0:
+            log.info(u"Chunk {0}...".format(i))
+        yield i, box.chunkCount
+
+        blocks = chunk.Blocks[slices]
+        data = chunk.Data[slices]
+
+        keys = blocks.astype('uint16') << 4
+        keys |= data
+        remapped = lookup[keys]
+        changed = remapped != keys
+
+        blockCount = numpy.count_nonzero(changed)
+        if changedCounts is not None:
+            changedCounts[chunk.chunkPosition] = blockCount
+        if not blockCount:
+            continue
+        replaced += blockCount
+
+        newBlocks = remapped >> 4
+        idChanged = newBlocks != blocks
+        blocks[:] = newBlocks
+        data[:] = remapped & 0xf
+
+        if idChanged.any():
+            def include(tileEntity):
+                p = TileEntity.pos(tileEntity)
+                x, y, z = map(lambda a, b, c: (a - b) - c, p, point, box.origin)
+                return not ((p in box) and idChanged[x, z, y])
+
+            chunk.TileEntities[:] = filter(include, chunk.TileEntities)
+
+            for newID, template in templates.iteritems():
+                mask = idChanged & (newBlocks == newID)
+                chunk.TileEntities.extend(tileEntitiesForMask(template, chunk, slices, mask, blocks.shape))
+
+        needsLighting = changesLighting and relightTable[keys[changed]].any()
+        chunk.chunkChanged(needsLighting and not boxLighting)
+        if needsLighting:
+            cx, cz = chunk.chunkPosition
+            relightBoxes.append(box.intersect(BoundingBox((cx << 4, box.miny, cz << 4), (16, box.height, 16))))
+
+    log.info(u"Remap: replaced {0} blocks, {1} chunks need relighting".format(replaced, len(relightBoxes)))
+
+    if boxLighting and relightBoxes:
+        level.generateLightsInBoxes(relightBoxes)
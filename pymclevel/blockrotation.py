@@ -934,36 +934,72 @@ def rotationTypeTable():
     return table
 
 
+# masterRotationTable evaluates every rotation class's blocktypes, so the tables are built once and shared.
+_rotationTables = {}
+
+
+def rotationTable(attrname):
+    table = _rotationTables.get(attrname)
+    if table is None:
+        table = _rotationTables[attrname] = masterRotationTable(attrname)
+    return table
+
+
+_composedTables = {}
+
+
+def composedRotationTable(transforms):
+    """ Returns a materials.id_limitx16 table mapping each blocktype/data combination to the data that results
+    from applying each of transforms in turn. transforms is a sequence of the names of the rotation tables:
+    "rotateLeft", "roll", "flipVertical", "flipNorthSouth" and "flipEastWest". """
+    transforms = tuple(transforms)
+    table = _composedTables.get(transforms)
+    if table is None:
+        table = zeros((materials.id_limit, 16), dtype='uint8')
+        table[:] = arange(16, dtype='uint8')
+        blocktypes = arange(materials.id_limit)[:, None]
+        for attrname in transforms:
+            table = rotationTable(attrname)[blocktypes, table]
+        _composedTables[transforms] = table
+    return table
+
+
 class BlockRotation:
     def __init__(self):
-        self.rotateLeft = masterRotationTable("rotateLeft")
-        self.flipEastWest = masterRotationTable("flipEastWest")
-        self.flipNorthSouth = masterRotationTable("flipNorthSouth")
-        self.flipVertical = masterRotationTable("flipVertical")
-        self.roll = masterRotationTable("roll")
+        self.rotateLeft = rotationTable("rotateLeft")
+        self.flipEastWest = rotationTable("flipEastWest")
+        self.flipNorthSouth = rotationTable("flipNorthSouth")
+        self.flipVertical = rotationTable("flipVertical")
+        self.roll = rotationTable("roll")
         self.typeTable = rotationTypeTable()
 
 
 def SameRotationType(blocktype1, blocktype2):
     # use different default values for typeTable.get() to make it return false when neither blocktype is present
-    return BlockRotation().typeTable.get(blocktype1.ID) == BlockRotation().typeTable.get(blocktype2.ID, BlockRotation())
+    typeTable = rotationTypeTable()
+    return typeTable.get(blocktype1.ID) == typeTable.get(blocktype2.ID, BlockRotation)
+
+
+def Transform(blocks, data, transforms):
+    """ Applies the sequence of rotations and flips named by transforms to data with a single lookup. """
+    data[:] = composedRotationTable(transforms)[blocks, data]
 
 
 def FlipVertical(blocks, data):
-    data[:] = BlockRotation().flipVertical[blocks, data]
+    data[:] = rotationTable("flipVertical")[blocks, data]
 
 
 def FlipNorthSouth(blocks, data):
-    data[:] = BlockRotation().flipNorthSouth[blocks, data]
+    data[:] = rotationTable("flipNorthSouth")[blocks, data]
 
 
 def FlipEastWest(blocks, data):
-    data[:] = BlockRotation().flipEastWest[blocks, data]
+    data[:] = rotationTable("flipEastWest")[blocks, data]
 
 
 def RotateLeft(blocks, data):
-    data[:] = BlockRotation().rotateLeft[blocks, data]
+    data[:] = rotationTable("rotateLeft")[blocks, data]
 
 
 def Roll(blocks, data):
-    data[:] = BlockRotation().roll[blocks, data]
+    data[:] = rotationTable("roll")[blocks, data]
@@ -2,16 +2,42 @@
 Created on Jul 23, 2011
 @author: Rio
 '''
+from collections import deque
 from math import isnan
 
 import random
 import nbt
-from copy import deepcopy
 
 __all__ = ["Entity", "TileEntity", "TileTick"]
 
 UNKNOWN_ENTITY_MASK = 1000
 
+# Ids of the latest tags moved by setpos, so an EntityIndex can tell whether any of its tags moved since it was
+# built. Indexes older than the moves kept here are rebuilt.
+MOVED_TAGS_LIMIT = 4096
+_movedTags = deque(maxlen=MOVED_TAGS_LIMIT)
+_movedTagCount = 0
+
+
+def _tagMoved(tag):
+    global _movedTagCount
+    _movedTags.append(id(tag))
+    _movedTagCount += 1
+
+
+def movedTagCount():
+    """ The number of times setpos has been called. """
+    return _movedTagCount
+
+
+def tagsMovedSince(count):
+    """ Returns the ids of the tags moved by setpos since movedTagCount() returned count, or None if they are
+    no longer all known. """
+    moves = _movedTagCount - count
+    if moves > len(_movedTags):
+        return None
+    return list(_movedTags)[len(_movedTags) - moves:]
+
 
 class TileEntity(object):
     baseStructures = {
@@ -183,7 +209,7 @@ class TileEntity(object):
                         tileEntityTag["SpawnData"] = tag()
                         if entity:
                             for k, v in entity.iteritems():
-                                tileEntityTag["SpawnData"][k] = deepcopy(v)
+                                tileEntityTag["SpawnData"][k] = v.copy()
                         else:
                             tileEntityTag["SpawnData"].add(spawn_id)
                 elif tileEntityID == "Bed":
@@ -201,6 +227,7 @@ class TileEntity(object):
     def setpos(cls, tag, pos):
         for a, p in zip('xyz', pos):
             tag[a] = nbt.TAG_Int(p)
+        _tagMoved(tag)
 
     @classmethod
     def copyWithOffset(cls, tileEntity, copyOffset, staticCommands, moveSpawnerPos, first, cancelCommandBlockOffset=False, defsIds=None):
@@ -212,7 +239,7 @@ class TileEntity(object):
             from pymclevel import MCEDIT_IDS
         else:
             MCEDIT_IDS = defsIds.mcedit_ids
-        eTag = deepcopy(tileEntity)
+        eTag = tileEntity.copy()
         eTag['x'] = nbt.TAG_Int(tileEntity['x'].value + copyOffset[0])
         eTag['y'] = nbt.TAG_Int(tileEntity['y'].value + copyOffset[1])
         eTag['z'] = nbt.TAG_Int(tileEntity['z'].value + copyOffset[2])
@@ -649,10 +676,11 @@ class Entity(object):
     @classmethod
     def setpos(cls, tag, pos):
         tag["Pos"] = nbt.TAG_List([nbt.TAG_Double(p) for p in pos])
+        _tagMoved(tag)
 
     @classmethod
     def copyWithOffset(cls, entity, copyOffset, regenerateUUID=False):
-        eTag = deepcopy(entity)
+        eTag = entity.copy()
 
         # Need to check the content of the copy to regenerate the possible sub entities UUIDs.
         # A simple fix for the 1.9+ minecarts is proposed.
@@ -23,6 +23,7 @@ from box import BoundingBox
 from entity import Entity, TileEntity, TileTick
 from faces import FaceXDecreasing, FaceXIncreasing, FaceZDecreasing, FaceZIncreasing
 from level import LightedChunk, EntityLevel, computeChunkHeightMap, MCLevel, ChunkBase
+import lighting
 from materials import alphaMaterials
 from mclevelbase import ChunkMalformed, ChunkNotPresent, ChunkAccessDenied,ChunkConcurrentException,exhaust, PlayerNotFound
 import nbt
@@ -114,6 +115,8 @@ class AnvilChunkData(object):
         self.world = world
         self.root_tag = root_tag
         self.dirty = False
+        # EntityIndexes of the chunk's tag lists, kept here so they outlive the AnvilChunk
+        self.entityIndexes = None
 
         self.Blocks = zeros((16, 16, world.Height), 'uint16')
         self.Data = zeros((16, 16, world.Height), 'uint8')
@@ -302,6 +305,14 @@ class AnvilChunk(LightedChunk):
         self.dirty = True
         return super(AnvilChunk, self).addTileTick(tickTag)
 
+    def addTileTicks(self, tileTicks):
+        self.dirty = True
+        return super(AnvilChunk, self).addTileTicks(tileTicks)
+
+    def addTileEntities(self, tileEntities):
+        self.dirty = True
+        return super(AnvilChunk, self).addTileEntities(tileEntities)
+
     def removeTileTicksInBox(self, box):
         self.dirty = True
         return super(AnvilChunk, self).removeTileTicksInBox(box)
@@ -354,6 +365,14 @@ class AnvilChunk(LightedChunk):
     def HeightMap(self):
         return self.root_tag["Level"]["HeightMap"].value.reshape((16, 16))
 
+    @property
+    def _entityIndexes(self):
+        return self.chunkData.entityIndexes
+
+    @_entityIndexes.setter
+    def _entityIndexes(self, value):
+        self.chunkData.entityIndexes = value
+
     @property
     def Entities(self):
         return self.root_tag["Level"]["Entities"]
@@ -605,12 +624,48 @@ class ChunkedLevelMixin(MCLevel):
 
     createChunk = NotImplemented
 
-    def generateLights(self, dirtyChunkPositions=None):
-        return exhaust(self.generateLightsIter(dirtyChunkPositions))
+    # "classic" disperses light chunk by chunk, "stitched" lights whole regions of chunks at once and
+    # "parallel" lights regions in worker processes (MCInfdevOldLevel only). See lighting.py
+    lightingEngine = "classic"
+    # number of worker processes for the parallel engine, or None for one per CPU
+    lightingProcesses = None
+
+    def generateLights(self, dirtyChunkPositions=None, engine=None):
+        return exhaust(self.generateLightsIter(dirtyChunkPositions, engine))
+
+    def generateLightsInBoxes(self, boxes):
+        return exhaust(self.generateLightsInBoxesIter(boxes))
+
+    def generateLightsInBoxesIter(self, boxes):
+        """ Relights only the blocks within 15 blocks of the given boxes, keeping the light
+        stored everywhere else. Blocks changed within the boxes should be committed with
+        chunkChanged(False) so their chunks are not flagged for a full relight.
+        """
+        return lighting.boxLightsIter(self, boxes)
+
+    # boxes waiting to be relit by generatePendingLightsIter. See queueLighting
+    pendingLightingBoxes = ()
+
+    def queueLighting(self, box):
+        """ Queues the blocks within 15 blocks of box to be relit later by generatePendingLightsIter.
+        Boxes overlapping an already queued box are merged with it, so an area changed by several
+        edits in a row is only relit once.
+        """
+        if box is not None and box.volume:
+            self.pendingLightingBoxes = lighting.mergeBoxes(list(self.pendingLightingBoxes) + [box])
+
+    def generatePendingLights(self):
+        return exhaust(self.generatePendingLightsIter())
 
-    def generateLightsIter(self, dirtyChunkPositions=None):
+    def generatePendingLightsIter(self):
+        boxes, self.pendingLightingBoxes = self.pendingLightingBoxes, ()
+        return self.generateLightsInBoxesIter(boxes)
+
+    def generateLightsIter(self, dirtyChunkPositions=None, engine=None):
         """ dirtyChunks may be an iterable yielding (xPos,zPos) tuples
         if none, generate lights for all chunks that need lighting
+
+        engine overrides lightingEngine for this call.
         """
 
         startTime = datetime.now()
@@ -621,6 +676,14 @@ class ChunkedLevelMixin(MCLevel):
             dirtyChunkPositions = (c for c in dirtyChunkPositions if self.containsChunk(*c))
 
         dirtyChunkPositions = sorted(dirtyChunkPositions)
+        engine = engine or self.lightingEngine
+
+        if engine == "parallel":
+            if isinstance(self, MCInfdevOldLevel):
+                for progress in lighting.parallelLightsIter(self, dirtyChunkPositions, self.lightingProcesses):
+                    yield progress
+                return
+            engine = "stitched"
 
         maxLightingChunks = getattr(self, 'loadedChunkLimit', 400)
 
@@ -668,7 +731,11 @@ class ChunkedLevelMixin(MCLevel):
             dc = sorted(dc)
             workTotal = sum(estimatedTotals)
             t = 0
-            for c, t, p in self._generateLightsIter(dc):
+            if engine == "stitched":
+                lightsIter = lighting.stitchedLightsIter(self, dc)
+            else:
+                lightsIter = self._generateLightsIter(dc)
+            for c, t, p in lightsIter:
                 yield c + workDone, t + workTotal - estimatedTotals[i], p
 
             estimatedTotals[i] = t
@@ -1287,9 +1354,13 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
     def saveInPlaceGen(self):
         if self.readonly:
             raise IOError("World is opened read only. (%s)"%self.filename)
-        self.saving = True
         self.checkSessionLock()
 
+        # Relight before setting saving, which keeps unloaded neighbors from being read in.
+        for _ in self.generatePendingLightsIter():
+            yield
+
+        self.saving = True
         for level in self.dimensions.itervalues():
             for _ in MCInfdevOldLevel.saveInPlaceGen(level):
                 yield
@@ -1670,6 +1741,42 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
 
                 self.unsavedWorkFolder.copyChunkFrom(sourceFolder, cx, cz)
 
+    def getChunkTagData(self, cx, cz):
+        """
+        Returns the uncompressed tag data of the chunk at (cx, cz) without decoding its blocks. A loaded chunk
+        with unsaved changes is saved first.
+        """
+        chunkData = self._loadedChunkData.get((cx, cz))
+        if chunkData is not None and chunkData.dirty:
+            return chunkData.savedTagData()
+        return self._getChunkBytes(cx, cz)
+
+    def replaceChunkTagData(self, cx, cz, data, needsLighting=True):
+        """
+        Replaces the chunk at (cx, cz), creating it if needed, with the uncompressed tag data of a whole chunk
+        whose xPos and zPos are already set. Returns False without changing anything if the chunk is in use.
+        """
+        if self.readonly:
+            raise IOError("World is opened read only.")
+        if self.saving:
+            raise ChunkAccessDenied
+        if (cx, cz) in self._loadedChunks:
+            return False
+        self.checkSessionLock()
+
+        self._loadedChunkData.pop((cx, cz), None)
+        self.unsavedWorkFolder.saveChunk(cx, cz, data)
+        if self._allChunks is None:
+            self.preloadChunkPositions()
+        self._allChunks.add((cx, cz))
+        self._bounds = None
+
+        if needsLighting:
+            self.chunksNeedingLighting.add((cx, cz))
+        else:
+            self.chunksNeedingLighting.discard((cx, cz))
+        return True
+
     def _getChunkBytes(self, cx, cz):
         if not self.readonly and self.unsavedWorkFolder.containsChunk(cx, cz):
             return self.unsavedWorkFolder.readChunk(cx, cz)
@@ -1872,6 +1979,47 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
         chunk.addTileTick(tickTag)
         chunk.dirty = True
 
+    def _addTagsByChunk(self, tags, pos, add):
+        tagsByChunk = collections.defaultdict(list)
+        for tag in tags:
+            if 'x' not in tag:
+                continue
+            x, y, z = pos(tag)
+            tagsByChunk[x >> 4, z >> 4].append(tag)
+
+        for (cx, cz), chunkTags in tagsByChunk.iteritems():
+            try:
+                chunk = self.getChunk(cx, cz)
+            except (ChunkNotPresent, ChunkMalformed):
+                continue
+            add(chunk, chunkTags)
+            chunk.dirty = True
+
+    def addTileEntities(self, tileEntities):
+        '''
+        Adds many TileEntities to the level at once, replacing the TileEntities already at their positions.
+        TileEntities in chunks that are not present are skipped.
+
+        :param tileEntities: The NBT data of the TileEntities
+        :type tileEntities: list of pymclevel.nbt.TAG_Compound
+        '''
+        self._addTagsByChunk(tileEntities, TileEntity.pos, lambda chunk, tags: chunk.addTileEntities(tags))
+
+    def addTileTicks(self, tileTicks):
+        '''
+        Adds many TileTicks to the level at once, replacing the TileTicks already at their positions.
+        TileTicks in chunks that are not present are skipped.
+
+        :param tileTicks: The NBT data of the TileTicks
+        :type tileTicks: list of pymclevel.nbt.TAG_Compound
+        '''
+        self._addTagsByChunk(tileTicks, TileTick.pos, lambda chunk, tags: chunk.addTileTicks(tags))
+
+    def invalidateEntityIndexes(self):
+        """ Call this after moving tags in loaded chunks other than with Entity.setpos or TileEntity.setpos. """
+        for chunkData in self._loadedChunkData.itervalues():
+            chunkData.entityIndexes = None
+
     def getEntitiesInBox(self, box):
         '''
         Get all of the Entities in the specified box
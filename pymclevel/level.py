@@ -6,14 +6,14 @@ Created on Jul 22, 2011
 
 from box import BoundingBox
 from collections import defaultdict
-from entity import Entity, TileEntity, TileTick
+from entity import Entity, TileEntity, TileTick, movedTagCount, tagsMovedSince
 import itertools
 from logging import getLogger
 import materials
 from math import floor
 from mclevelbase import ChunkMalformed, ChunkNotPresent
 import nbt
-from numpy import argmax, swapaxes, zeros, zeros_like
+from numpy import arange, argmax, array, clip, newaxis, swapaxes, where, zeros, zeros_like
 import os.path
 import id_definitions
 
@@ -63,6 +63,21 @@ def extractHeights(array):
     return heightMap
 
 
+def extractSkyLight(absorption, heights):
+    """ Given light absorption shaped (x, z, y), at least 1 for every block, and the heightmap
+    of those columns indexed (x, z), return the skylight falling straight down each column:
+    full strength at and above the heightmap, then reduced by the absorption of each block
+    below it.
+    """
+
+    # Sum the absorption from the top of each column down, counting only blocks below the
+    # heightmap, then take it away from full strength.
+    below = arange(absorption.shape[2])[newaxis, newaxis, :] < heights[:, :, newaxis]
+    falloff = where(below, absorption, 0)[..., ::-1].cumsum(axis=2, dtype='int16')[..., ::-1]
+
+    return clip(15 - falloff, 0, 15).astype('uint8')
+
+
 def getSlices(box, height):
     """ call this method to iterate through a large slice of the world by
         visiting each chunk and indexing its data with a subslice.
@@ -243,6 +258,10 @@ class MCLevel(object):
     def addTileEntity(self, entityTag):
         pass
 
+    def addTileEntities(self, tileEntities):
+        for tileEntity in tileEntities:
+            self.addTileEntity(tileEntity)
+
     def addTileTick(self, entityTag):
         pass
 
@@ -412,7 +431,7 @@ class MCLevel(object):
 
     # --- Fill and Replace ---
 
-    from block_fill import fillBlocks, fillBlocksIter
+    from block_fill import fillBlocks, fillBlocksIter, remapBlocks, remapBlocksIter
 
     # --- Transformations ---
     def rotateLeft(self):
@@ -474,44 +493,144 @@ class MCLevel(object):
         return -45., 0.
 
     # --- Dummy Lighting Methods ---
-    def generateLights(self, dirtyChunks=None):
+    def generateLights(self, dirtyChunks=None, engine=None):
+        pass
+
+    def generateLightsIter(self, dirtyChunks=None, engine=None):
+        yield 0
+
+    def generateLightsInBoxes(self, boxes):
         pass
 
-    def generateLightsIter(self, dirtyChunks=None):
+    def generateLightsInBoxesIter(self, boxes):
         yield 0
 
+    pendingLightingBoxes = ()
+
+    def queueLighting(self, box):
+        pass
+
+    def generatePendingLights(self):
+        pass
+
+    def generatePendingLightsIter(self):
+        yield 0
+
+
+class EntityIndex(object):
+    """ The positions of the tags in an entity, tile entity or tile tick list, read once so that
+    box and point queries don't decode every tag's position. Built lazily by EntityLevel and
+    rebuilt whenever the list is changed or one of its tags is moved with setpos. """
+
+    def __init__(self, tags, pos):
+        self.movedTagCount = movedTagCount()
+        self.tags = list(tags)
+        self.ids = map(id, self.tags)
+        self.positions = [pos(tag) for tag in self.tags]
+        self.positionArray = array(self.positions, dtype='float64').reshape(len(self.tags), 3)
+        self._byPosition = None
+
+    def matches(self, tags):
+        """ Checks that tags still holds the same tags this index was built from, and that none of
+        them was moved with Entity.setpos or TileEntity.setpos since. Code changing a position
+        some other way should call invalidateEntityIndexes. """
+        if map(id, tags) != self.ids:
+            return False
+        moved = tagsMovedSince(self.movedTagCount)
+        if moved is None:
+            return False
+        if moved:
+            if not set(self.ids).isdisjoint(moved):
+                return False
+            self.movedTagCount = movedTagCount()
+        return True
+
+    def inBox(self, box):
+        p = self.positionArray
+        mask = ((p >= box.origin) & (p < box.maximum)).all(1)
+        return [self.tags[i] for i in mask.nonzero()[0]]
+
+    def at(self, pos):
+        if self._byPosition is None:
+            self._byPosition = defaultdict(list)
+            for p, tag in zip(self.positions, self.tags):
+                self._byPosition[tuple(p)].append(tag)
+        return self._byPosition.get(tuple(pos), [])
+
 
 class EntityLevel(MCLevel):
     """Abstract subclass of MCLevel that adds default entity behavior"""
 
+    # EntityIndex of each tag list, by list name
+    _entityIndexes = None
+
+    def entityIndex(self, name, pos):
+        """ Returns the EntityIndex of the tag list self.<name>, whose tag positions are read with pos. """
+        tags = getattr(self, name)
+        if self._entityIndexes is None:
+            self._entityIndexes = {}
+        index = self._entityIndexes.get(name)
+        if index is None or not index.matches(tags):
+            index = self._entityIndexes[name] = EntityIndex(tags, pos)
+        return index
+
+    def invalidateEntityIndexes(self):
+        """ Call this after moving a tag in place other than with Entity.setpos or TileEntity.setpos. """
+        self._entityIndexes = None
+
     def getEntitiesInBox(self, box):
         """Returns a list of references to entities in this chunk, whose positions are within box"""
-        return [ent for ent in self.Entities if Entity.pos(ent) in box]
+        return self.entityIndex("Entities", Entity.pos).inBox(box)
 
     def getTileEntitiesInBox(self, box):
         """Returns a list of references to tile entities in this chunk, whose positions are within box"""
-        return [ent for ent in self.TileEntities if TileEntity.pos(ent) in box]
+        return self.entityIndex("TileEntities", TileEntity.pos).inBox(box)
 
     def getTileTicksInBox(self, box):
         if hasattr(self, "TileTicks"):
-            return [ent for ent in self.TileTicks if TileTick.pos(ent) in box]
+            return self.entityIndex("TileTicks", TileTick.pos).inBox(box)
         else:
             return []
 
-    def removeEntities(self, func):
-        if not hasattr(self, "Entities"):
+    def _removeTags(self, name, pos, func):
+        index = self.entityIndex(name, pos)
+        newEnts = [ent for ent, p in zip(index.tags, index.positions) if not func(p)]
+
+        entsRemoved = len(index.tags) - len(newEnts)
+        if entsRemoved:
+            getattr(self, name).value[:] = newEnts
+            self.invalidateEntityIndexes()
+
+        return entsRemoved
+
+    def _addTags(self, name, pos, tags):
+        """ Appends tags to the tag list self.<name>, replacing the tags already at their positions.
+        If several of tags share a position, the last one wins. """
+        tags = list(tags)
+        byPosition = {}
+        for tag in tags:
+            byPosition[tuple(pos(tag))] = tag
+        if not byPosition:
             return
-        newEnts = []
-        for ent in self.Entities:
-            if func(Entity.pos(ent)):
-                continue
-            newEnts.append(ent)
 
-        entsRemoved = len(self.Entities) - len(newEnts)
-        log.debug("Removed {0} entities".format(entsRemoved))
+        added = set(id(tag) for tag in byPosition.itervalues())
+        index = self.entityIndex(name, pos)
+        kept = [tag for tag, p in zip(index.tags, index.positions)
+                if tuple(p) not in byPosition and id(tag) not in added]
+        kept.extend(tag for tag in tags if byPosition[tuple(pos(tag))] is tag)
 
-        self.Entities.value[:] = newEnts
+        # Refill the list through its own methods, so an empty list takes the type of the new tags.
+        tagList = getattr(self, name)
+        del tagList[:]
+        tagList.extend(kept)
+        self._fakeEntities = None
+        self.invalidateEntityIndexes()
 
+    def removeEntities(self, func):
+        if not hasattr(self, "Entities"):
+            return
+        entsRemoved = self._removeTags("Entities", Entity.pos, func)
+        log.debug("Removed {0} entities".format(entsRemoved))
         return entsRemoved
 
     def removeEntitiesInBox(self, box):
@@ -520,17 +639,8 @@ class EntityLevel(MCLevel):
     def removeTileEntities(self, func):
         if not hasattr(self, "TileEntities"):
             return
-        newEnts = []
-        for ent in self.TileEntities:
-            if func(TileEntity.pos(ent)):
-                continue
-            newEnts.append(ent)
-
-        entsRemoved = len(self.TileEntities) - len(newEnts)
+        entsRemoved = self._removeTags("TileEntities", TileEntity.pos, func)
         log.debug("Removed {0} tile entities".format(entsRemoved))
-
-        self.TileEntities.value[:] = newEnts
-
         return entsRemoved
 
     def removeTileEntitiesInBox(self, box):
@@ -539,17 +649,8 @@ class EntityLevel(MCLevel):
     def removeTileTicks(self, func):
         if not hasattr(self, "TileTicks"):
             return
-        newEnts = []
-        for ent in self.TileTicks:
-            if func(TileTick.pos(ent)):
-                continue
-            newEnts.append(ent)
-
-        entsRemoved = len(self.TileTicks) - len(newEnts)
+        entsRemoved = self._removeTags("TileTicks", TileTick.pos, func)
         log.debug("Removed {0} tile tickss".format(entsRemoved))
-
-        self.TileTicks.value[:] = newEnts
-
         return entsRemoved
 
     def removeTileTicksInBox(self, box):
@@ -563,16 +664,14 @@ class EntityLevel(MCLevel):
         assert isinstance(entityTag, nbt.TAG_Compound)
         self.Entities.append(entityTag)
         self._fakeEntities = None
+        self._entityIndexes = None
 
     def tileEntityAt(self, x, y, z, print_stuff=False):
-        entities = []
         if print_stuff:
             print "len(self.TileEntities)", len(self.TileEntities)
-        for entityTag in self.TileEntities:
-            if print_stuff:
+            for entityTag in self.TileEntities:
                 print entityTag["id"].value, TileEntity.pos(entityTag), x, y, z
-            if TileEntity.pos(entityTag) == [x, y, z]:
-                entities.append(entityTag)
+        entities = self.entityIndex("TileEntities", TileEntity.pos).at((x, y, z))
 
         if len(entities) > 1:
             log.info("Multiple tile entities found: {0}".format(entities))
@@ -583,29 +682,20 @@ class EntityLevel(MCLevel):
 
     def addTileEntity(self, tileEntityTag):
         assert isinstance(tileEntityTag, nbt.TAG_Compound)
+        self._addTags("TileEntities", TileEntity.pos, [tileEntityTag])
 
-        def differentPosition(a):
-            return not ((tileEntityTag is a) or TileEntity.pos(a) == TileEntity.pos(tileEntityTag))
-
-        self.TileEntities.value[:] = filter(differentPosition, self.TileEntities)
-
-        self.TileEntities.append(tileEntityTag)
-        self._fakeEntities = None
+    def addTileEntities(self, tileEntities):
+        """ Adds many tile entities at once, replacing any already at their positions. """
+        self._addTags("TileEntities", TileEntity.pos, tileEntities)
 
     def addTileTick(self, tickTag):
         assert isinstance(tickTag, nbt.TAG_Compound)
         if hasattr(self, "TileTicks"):
-            def differentPosition(a):
-                return not ((tickTag is a) or TileTick.pos(a) == TileTick.pos(tickTag))
-
-            self.TileTicks.value[:] = filter(differentPosition, self.TileTicks)
-
-            self.TileTicks.append(tickTag)
-            self._fakeEntities = None
+            self._addTags("TileTicks", TileTick.pos, [tickTag])
 
     def addTileTicks(self, tileTicks):
-        for e in tileTicks:
-            self.addTileTick(e)
+        if hasattr(self, "TileTicks"):
+            self._addTags("TileTicks", TileTick.pos, tileTicks)
 
     _fakeEntities = None
 
@@ -696,17 +786,5 @@ class LightedChunk(ChunkBase):
         if self.world.dimNo in (-1, 1):
             return  # no light in nether or the end
 
-        blocks = self.Blocks
-        la = self.world.materials.lightAbsorption
-        skylight = self.SkyLight
-        heightmap = self.HeightMap
-
-        for x, z in itertools.product(xrange(16), xrange(16)):
-            skylight[x, z, heightmap[z, x]:] = 15
-            lv = 15
-            for y in reversed(range(heightmap[z, x])):
-                lv -= (la[blocks[x, z, y]] or 1)
-
-                if lv <= 0:
-                    break
-                skylight[x, z, y] = lv
+        la = clip(self.world.materials.lightAbsorption[self.Blocks], 1, 15)
+        self.SkyLight[:] = extractSkyLight(la, self.HeightMap.swapaxes(0, 1))
@@ -14,6 +14,7 @@ import struct
 from infiniteworld import ChunkedLevelMixin, SessionLockLost, AnvilChunkData, unpackNibbleArray, packNibbleArray
 from level import LightedChunk
 from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 from pymclevel import entity, BoundingBox, Entity, TileEntity
 import traceback
 
@@ -86,13 +87,15 @@ def loadNBTCompoundList(data, littleEndian=True, partNBT=False):
     :param partNBT: bool. If part of the data is NBT (begins with NBT), the function will return the list of compounds with the rest of the data that was not NBT
     :return: list of TAG_Compounds
     """
+    codec = nbt.LITTLE_ENDIAN if littleEndian else nbt.BIG_ENDIAN
+
     def load(_data, _partNBT):
         compound_list = []
         idx = 0
         while idx < len(_data):
             try:
-                __data = nbt.load(buf=_data[idx:])
-                idx += len(nbt.gunzip(__data.save()))
+                __data = nbt.load(buf=_data[idx:], codec=codec)
+                idx += len(__data.save(compressed=False, codec=codec))
             except Exception as e:
                 if _partNBT:
                     return compound_list, _data[idx:]
@@ -127,11 +130,7 @@ def loadNBTCompoundList(data, littleEndian=True, partNBT=False):
             return compound_list, None
         return compound_list
 
-    if littleEndian:
-        with nbt.littleEndianNBT():
-            return load(data, partNBT)
-    else:
-        return load(data, partNBT)
+    return load(data, partNBT)
 
 
 # =====================================================================
@@ -360,11 +359,14 @@ class PocketLeveldbDatabase(object):
 
         return terrain, tile_entities, entities
 
-    def _readChunk(self, cx, cz, world, readOptions=None):
+    def _readChunkData(self, cx, cz, world, readOptions=None):
         """
+        Reads the raw data of a chunk from the database, without decoding it.
         :param cx, cz: int Coordinates of the chunk
         :param readOptions: ReadOptions
-        :return: chunk data in a tuple: (terrain, tile_entities, entities)
+        :return: tuple (chunk version, raw data), to be passed to _decodeChunk.
+            Raw data is (terrain, tile_entities, entities) for pre 1.0 chunks, and (data_2d, subchunks) for 1.0+ ones,
+            subchunks being a list of (y, (terrain, tile_entities, entities)).
         """
         # PE 1+ worlds can contain pre 1.0 chunks.
         # Let check which version of the chunk we have before doing anything else.
@@ -388,7 +390,7 @@ class PocketLeveldbDatabase(object):
                 data = self._readChunk_pre1_0(cx, cz, rop, key)
                 if data is None:
                     raise ChunkNotPresent((cx, cz, self))
-                chunk = PocketLeveldbChunkPre1(cx, cz, world, data, world_version=self.world_version)
+                return ver, data
             # Let assume that any chunk wich version is greater or equal to 3 in a PE 1+ one.
             elif ord(ver) >= 3:
                 # PE 1+ chunk detected. Iterate through the subchunks to rebuild the whole data.
@@ -404,37 +406,63 @@ class PocketLeveldbDatabase(object):
                     world._allChunks = None
                     world.allChunks
 
-                chunk = PocketLeveldbChunk1Plus(cx, cz, world, world_version=self.world_version, chunk_version=ver)
                 d2d = db.Get(rop, key + "\x2d")
-                if d2d:
-                    # data_2d contains the heightmap (currently computed dynamically, may change)
-                    # and the biome information of the chunk on the last 256 bytes.
-                    chunk.data_2d = d2d
-                    biomes = numpy.fromstring(d2d[512:], 'uint8')
-                    biomes.shape = (16 ,16)
-                    chunk.Biomes = biomes
+                subchunks = []
                 for i in range(16):
                     r = self._readSubChunk_1plus(cx, cz, i, rop, key)
                     if type(r) == tuple:
-                        tr, te, en = r
-                        chunk.add_data(terrain=tr, tile_entities=te, entities=en, subchunk=i)
-                # Generate the lights if we have a PE 1.1 chunk.
-                if ord(chunk.version) >= 4:
-                    chunk.genFastLights()
-                if DEBUG_PE:
-                    write_dump(">>> Chunk (%s, %s) sub-chunks: %s\n" % (cx, cz, repr(chunk.subchunks)))
+                        subchunks.append((i, r))
+                return ver, (d2d, subchunks)
             elif ver is not None:
                 raise AttributeError("Unknown PE chunk version %s" % repr(ver))
-            elif ver is None:
+            else:
                 if DEBUG_PE:
                     write_dump("Chunk (%s, %s) version seem to be 'None'. Do this chunk exists in this world?" % (cx, cz))
                 return None
-            else:
-                if DEBUG_PE:
-                    write_dump("Unknown chunk version detected for chukn (%s, %s): %s" % (cx, cz, repr(ver)))
-                raise AttributeError("Unknown chunk version detected for chukn (%s, %s): %s" % (cx, cz, repr(ver)))
-            logger.debug("CHUNK LOAD %s %s" % (cx, cz))
-            return chunk
+
+    def _decodeChunk(self, cx, cz, world, ver, data):
+        """
+        Builds a chunk object from the raw data returned by _readChunkData.
+        Does not access the database and does not change any global NBT state, so several chunks
+        can be decoded at the same time from a worker pool.
+        :param cx, cz: int Coordinates of the chunk
+        :param world: PocketLeveldbWorld
+        :param ver: str, chunk version
+        :param data: raw chunk data
+        :return: PocketLeveldbChunk
+        """
+        if ver == "\x02":
+            chunk = PocketLeveldbChunkPre1(cx, cz, world, data, world_version=self.world_version)
+        else:
+            d2d, subchunks = data
+            chunk = PocketLeveldbChunk1Plus(cx, cz, world, world_version=self.world_version, chunk_version=ver)
+            if d2d:
+                # data_2d contains the heightmap (currently computed dynamically, may change)
+                # and the biome information of the chunk on the last 256 bytes.
+                chunk.data_2d = d2d
+                biomes = numpy.fromstring(d2d[512:], 'uint8')
+                biomes.shape = (16 ,16)
+                chunk.Biomes = biomes
+            for i, (tr, te, en) in subchunks:
+                chunk.add_data(terrain=tr, tile_entities=te, entities=en, subchunk=i)
+            # Generate the lights if we have a PE 1.1 chunk.
+            if ord(chunk.version) >= 4:
+                chunk.genFastLights()
+            if DEBUG_PE:
+                write_dump(">>> Chunk (%s, %s) sub-chunks: %s\n" % (cx, cz, repr(chunk.subchunks)))
+        logger.debug("CHUNK LOAD %s %s" % (cx, cz))
+        return chunk
+
+    def _readChunk(self, cx, cz, world, readOptions=None):
+        """
+        :param cx, cz: int Coordinates of the chunk
+        :param readOptions: ReadOptions
+        :return: PocketLeveldbChunk or None
+        """
+        raw = self._readChunkData(cx, cz, world, readOptions)
+        if raw is None:
+            return None
+        return self._decodeChunk(cx, cz, world, *raw)
 
     def _saveChunk_pre1_0(self, chunk, batch=None, writeOptions=None):
         """
@@ -472,23 +500,23 @@ class PocketLeveldbDatabase(object):
         cx, cz = chunk.chunkPosition
         key = struct.pack('<i', cx) + struct.pack('<i', cz)
 
-        with nbt.littleEndianNBT():
-            mcedit_defs = self.level.defsIds.mcedit_defs
-            defs_get = mcedit_defs.get
-            ids_get = self.level.defsIds.mcedit_ids.get
-            tileEntityData = ''
-            for ent in chunk.TileEntities:
-                tileEntityData += ent.save(compressed=False)
-
-            entityData = ''
-            for ent in chunk.Entities:
-                v = ent["id"].value
-                ent_data = defs_get(ids_get(v, v), {'id': -1})
-                id = ent_data['id']
-                ent['id'] = nbt.TAG_Int(id + mcedit_defs['entity_types'].get(ent_data.get('type', None),0))
-                entityData += ent.save(compressed=False)
-                # We have to re-invert after saving otherwise the next save will fail.
-                ent["id"] = nbt.TAG_String(v)
+        codec = nbt.LITTLE_ENDIAN
+        mcedit_defs = self.level.defsIds.mcedit_defs
+        defs_get = mcedit_defs.get
+        ids_get = self.level.defsIds.mcedit_ids.get
+        tileEntityData = ''
+        for ent in chunk.TileEntities:
+            tileEntityData += ent.save(compressed=False, codec=codec)
+
+        entityData = ''
+        for ent in chunk.Entities:
+            v = ent["id"].value
+            ent_data = defs_get(ids_get(v, v), {'id': -1})
+            id = ent_data['id']
+            ent['id'] = nbt.TAG_Int(id + mcedit_defs['entity_types'].get(ent_data.get('type', None),0))
+            entityData += ent.save(compressed=False, codec=codec)
+            # We have to re-invert after saving otherwise the next save will fail.
+            ent["id"] = nbt.TAG_String(v)
 
         wop = self.writeOptions if writeOptions is None else writeOptions
         chunk._Blocks.update_subchunks()
@@ -564,6 +592,41 @@ class PocketLeveldbDatabase(object):
         chunk = self._readChunk(cx, cz, world)
         return chunk
 
+    # Number of threads used by loadChunks to decode chunks. None means one per CPU.
+    decodeWorkers = None
+
+    def loadChunks(self, coords, world):
+        """
+        Loads several chunks at once. The database is read from the calling thread, and the raw
+        data is decoded in a pool of worker threads.
+        Chunks which are not present in the database are skipped.
+        :param coords: iterable of (cx, cz) tuples
+        :param world: PocketLeveldbWorld
+        :return: dict mapping (cx, cz) to PocketLeveldbChunk
+        """
+        raw_chunks = []
+        for cx, cz in coords:
+            try:
+                raw = self._readChunkData(cx, cz, world)
+            except ChunkNotPresent:
+                continue
+            if raw is not None:
+                raw_chunks.append((cx, cz, raw))
+
+        def decode(item):
+            cx, cz, (ver, data) = item
+            return (cx, cz), self._decodeChunk(cx, cz, world, ver, data)
+
+        if len(raw_chunks) < 2:
+            return dict(decode(item) for item in raw_chunks)
+
+        pool = ThreadPool(self.decodeWorkers)
+        try:
+            return dict(pool.map(decode, raw_chunks))
+        finally:
+            pool.close()
+            pool.join()
+
     _allChunks = None
 
     def deleteChunk(self, cx, cz, batch=None):
@@ -802,25 +865,24 @@ class PocketLeveldbWorld(ChunkedLevelMixin, MCLevel):
         :param last_played: long
         :return: None
         """
-        with nbt.littleEndianNBT():
-            root_tag = nbt.TAG_Compound()
-            root_tag["Data"] = nbt.TAG_Compound()
-            root_tag["Data"]["SpawnX"] = nbt.TAG_Int(0)
-            root_tag["Data"]["SpawnY"] = nbt.TAG_Int(2)
-            root_tag["Data"]["SpawnZ"] = nbt.TAG_Int(0)
+        root_tag = nbt.TAG_Compound()
+        root_tag["Data"] = nbt.TAG_Compound()
+        root_tag["Data"]["SpawnX"] = nbt.TAG_Int(0)
+        root_tag["Data"]["SpawnY"] = nbt.TAG_Int(2)
+        root_tag["Data"]["SpawnZ"] = nbt.TAG_Int(0)
 
-            if last_played is None:
-                last_played = long(time.time() * 100)
-            if random_seed is None:
-                random_seed = long(numpy.random.random() * 0xffffffffffffffffL) - 0x8000000000000000L
+        if last_played is None:
+            last_played = long(time.time() * 100)
+        if random_seed is None:
+            random_seed = long(numpy.random.random() * 0xffffffffffffffffL) - 0x8000000000000000L
 
-            self.root_tag = root_tag
+        self.root_tag = root_tag
 
-            self.LastPlayed = long(last_played)
-            self.RandomSeed = long(random_seed)
-            self.SizeOnDisk = 0
-            self.Time = 1
-            self.LevelName = os.path.basename(self.worldFile.path)
+        self.LastPlayed = long(last_played)
+        self.RandomSeed = long(random_seed)
+        self.SizeOnDisk = 0
+        self.Time = 1
+        self.LevelName = os.path.basename(self.worldFile.path)
 
     def loadLevelDat(self, create=False, random_seed=None, last_played=None):
         """
@@ -839,11 +901,11 @@ class PocketLeveldbWorld(ChunkedLevelMixin, MCLevel):
             if len(root_tag_buf) != struct.Struct('<i').unpack(length)[0]:
                 raise nbt.NBTFormatError()
             self.root_tag = nbt.TAG_Compound()
-            level_nbt_data = nbt.load(buf=root_tag_buf)
+            level_nbt_data = nbt.load(buf=root_tag_buf, codec=nbt.LITTLE_ENDIAN)
             if "Data" in level_nbt_data:
                 self.root_tag = level_nbt_data
             else:
-                self.root_tag["Data"] = nbt.load(buf=root_tag_buf)
+                self.root_tag["Data"] = level_nbt_data
 
         self.__gameVersion = 'PE'
         if create:
@@ -851,14 +913,12 @@ class PocketLeveldbWorld(ChunkedLevelMixin, MCLevel):
             self._createLevelDat(random_seed, last_played)
             return
         try:
-            with nbt.littleEndianNBT():
-                _loadLevelDat(os.path.join(self.worldFile.path, "level.dat"))
+            _loadLevelDat(os.path.join(self.worldFile.path, "level.dat"))
             return
         except (nbt.NBTFormatError, IOError) as err:
             logger.info("Failed to load level.dat, trying to load level.dat_old ({0})".format(err))
         try:
-            with nbt.littleEndianNBT():
-                _loadLevelDat(os.path.join(self.worldFile.path, "level.dat_old"))
+            _loadLevelDat(os.path.join(self.worldFile.path, "level.dat_old"))
             return
         except (nbt.NBTFormatError, IOError) as err:
             logger.info("Failed to load level.dat_old, creating new level.dat ({0})".format(err))
@@ -905,6 +965,29 @@ class PocketLeveldbWorld(ChunkedLevelMixin, MCLevel):
                 write_dump("*** Loaded chunks num.: %s\n" % len(self._loadedChunks))
         return c
 
+    # Number of chunks getChunks decodes at a time before yielding them.
+    chunkBatchSize = 64
+
+    def getChunks(self, chunks=None):
+        """
+        Pass a list of chunk coordinate tuples to get an iterator yielding chunks. Pass nothing for an
+        iterator of every chunk in the level. Chunks not loaded yet are decoded in parallel, chunkBatchSize
+        at a time, so the first chunks are yielded before the rest of the world is read.
+        """
+        if chunks is None:
+            chunks = self.allChunks
+        chunks = iter(chunks)
+        while True:
+            batch = list(itertools.islice(chunks, self.chunkBatchSize))
+            if not batch:
+                return
+            batch = [c for c in batch if self.containsChunk(*c)]
+            missing = [c for c in batch if c not in self._loadedChunks]
+            if missing:
+                self._loadedChunks.update(self.worldFile.loadChunks(missing, self))
+            for cx, cz in batch:
+                yield self.getChunk(cx, cz)
+
     def unload(self):
         """
         Unload all chunks and close all open file-handlers.
@@ -1029,14 +1112,14 @@ class PocketLeveldbWorld(ChunkedLevelMixin, MCLevel):
                 chunk.dirty = False
             yield
 
-        with nbt.littleEndianNBT():
-            for p in self.players:
-                # The player data may not be in the cache if we have multi-player game.
-                # So, accessing the cache using the player as key crashes the program...
-                playerData = self.playerTagCache.get(p)
-                if playerData is not None:
-                    playerData = playerData.save(compressed=False)  # It will get compressed in the DB itself
-                    self.worldFile.savePlayer(p, playerData, batch=batch)
+        for p in self.players:
+            # The player data may not be in the cache if we have multi-player game.
+            # So, accessing the cache using the player as key crashes the program...
+            playerData = self.playerTagCache.get(p)
+            if playerData is not None:
+                # It will get compressed in the DB itself
+                playerData = playerData.save(compressed=False, codec=nbt.LITTLE_ENDIAN)
+                self.worldFile.savePlayer(p, playerData, batch=batch)
 
         with self.worldFile.world_db() as db:
             wop = self.worldFile.writeOptions
@@ -1045,20 +1128,19 @@ class PocketLeveldbWorld(ChunkedLevelMixin, MCLevel):
         self.saving = False
         logger.info(u"Saved {0} chunks to the database".format(dirtyChunkCount))
         path = os.path.join(self.worldFile.path, 'level.dat')
-        with nbt.littleEndianNBT():
-            rootTagData = self.root_tag["Data"].save(compressed=False)
-#             if self.world_version == '1.plus':
-#                 magic = 5
-#             else:
-#                 magic = 4
+        rootTagData = self.root_tag["Data"].save(compressed=False, codec=nbt.LITTLE_ENDIAN)
+#         if self.world_version == '1.plus':
+#             magic = 5
+#         else:
+#             magic = 4
 
-            magic = self.dat_world_version
-            if isinstance(magic, (str, unicode)):
-                magic = ord(magic)
+        magic = self.dat_world_version
+        if isinstance(magic, (str, unicode)):
+            magic = ord(magic)
 
-            rootTagData = struct.Struct('<i').pack(magic) + struct.Struct('<i').pack(len(rootTagData)) + rootTagData
-            with open(path, 'wb') as f:
-                f.write(rootTagData)
+        rootTagData = struct.Struct('<i').pack(magic) + struct.Struct('<i').pack(len(rootTagData)) + rootTagData
+        with open(path, 'wb') as f:
+            f.write(rootTagData)
 
     def containsChunk(self, cx, cz):
         """
@@ -1293,9 +1375,8 @@ class PocketLeveldbWorld(ChunkedLevelMixin, MCLevel):
         if _player is not None:
             return _player
         playerData = self.playerData[player]
-        with nbt.littleEndianNBT():
-            _player = nbt.load(buf=playerData)
-            self.playerTagCache[player] = _player
+        _player = nbt.load(buf=playerData, codec=nbt.LITTLE_ENDIAN)
+        self.playerTagCache[player] = _player
         return _player
 
     def getPlayerDimension(self, player="Player"):
@@ -1569,29 +1650,29 @@ class PocketLeveldbChunkPre1(LightedChunk):
             # we only track modifications at the chunk level.
             self.DirtyColumns[:] = 255
 
-        with nbt.littleEndianNBT():
-            entityData = ""
-            tileEntityData = ""
-            defs_get = self.world.defsIds.mcedit_defs.get
-            ids_get = self.world.defsIds.mcedit_ids.get
-
-            for ent in self.TileEntities:
-                tileEntityData += ent.save(compressed=False)
-
-            for ent in self.Entities:
-                v = ent["id"].value
-#                 ent["id"] = nbt.TAG_Int(entity.PocketEntity.entityList[v])
-#                 id = entity.PocketEntity.getNumId(v)
-#                 print v, id, MCEDIT_DEFS.get(MCEDIT_IDS.get(v, v), {'id': -1})['id']
-                id = defs_get(ids_get(v, v), {'id': -1})['id']
-                if id >= 1000:
-                    print id
-                    print type(ent)
-                    print ent
-                ent['id'] = nbt.TAG_Int(id)
-                entityData += ent.save(compressed=False)
-                # We have to re-invert after saving otherwise the next save will fail.
-                ent["id"] = nbt.TAG_String(v)
+        codec = nbt.LITTLE_ENDIAN
+        entityData = ""
+        tileEntityData = ""
+        defs_get = self.world.defsIds.mcedit_defs.get
+        ids_get = self.world.defsIds.mcedit_ids.get
+
+        for ent in self.TileEntities:
+            tileEntityData += ent.save(compressed=False, codec=codec)
+
+        for ent in self.Entities:
+            v = ent["id"].value
+#             ent["id"] = nbt.TAG_Int(entity.PocketEntity.entityList[v])
+#             id = entity.PocketEntity.getNumId(v)
+#             print v, id, MCEDIT_DEFS.get(MCEDIT_IDS.get(v, v), {'id': -1})['id']
+            id = defs_get(ids_get(v, v), {'id': -1})['id']
+            if id >= 1000:
+                print id
+                print type(ent)
+                print ent
+            ent['id'] = nbt.TAG_Int(id)
+            entityData += ent.save(compressed=False, codec=codec)
+            # We have to re-invert after saving otherwise the next save will fail.
+            ent["id"] = nbt.TAG_String(v)
 
         terrain = ''.join([self.Blocks.tostring(),
                            packData(self.Data).tostring(),
@@ -0,0 +1,551 @@
+'''
+Vectorized lighting for chunked levels.
+
+ChunkedLevelMixin._generateLightsIter disperses light one chunk at a time, stepping
+across chunk borders with separate edge arrays. The functions here instead stitch
+the chunks of a region together into one contiguous (x, z, y) volume and disperse
+light across the whole volume with shifted numpy operations, then scatter the
+results back into the chunks.
+'''
+
+import itertools
+from logging import getLogger
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+from numpy import array, clip, maximum, zeros
+
+from box import BoundingBox
+from level import computeChunkHeightMap, extractSkyLight
+from mclevelbase import ChunkMalformed, ChunkNotPresent
+import nbt
+
+log = getLogger(__name__)
+
+__all__ = ["LightingVolume", "disperseLight", "stitchedLightsIter", "boxLightsIter", "parallelLightsIter"]
+
+
+def lightAbsorptionTable(materials):
+    """ Light absorption per block ID as used for dispersal: every block, even air,
+    takes at least one level of light away. """
+    la = array(materials.lightAbsorption, dtype='uint8')
+    clip(la, 1, 15, la)
+    return la
+
+
+def disperseLight(light, absorption):
+    """ Spread light through a stitched volume until it stops changing.
+
+    light and absorption are uint8 arrays of the same (x, z, y) shape. Light entering
+    a block is reduced by that block's absorption, which must already be clipped to
+    1..15. light is updated in place. Returns the number of passes made.
+
+    Each pass only visits the bounding box of the blocks changed by the previous pass,
+    grown by one block, since light can travel no further than that in one pass. The first
+    pass visits only the blocks bright enough to spread light next to blocks dark enough to
+    receive it. For skylight seeded from the heightmap, that leaves out the open sky above
+    the terrain and the dark rock below it, leaving a thin shell around overhangs and caves.
+    """
+    # light and absorption never exceed 15, so their difference fits in a signed byte. Viewing
+    # both as int8, light that drops below zero loses every comparison in maximum() without
+    # needing to be clipped first.
+    signedLight = light.view('int8')
+    signedAbsorption = absorption.view('int8')
+
+    # Light entering a block loses at least one level, so only blocks brighter than 1 can
+    # light their neighbors, and only blocks darker than 14 can be lit by them.
+    senders = _changedRegion(light > 1, light.shape)
+    receivers = _changedRegion(light < 14, light.shape)
+    if senders is None or receivers is None:
+        return 0
+
+    region = _changedRegion(None, light.shape, [slice(max(s.start, r.start), min(s.stop, r.stop))
+                                                for s, r in zip(senders, receivers)])
+    passes = 0
+
+    while region is not None:
+        regionLight = signedLight[region]
+        regionAbsorption = signedAbsorption[region]
+        previous = regionLight.copy()
+
+        for axis in range(3):
+            size = regionLight.shape[axis]
+            if size < 2:
+                continue
+
+            low = [slice(None)] * 3
+            high = [slice(None)] * 3
+            low[axis] = slice(0, size - 1)
+            high[axis] = slice(1, size)
+            low = tuple(low)
+            high = tuple(high)
+
+            # toward decreasing, then toward increasing coordinates
+            for src, dst in ((high, low), (low, high)):
+                newlight = regionLight[src] - regionAbsorption[dst]
+                maximum(regionLight[dst], newlight, regionLight[dst])
+
+        passes += 1
+        changed = _changedRegion(previous != regionLight, light.shape)
+        if changed is not None:
+            changed = tuple(slice(r.start + c.start, r.start + c.stop)
+                            for r, c in zip(region, changed))
+            changed = _changedRegion(None, light.shape, changed)
+        region = changed
+
+    return passes
+
+
+def _changedRegion(mask, shape, bounds=None):
+    """ Returns a tuple of slices selecting the bounding box of the True values in mask,
+    grown by one in every direction and clipped to shape, or None if mask is all False.
+    If bounds are given instead of a mask, they are grown and clipped.
+    """
+    if bounds is None:
+        bounds = []
+        for axis in range(3):
+            others = tuple(a for a in range(3) if a != axis)
+            indexes = mask.any(axis=others).nonzero()[0]
+            if not len(indexes):
+                return None
+            bounds.append(slice(indexes[0], indexes[-1] + 1))
+
+    return tuple(slice(max(0, b.start - 1), min(size, b.stop + 1))
+                 for b, size in zip(bounds, shape))
+
+
+class LightingVolume(object):
+    """ The blocks of a level within a box, stitched together into contiguous arrays
+    indexed (x, z, y) like chunk arrays.
+
+    Chunks missing from the level are treated as dark and opaque, so light leaking out
+    of the level's edge never comes back.
+    """
+
+    def __init__(self, level, box, absorption=None):
+        self.level = level
+        self.box = box
+
+        if absorption is None:
+            absorption = lightAbsorptionTable(level.materials)
+        emission = level.materials.lightEmission
+
+        shape = (box.width, box.length, box.height)
+        self.Absorption = zeros(shape, 'uint8')
+        self.Absorption[:] = 15
+        self.Emission = zeros(shape, 'uint8')
+
+        self.chunks = {}
+        for cx, cz in box.chunkPositions:
+            try:
+                chunk = level.getChunk(cx, cz)
+            except (ChunkNotPresent, ChunkMalformed):
+                continue
+
+            self.chunks[cx, cz] = chunk
+            src, dst = self.chunkSlices(cx, cz)
+            blocks = chunk.Blocks[src]
+            self.Absorption[dst] = absorption[blocks]
+            self.Emission[dst] = emission[blocks]
+
+    def chunkSlices(self, cx, cz, box=None):
+        """ Returns a pair of slice tuples selecting the part of chunk (cx, cz) within box
+        (by default, the whole volume) from the chunk's arrays and from this volume's arrays.
+        """
+        if box is None:
+            box = self.box
+
+        x = cx << 4
+        z = cz << 4
+        minx, maxx = max(x, box.minx), min(x + 16, box.maxx)
+        minz, maxz = max(z, box.minz), min(z + 16, box.maxz)
+
+        src = (slice(minx - x, maxx - x),
+               slice(minz - z, maxz - z),
+               slice(box.miny, box.maxy))
+        dst = (slice(minx - self.box.minx, maxx - self.box.minx),
+               slice(minz - self.box.minz, maxz - self.box.minz),
+               slice(box.miny - self.box.miny, box.maxy - self.box.miny))
+        return src, dst
+
+    def gather(self, light):
+        """ Returns a new array holding the light named by light ("BlockLight" or "SkyLight")
+        for the whole volume. """
+        values = zeros(self.Absorption.shape, 'uint8')
+        for (cx, cz), chunk in self.chunks.iteritems():
+            src, dst = self.chunkSlices(cx, cz)
+            values[dst] = getattr(chunk, light)[src]
+        return values
+
+    def heightMap(self):
+        """ Returns the heightmap of the volume indexed (x, z). Columns of missing chunks are
+        as tall as the level, so no skylight falls into them. """
+        heights = zeros(self.Absorption.shape[:2], 'int32')
+        heights[:] = self.level.Height
+        for (cx, cz), chunk in self.chunks.iteritems():
+            src, dst = self.chunkSlices(cx, cz)
+            heights[dst[:2]] = chunk.HeightMap.swapaxes(0, 1)[src[:2]]
+        return heights
+
+    def skyLightSeeds(self):
+        """ Returns skylight for the volume before dispersal: full strength at and above the
+        heightmap and fading down through the blocks below it, like LightedChunk.genFastLights.
+        The volume must span the full height of the level. """
+        return extractSkyLight(self.Absorption, self.heightMap())
+
+    def scatter(self, light, values, chunkPositions, box=None):
+        """ Writes values back into the named light of the chunks at chunkPositions, limited to box
+        if given. Returns the positions of the chunks whose light changed. """
+        changed = []
+        for cPos in chunkPositions:
+            chunk = self.chunks.get(cPos)
+            if chunk is None:
+                continue
+
+            src, dst = self.chunkSlices(cPos[0], cPos[1], box)
+            chunkLight = getattr(chunk, light)
+            if (chunkLight[src] != values[dst]).any():
+                chunkLight[src] = values[dst]
+                chunk.dirty = True
+                changed.append(cPos)
+
+        return changed
+
+
+def stitchedLightsIter(level, dirtyChunkPositions, tileSize=8):
+    """ Relights the given chunks like ChunkedLevelMixin._generateLightsIter, yielding
+    (done, total, info) progress tuples.
+
+    Chunks are grouped into tiles of tileSize x tileSize chunks. Each tile is stitched
+    together with a one chunk apron of its neighbors and lit as a single volume. When
+    a tile's light changes next to another tile, that tile is lit again, so light
+    crosses tile borders the same as it crosses chunk borders in the classic engine.
+    """
+    absorption = lightAbsorptionTable(level.materials)
+
+    dirtyChunks = [level.getChunk(*cPos) for cPos in dirtyChunkPositions]
+    progressInfo = u"Lighting {0} chunks".format(len(dirtyChunks))
+    log.info(progressInfo)
+
+    workTotal = len(dirtyChunks) * 2
+    for i, chunk in enumerate(dirtyChunks):
+        chunk.chunkChanged()
+        yield i, workTotal, progressInfo
+
+    # relight all blocks in neighboring chunks in case their light source disappeared.
+    targets = set()
+    for chunk in dirtyChunks:
+        cx, cz = chunk.chunkPosition
+        for dx, dz in itertools.product((-1, 0, 1), (-1, 0, 1)):
+            if level.containsChunk(cx + dx, cz + dz):
+                targets.add((cx + dx, cz + dz))
+
+    tiles = {}
+    for cx, cz in targets:
+        try:
+            chunk = level.getChunk(cx, cz)
+        except (ChunkNotPresent, ChunkMalformed):
+            continue
+        chunk.BlockLight[:] = level.materials.lightEmission[chunk.Blocks]
+        chunk.dirty = True
+        tiles.setdefault((cx // tileSize, cz // tileSize), []).append((cx, cz))
+
+    if level.dimNo in (-1, 1):
+        lights = ("BlockLight",)
+    else:
+        lights = ("BlockLight", "SkyLight")
+
+    queue = sorted(tiles)
+    queued = set(queue)
+    workDone = len(dirtyChunks)
+    workTotal = workDone + len(queue)
+
+    while queue:
+        tile = queue.pop(0)
+        queued.discard(tile)
+        positions = tiles[tile]
+
+        mincx = min(cx for cx, cz in positions) - 1
+        mincz = min(cz for cx, cz in positions) - 1
+        maxcx = max(cx for cx, cz in positions) + 2
+        maxcz = max(cz for cx, cz in positions) + 2
+        box = BoundingBox((mincx << 4, 0, mincz << 4),
+                          ((maxcx - mincx) << 4, level.Height, (maxcz - mincz) << 4))
+
+        progressInfo = u"Lighting tile {0}: {1} chunks".format(tile, len(positions))
+        log.info(progressInfo)
+
+        volume = LightingVolume(level, box, absorption)
+        changed = set()
+        for light in lights:
+            values = volume.gather(light)
+            disperseLight(values, volume.Absorption)
+            changed.update(volume.scatter(light, values, positions))
+
+        for cx, cz in changed:
+            for dx, dz in itertools.product((-1, 0, 1), (-1, 0, 1)):
+                neighbor = ((cx + dx) // tileSize, (cz + dz) // tileSize)
+                if neighbor != tile and neighbor in tiles and neighbor not in queued:
+                    queue.append(neighbor)
+                    queued.add(neighbor)
+
+        workDone += 1
+        workTotal = workDone + len(queue)
+        yield workDone, workTotal, progressInfo
+
+    for chunk in dirtyChunks:
+        chunk.needsLighting = False
+
+
+def mergeBoxes(boxes):
+    """ Returns a list of boxes where every group of overlapping boxes is replaced by their union. """
+    merged = []
+    for box in boxes:
+        while True:
+            for other in merged:
+                if box.intersect(other).volume:
+                    merged.remove(other)
+                    box = box.union(other)
+                    break
+            else:
+                break
+        merged.append(box)
+    return merged
+
+
+def boxLightsIter(level, boxes, maxChunks=64):
+    """ Relights only the parts of the level within 15 blocks of the given boxes, yielding
+    (done, total, info) progress tuples.
+
+    Light from outside those areas cannot reach the boxes and light from inside the boxes
+    cannot leave them, so the light already stored everywhere else is reused as is. Every
+    column of each area is relit from the top down, as anything above may shade the blocks
+    below.
+
+    Chunks flagged with needsLighting may have had their skylight reset by chunkChanged(), so
+    they are relit entirely. Areas larger than maxChunks chunks are passed to generateLightsIter
+    instead.
+    """
+    absorption = lightAbsorptionTable(level.materials)
+
+    def lightingArea(box):
+        box = box.expand(15, 0, 15)
+        return BoundingBox((box.minx, 0, box.minz), (box.width, level.Height, box.length))
+
+    def chunkArea(cx, cz):
+        return lightingArea(BoundingBox((cx << 4, 0, cz << 4), (16, level.Height, 16)))
+
+    areas = mergeBoxes(lightingArea(box) for box in boxes if box.volume)
+
+    needsLighting = set(level.chunksNeedingLighting)
+    while True:
+        flagged = set(cPos for area in areas for cPos in area.chunkPositions if cPos in needsLighting)
+        if not flagged:
+            break
+        needsLighting -= flagged
+        areas = mergeBoxes(areas + [chunkArea(cx, cz) for cx, cz in flagged])
+
+    chunksToRelight = []
+    for area in list(areas):
+        if area.chunkCount > maxChunks:
+            areas.remove(area)
+            chunksToRelight.extend(c for c in area.chunkPositions if level.containsChunk(*c))
+
+    if level.dimNo in (-1, 1):
+        lights = ("BlockLight",)
+    else:
+        lights = ("BlockLight", "SkyLight")
+
+    workTotal = len(areas) + len(chunksToRelight)
+    for i, area in enumerate(areas):
+        progressInfo = u"Lighting {0}".format(area)
+        log.info(progressInfo)
+
+        volume = LightingVolume(level, area.expand(1, 0, 1), absorption)
+        interior = (slice(1, -1), slice(1, -1), slice(None))
+
+        for light in lights:
+            values = volume.gather(light)
+            if light == "BlockLight":
+                values[interior] = volume.Emission[interior]
+            else:
+                values[interior] = volume.skyLightSeeds()[interior]
+
+            disperseLight(values, volume.Absorption)
+            volume.scatter(light, values, area.chunkPositions, area)
+
+        for (cx, cz), chunk in volume.chunks.iteritems():
+            if area.minx <= cx << 4 and (cx + 1) << 4 <= area.maxx and area.minz <= cz << 4 and (cz + 1) << 4 <= area.maxz:
+                chunk.needsLighting = False
+
+        yield i + 1, workTotal, progressInfo
+
+    if chunksToRelight:
+        for done, total, progressInfo in level.generateLightsIter(chunksToRelight):
+            yield len(areas) + done, len(areas) + total, progressInfo
+
+
+class _LightingMaterials(object):
+    """ The parts of a level's materials needed for lighting, small enough to send to worker processes. """
+
+    def __init__(self, lightAbsorption, lightEmission):
+        self.lightAbsorption = lightAbsorption
+        self.lightEmission = lightEmission
+
+
+class _RegionLevel(object):
+    """ Reads chunks straight from the region files of one or more world folders, searched in order,
+    with just enough of a level's interface for LightingVolume. """
+
+    def __init__(self, folders, height, dimNo, materials):
+        from infiniteworld import AnvilWorldFolder
+
+        self.folders = [AnvilWorldFolder(f) for f in folders]
+        self.Height = height
+        self.dimNo = dimNo
+        self.materials = materials
+
+    def getChunk(self, cx, cz):
+        from infiniteworld import AnvilChunkData
+
+        for folder in self.folders:
+            if folder.containsChunk(cx, cz):
+                break
+        else:
+            raise ChunkNotPresent((cx, cz))
+
+        try:
+            chunkData = AnvilChunkData(self, (cx, cz), nbt.load(buf=folder.readChunk(cx, cz)))
+        except (MemoryError, ChunkNotPresent):
+            raise
+        except Exception as e:
+            raise ChunkMalformed("Chunk {0} had an error: {1!r}".format((cx, cz), e), sys.exc_info()[2])
+
+        chunkData.HeightMap = computeChunkHeightMap(self.materials, chunkData.Blocks, zeros((16, 16), 'int32'))
+        return chunkData
+
+
+_workerLevel = None
+
+
+def _initLightingWorker(folders, height, dimNo, lightAbsorption, lightEmission):
+    global _workerLevel
+    _workerLevel = _RegionLevel(folders, height, dimNo, _LightingMaterials(lightAbsorption, lightEmission))
+
+
+def _lightTile(positions):
+    """ Lights the chunks at positions from scratch, together with a one chunk apron. Light travels
+    less than a chunk, so the apron holds every block that can light the tile. Returns a list of
+    (chunkPosition, BlockLight, SkyLight) for the chunks of the tile. """
+    level = _workerLevel
+
+    mincx = min(cx for cx, cz in positions) - 1
+    mincz = min(cz for cx, cz in positions) - 1
+    maxcx = max(cx for cx, cz in positions) + 2
+    maxcz = max(cz for cx, cz in positions) + 2
+    box = BoundingBox((mincx << 4, 0, mincz << 4),
+                      ((maxcx - mincx) << 4, level.Height, (maxcz - mincz) << 4))
+
+    volume = LightingVolume(level, box)
+
+    blockLight = volume.Emission.copy()
+    disperseLight(blockLight, volume.Absorption)
+
+    skyLight = None
+    if level.dimNo not in (-1, 1):
+        skyLight = volume.skyLightSeeds()
+        disperseLight(skyLight, volume.Absorption)
+
+    results = []
+    for cx, cz in positions:
+        if (cx, cz) not in volume.chunks:
+            continue
+        src, dst = volume.chunkSlices(cx, cz)
+        results.append(((cx, cz),
+                        blockLight[dst].copy(),
+                        skyLight[dst].copy() if skyLight is not None else None))
+
+    return results
+
+
+def parallelLightsIter(level, dirtyChunkPositions, processes=None, tileSize=8):
+    """ Relights the given chunks of an MCInfdevOldLevel using a pool of worker processes, yielding
+    (done, total, info) progress tuples.
+
+    The chunks and their neighbors are split into tiles of tileSize x tileSize chunks. Each worker
+    reads a tile and its one chunk apron straight from the region files and lights it from scratch,
+    and the results for the tile itself are copied back into the level here. Chunks changed since
+    the level was last saved are written to the level's work folder first, and the work folder is
+    copied aside so workers never read region files while this process writes them.
+
+    Where worker processes can't be forked (Windows), or when the level has unsaved changes it
+    can't write out, this falls back to stitchedLightsIter.
+
+    The workers are forked from the calling process, so a GUI process holding a display or an
+    OpenGL context should only use this when the user asked for it.
+    """
+    dirtyChunkPositions = list(dirtyChunkPositions)
+
+    readonly = getattr(level, "readonly", True)
+    if sys.platform == "win32" or (readonly and any(True for _ in level.listDirtyChunks())):
+        for progress in stitchedLightsIter(level, dirtyChunkPositions, tileSize):
+            yield progress
+        return
+
+    # relight all blocks in neighboring chunks in case their light source disappeared.
+    targets = set()
+    for cx, cz in dirtyChunkPositions:
+        for dx, dz in itertools.product((-1, 0, 1), (-1, 0, 1)):
+            if level.containsChunk(cx + dx, cz + dz):
+                targets.add((cx + dx, cz + dz))
+
+    tiles = {}
+    for cx, cz in targets:
+        tiles.setdefault((cx // tileSize, cz // tileSize), []).append((cx, cz))
+    tiles = [sorted(tiles[t]) for t in sorted(tiles)]
+
+    progressInfo = u"Lighting {0} chunks".format(len(dirtyChunkPositions))
+    log.info(progressInfo)
+
+    folders = [level.worldFolder.filename]
+    snapshotFolder = None
+    if not readonly:
+        for cx, cz in list(level.listDirtyChunks()):
+            level.unsavedWorkFolder.saveChunk(cx, cz, level._getChunkData(cx, cz).savedTagData())
+        level.unsavedWorkFolder.closeRegions()
+
+        snapshotFolder = os.path.join(tempfile.mkdtemp(prefix="mcedit-lighting"), "unsaved")
+        shutil.copytree(level.unsavedWorkFolder.filename, snapshotFolder)
+        folders.insert(0, snapshotFolder)
+
+    processes = min(processes or multiprocessing.cpu_count(), len(tiles)) or 1
+    pool = multiprocessing.Pool(processes, _initLightingWorker,
+                                (folders, level.Height, level.dimNo,
+                                 array(level.materials.lightAbsorption), array(level.materials.lightEmission)))
+    dirtySet = set(dirtyChunkPositions)
+
+    try:
+        for i, results in enumerate(pool.imap_unordered(_lightTile, tiles)):
+            for cPos, blockLight, skyLight in results:
+                chunk = level.getChunk(*cPos)
+                chunk.BlockLight[:] = blockLight
+                if skyLight is not None:
+                    chunk.SkyLight[:] = skyLight
+
+                if cPos in dirtySet:
+                    chunk.chunkChanged(False)
+                    chunk.needsLighting = False
+                else:
+                    chunk.dirty = True
+
+            yield i + 1, len(tiles), progressInfo
+
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        if snapshotFolder is not None:
+            shutil.rmtree(os.path.dirname(snapshotFolder), True)
@@ -1,5 +1,7 @@
 from logging import getLogger
 from numpy import zeros, rollaxis, indices
+import numpy
+import hashlib
 import traceback
 from os.path import join
 from collections import defaultdict
@@ -9,6 +11,7 @@ import json
 import os
 import pkg_resources
 import id_definitions
+from directories import getCacheDir
 
 NOTEX = (496, 496)
 
@@ -100,6 +103,44 @@ class BlockstateAPI(object):
                 self.blockstates = json.load(def_file)
 
         self.material_map[self._mats] = self
+        self._buildIndexes()
+
+    def _buildIndexes(self):
+        """
+        Precomputes both directions of the lookup. self.states lists every distinct (name, properties)
+        Blockstate, starting with the unknown one. stateIndexes maps each (id, data) pair to its index in
+        self.states, and stateIDs maps each index back to an (id, data) pair, so whole arrays of blocks or
+        palette indexes can be converted with a numpy gather. _stateToID maps a Blockstate's name and
+        frozen set of properties to the (id, data) pair blockstateToID returns for it.
+        """
+        self.states = [("<Unknown>", {})]
+        self.stateIndexes = zeros((id_limit, 16), 'uint16')
+        self._stateToID = {}
+
+        for prefix, blocks in self.blockstates.iteritems():
+            for name, block in blocks.iteritems():
+                for prop in block["properties"]:
+                    properties = dict((key, value) for (key, value) in prop.iteritems() if key != "<data>")
+                    key = (prefix, name, frozenset(properties.iteritems()))
+                    if key not in self._stateToID:
+                        self._stateToID[key] = self._findID(block, properties)
+
+        known = self.blockstates.get("minecraft", {})
+        for bid, name in self.block_map.iteritems():
+            name = name.replace("minecraft:", "")
+            if name not in known or not 0 <= bid < id_limit:
+                continue
+            self.stateIndexes[bid] = len(self.states)
+            self.states.append((name, {}))
+            # The first property set with a data value wins, as in a linear scan.
+            for prop in reversed(known[name]["properties"]):
+                if 0 <= prop["<data>"] < 16:
+                    self.stateIndexes[bid, prop["<data>"]] = len(self.states)
+                    self.states.append((name, dict((key, value) for (key, value) in prop.iteritems() if key != "<data>")))
+
+        self.stateIDs = zeros((len(self.states), 2), 'int32')
+        for i, (name, properties) in enumerate(self.states):
+            self.stateIDs[i] = self.blockstateToID(name, properties)
 
     def idToBlockstate(self, bid, data):
         """
@@ -112,24 +153,25 @@ class BlockstateAPI(object):
         :return: A tuple of BlockState name and it's properties
         :rtype: tuple
         """
-        if bid not in self.block_map:
-            return "<Unknown>", {}
-        
-        name = self.block_map[bid].replace("minecraft:", "")
-
-        if name not in self.blockstates["minecraft"]:
+        if not 0 <= bid < id_limit:
             return "<Unknown>", {}
-        
-        properties = {}
-        for prop in self.blockstates["minecraft"][name]["properties"]: # TODO: Change this if MCEdit's mod support ever improves
-            if prop["<data>"] == data:
-                for field in prop.keys():
-                    if field == "<data>":
-                        continue
-                    properties[field] = prop[field]
-                return name, properties
-        return name, properties
+        if not 0 <= data < 16:
+            # No Blockstate has this data value
+            return self.states[self.stateIndexes[bid, 0]][0], {}
+        name, properties = self.states[self.stateIndexes[bid, data]]
+        return name, dict(properties)
     
+    @staticmethod
+    def _findID(block, properties):
+        for prop in block["properties"]:
+            correct = True
+            for (key, value) in properties.iteritems():
+                if key in prop:
+                    correct = correct and (prop[key] == value)
+            if correct:
+                return block["id"], prop["<data>"]
+        return block["id"], 0
+
     def blockstateToID(self, name, properties):
         """
         Converts from a BlockState to a numerical ID/Data pair
@@ -146,21 +188,19 @@ class BlockstateAPI(object):
             prefix, name = name.split(":")
         else:
             prefix = "minecraft"
-            
+
+        try:
+            return self._stateToID[prefix, name, frozenset(properties.iteritems())]
+        except (KeyError, TypeError):
+            pass
+
         if prefix not in self.blockstates:
             return -1, -1
         elif name not in self.blockstates[prefix]:
             return -1, -1
-        
-        bid = self.blockstates[prefix][name]["id"]
-        for prop in self.blockstates[prefix][name]["properties"]:
-            correct = True
-            for (key, value) in properties.iteritems():
-                if key in prop:
-                    correct = correct and (prop[key] == value)
-            if correct:
-                return bid, prop["<data>"]
-        return bid, 0
+
+        # Only some of the properties are given, or values that no Blockstate has.
+        return self._findID(self.blockstates[prefix][name], properties)
     
     @staticmethod
     def stringifyBlockstate(name, properties):
@@ -391,9 +431,10 @@ class MCMaterials(object):
         print "Game Version: " + game_version
         game_version = game_version.replace('java ', '')
         blockyaml = id_definitions.ids_loader(game_version, json_dict=True)
+        blockstate_definition_file = None
         if game_version == 'PE' or game_version == 'old pocket':
             f_name = 'pocket.json'
-            self.setup_blockstates("pe_blockstates.json")
+            blockstate_definition_file = "pe_blockstates.json"
             meth = build_pocket_materials
         elif game_version == 'javalevel':
             # No reference to materials in javalevel.py and no related JSon file, let use the 'classic' ones?
@@ -404,12 +445,15 @@ class MCMaterials(object):
             meth = build_indev_materials
         else:
             f_name = 'minecraft.json'
-            self.setup_blockstates("pc_blockstates.json")
+            blockstate_definition_file = "pc_blockstates.json"
             meth = build_alpha_materials
         if blockyaml:
             self.addJSONBlocks(blockyaml)
         else:
             self.addJSONBlocksFromFile(f_name)
+        # The Blockstate lookups are indexed by the block IDs, so they are set up once the blocks are known.
+        if blockstate_definition_file:
+            self.setup_blockstates(blockstate_definition_file)
         meth()
 #         build_api_material_map()
 
@@ -1286,14 +1330,55 @@ allMaterials = (alphaMaterials, classicMaterials, pocketMaterials, indevMaterial
 
 _conversionFuncs = {}
 
+# Guessed conversion tables are saved here, named by a digest of both materials' block definitions, so
+# each pair of definitions is only guessed once and not again in every session or filter process.
+conversionTableDir = os.path.join(getCacheDir(), u"ConversionTables")
 
-def conversionFunc(destMats, sourceMats):
-    if destMats is sourceMats:
-        return nullConversion
-    func = _conversionFuncs.get((destMats, sourceMats))
-    if func:
-        return func
+# Bump this when guessFilterTable or _filterTable change, to ignore the tables cached before.
+_conversionTableVersion = 1
+
+
+def _materialsDigest(mats):
+    """ A digest of the names, aliases and search terms of every block in mats, which are all
+    guessFilterTable looks at. """
+    digest = hashlib.sha1()
+    for b in mats.allBlocks:
+        digest.update(repr((b.ID, b.blockData, b.name, b.aka, b.search)))
+    return digest.hexdigest()
+
+
+def _conversionTablePath(destMats, sourceMats):
+    key = "%d %s %s" % (_conversionTableVersion, _materialsDigest(destMats), _materialsDigest(sourceMats))
+    return os.path.join(conversionTableDir, hashlib.sha1(key).hexdigest() + ".npy")
+
+
+def _loadConversionTable(path):
+    try:
+        table = numpy.load(path)
+    except (IOError, ValueError):
+        return None
+    if table.shape != (id_limit, 16, 2):
+        return None
+    return table
 
+
+def _saveConversionTable(path, table):
+    # Written under a temporary name and renamed, so processes converting at the same time never
+    # load a partial table.
+    temp = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        if not os.path.exists(conversionTableDir):
+            os.makedirs(conversionTableDir)
+        with open(temp, 'wb') as f:
+            numpy.save(f, table)
+        os.rename(temp, path)
+    except (IOError, OSError) as e:
+        log.warning("Could not cache conversion table %s: %s", path, e)
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+def _guessConversionTable(destMats, sourceMats):
     filters, unavailable = guessFilterTable(sourceMats, destMats)
     log.debug("")
     log.debug("%s %s %s", sourceMats.name, "=>", destMats.name)
@@ -1303,7 +1388,22 @@ def conversionFunc(destMats, sourceMats):
     log.debug("")
     log.debug("Missing blocks: %s", [sourceMats.blockWithID(*a).name for a in unavailable])
 
-    table = _filterTable(filters, unavailable, (35, 0))
+    return _filterTable(filters, unavailable, (35, 0))
+
+
+def conversionFunc(destMats, sourceMats):
+    if destMats is sourceMats:
+        return nullConversion
+    func = _conversionFuncs.get((destMats, sourceMats))
+    if func:
+        return func
+
+    path = _conversionTablePath(destMats, sourceMats)
+    table = _loadConversionTable(path)
+    if table is None:
+        table = _guessConversionTable(destMats, sourceMats)
+        _saveConversionTable(path, table)
+
     func = filterConversion(table)
     _conversionFuncs[(destMats, sourceMats)] = func
     return func
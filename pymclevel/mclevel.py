@@ -182,7 +182,7 @@ import os
 from pocket import PocketWorld
 from leveldbpocket import PocketLeveldbWorld
 from pymclevel import leveldbpocket
-from schematic import INVEditChest, MCSchematic, ZipSchematic
+from schematic import DiskBackedSchematic, INVEditChest, MCSchematic, ZipSchematic
 import sys
 import traceback
 
@@ -230,6 +230,10 @@ def fromFile(filename, loadInfinite=True, readonly=False):
     if os.path.isdir(filename):
         logging.exception("World load failed, trying to open a directory instead of a file")
 
+    if DiskBackedSchematic._isLevel(filename):
+        log.info(u"Detected large Schematic, mapping it from disk.")
+        return DiskBackedSchematic(filename=filename)
+
     f = file(filename, 'rb')
     rawdata = f.read()
     f.close()
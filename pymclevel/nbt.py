@@ -23,6 +23,7 @@ import gzip
 import itertools
 import logging
 import struct
+import threading
 import zlib
 from cStringIO import StringIO
 
@@ -59,6 +60,50 @@ TAG_LONG_ARRAY = 12
 TAG_SHORT_ARRAY = -1
 
 
+class NBTCodec(object):
+    """Byte order used to read and write NBT data. Java edition NBT is big endian, Pocket edition NBT is
+    little endian. Pass one of the BIG_ENDIAN or LITTLE_ENDIAN instances to load() and save() instead of
+    changing module state, so both formats can be handled at the same time from any thread."""
+
+    def __init__(self, byteorder):
+        self.byteorder = byteorder
+        self.fmts = {
+            TAG_BYTE: struct.Struct(byteorder + "b"),
+            TAG_SHORT: struct.Struct(byteorder + "h"),
+            TAG_INT: struct.Struct(byteorder + "i"),
+            TAG_LONG: struct.Struct(byteorder + "q"),
+            TAG_FLOAT: struct.Struct(byteorder + "f"),
+            TAG_DOUBLE: struct.Struct(byteorder + "d"),
+        }
+        self.string_len_fmt = struct.Struct(byteorder + "H")
+        self.array_len_fmt = struct.Struct(byteorder + "I")
+        self.dtypes = {
+            TAG_BYTE_ARRAY: numpy.dtype("uint8"),
+            TAG_INT_ARRAY: numpy.dtype(byteorder + "u4"),
+            TAG_LONG_ARRAY: numpy.dtype(byteorder + "q"),
+            TAG_SHORT_ARRAY: numpy.dtype(byteorder + "u2"),
+        }
+
+    @property
+    def big_endian(self):
+        return self.byteorder == ">"
+
+    def __repr__(self):
+        return "NBTCodec(%r)" % self.byteorder
+
+
+BIG_ENDIAN = NBTCodec(">")
+LITTLE_ENDIAN = NBTCodec("<")
+
+_codec_state = threading.local()
+
+
+def current_codec():
+    """The codec used by load() and save() when none is passed: BIG_ENDIAN, unless the calling thread is
+    inside a littleEndianNBT() block."""
+    return getattr(_codec_state, "codec", BIG_ENDIAN)
+
+
 class TAG_Value(object):
     """Simple values. Subclasses override fmt to change the type and size.
     Subclasses may set data_type instead of overriding setValue for automatic data type coercion"""
@@ -99,10 +144,11 @@ class TAG_Value(object):
     @classmethod
     def load_from(cls, ctx):
         data = ctx.data[ctx.offset:]
+        fmt = ctx.codec.fmts[cls.tagID]
         # 'data' may be empty or not have the required length. Shall we bypass?
         value = None
         try:
-            (value,) = cls.fmt.unpack_from(data)
+            (value,) = fmt.unpack_from(data)
         except Exception as e:
             if DEBUG_PE:
                 fp = open(dump_fName)
@@ -113,7 +159,7 @@ class TAG_Value(object):
                     "----------\nctx.data (length: {lcd}):\n{cd}\n"
                     "..........\ndata (length: {lrd}):\n{rd}\n"
                     "''''''''''\nctx.offset:\n{co}\n"
-                    "^^^^^^^^^^\ncls.fmt.format: {cf}\n***\n".format(e=e, cd=repr(ctx.data), rd=repr(data), co=ctx.offset, cf=cls.fmt.format,
+                    "^^^^^^^^^^\ncls.fmt.format: {cf}\n***\n".format(e=e, cd=repr(ctx.data), rd=repr(data), co=ctx.offset, cf=fmt.format,
                                                                lcd=len(ctx.data), lrd=len(data)
                                                               )
                 )
@@ -127,21 +173,32 @@ class TAG_Value(object):
             self.name = 'Unknown'
         else:
             self = cls(value=value)
-        ctx.offset += self.fmt.size
+        ctx.offset += fmt.size
         return self
 
     def __repr__(self):
         return "<%s name=\"%s\" value=%r>" % (str(self.__class__.__name__), self.name, self.value)
 
+    def copy(self):
+        """Returns a copy of this tag. Much faster than copy.deepcopy, which goes through a memo
+        dictionary and reflection for every tag of the tree."""
+        tag = self.__class__.__new__(self.__class__)
+        tag._name = self._name
+        tag._value = self._value
+        return tag
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
     def write_tag(self, buf):
         buf.write(chr(self.tagID))
 
-    def write_name(self, buf):
+    def write_name(self, buf, codec=BIG_ENDIAN):
         if self.name is not None:
-            write_string(self.name, buf)
+            write_string(self.name, buf, codec)
 
-    def write_value(self, buf):
-        buf.write(self.fmt.pack(self.value))
+    def write_value(self, buf, codec=BIG_ENDIAN):
+        buf.write(codec.fmts[self.tagID].pack(self.value))
 
     def isCompound(self):
         return False
@@ -191,7 +248,11 @@ class TAG_Double(TAG_Value):
 
 class TAG_Byte_Array(TAG_Value):
     """Like a string, but for binary data. Four length bytes instead of
-    two. Value is a numpy array, and you can change its elements"""
+    two. Value is a numpy array, and you can change its elements.
+
+    Copies made with copy() share the array with the original tag until the value
+    of either one is accessed. A tag whose array was already handed out through value
+    is copied at once instead."""
 
     tagID = TAG_BYTE_ARRAY
 
@@ -202,45 +263,71 @@ class TAG_Byte_Array(TAG_Value):
         self.value = value
 
     def __repr__(self):
-        return "<%s name=%s length=%d>" % (self.__class__, self.name, len(self.value))
+        return "<%s name=%s length=%d>" % (self.__class__, self.name, len(self._value))
 
-    __slots__ = ('_name', '_value')
+    __slots__ = ('_name', '_value', '_shared', '_exposed')
+
+    @property
+    def value(self):
+        if self._shared:
+            self._value = self._value.copy()
+            self._shared = False
+        self._exposed = True
+        return self._value
+
+    @value.setter
+    def value(self, newVal):
+        self._value = self.data_type(newVal)
+        self._shared = self._exposed = False
 
     def data_type(self, value):
         return array(value, self.dtype)
 
+    def copy(self):
+        tag = TAG_Value.copy(self)
+        tag._exposed = False
+        if self._exposed:
+            # Whoever holds the array may still write to it, so the copy can't share it.
+            tag._value = self._value.copy()
+            tag._shared = False
+        else:
+            tag._shared = self._shared = True
+        return tag
+
     dtype = numpy.dtype('uint8')
 
     @classmethod
     def load_from(cls, ctx):
         data = ctx.data[ctx.offset:]
-        (string_len,) = TAG_Int.fmt.unpack_from(data)
-        value = fromstring(data[4:string_len * cls.dtype.itemsize + 4], cls.dtype)
+        dtype = ctx.codec.dtypes[cls.tagID]
+        (string_len,) = ctx.codec.array_len_fmt.unpack_from(data)
+        value = fromstring(data[4:string_len * dtype.itemsize + 4], dtype)
         self = cls(value)
-        ctx.offset += string_len * cls.dtype.itemsize + 4
+        ctx.offset += string_len * dtype.itemsize + 4
         return self
 
-    def write_value(self, buf):
-        value_str = self.value.tostring()
-        buf.write(struct.pack(">I%ds" % (len(value_str),), self.value.size, value_str))
+    def write_value(self, buf, codec=BIG_ENDIAN):
+        value = numpy.asarray(self._value, codec.dtypes[self.tagID])
+        buf.write(codec.array_len_fmt.pack(value.size))
+        buf.write(value.tostring())
 
 
 class TAG_Int_Array(TAG_Byte_Array):
     """An array of big-endian 32-bit integers"""
     tagID = TAG_INT_ARRAY
-    __slots__ = ('_name', '_value')
+    __slots__ = ('_name', '_value', '_shared', '_exposed')
     dtype = numpy.dtype('>u4')
 
 
 class TAG_Short_Array(TAG_Int_Array):
     """An array of big-endian 16-bit integers. Not official, but used by some mods."""
     tagID = TAG_SHORT_ARRAY
-    __slots__ = ('_name', '_value')
+    __slots__ = ('_name', '_value', '_shared', '_exposed')
     dtype = numpy.dtype('>u2')
 
 class TAG_Long_Array(TAG_Int_Array):
     tagID = TAG_LONG_ARRAY
-    __slots__ = ('_name', '_value')
+    __slots__ = ('_name', '_value', '_shared', '_exposed')
     dtype = numpy.dtype('>q')
 
 
@@ -276,24 +363,26 @@ class TAG_String(TAG_Value):
         value = load_string(ctx)
         return cls(value)
 
-    def write_value(self, buf):
-        write_string(self._value, buf)
-
-string_len_fmt = struct.Struct(">H")
+    def write_value(self, buf, codec=BIG_ENDIAN):
+        write_string(self._value, buf, codec)
 
 
 def load_string(ctx):
     data = ctx.data[ctx.offset:]
-    (string_len,) = string_len_fmt.unpack_from(data)
+    (string_len,) = ctx.codec.string_len_fmt.unpack_from(data)
 
     value = data[2:string_len + 2].tostring()
     ctx.offset += string_len + 2
     return value
 
 
-def write_string(string, buf):
+def write_string(string, buf, codec=BIG_ENDIAN):
     encoded = string.encode('utf-8')
-    buf.write(struct.pack(">h%ds" % (len(encoded),), len(encoded), encoded))
+    # The length is unsigned, as in load_string, so strings up to 65535 bytes can be saved.
+    if len(encoded) > 0xffff:
+        raise ValueError("String of %d bytes is too long for NBT" % len(encoded))
+    buf.write(codec.string_len_fmt.pack(len(encoded)))
+    buf.write(encoded)
 
 
 # noinspection PyMissingConstructor
@@ -347,20 +436,23 @@ class TAG_Compound(TAG_Value, collections.MutableMapping):
 
         return self
 
-    def save(self, filename_or_buf=None, compressed=True):
+    def save(self, filename_or_buf=None, compressed=True, codec=None):
         """
         Save the TAG_Compound element to a file. Since this element is the root tag, it can be named.
 
         Pass a filename to save the data to a file. Pass a file-like object (with a read() method)
         to write the data to that object. Pass nothing to return the data as a string.
+        Pass LITTLE_ENDIAN as codec to write Pocket edition NBT.
         """
         if self.name is None:
             self.name = ""
+        if codec is None:
+            codec = current_codec()
 
         buf = StringIO()
         self.write_tag(buf)
-        self.write_name(buf)
-        self.write_value(buf)
+        self.write_name(buf, codec)
+        self.write_value(buf, codec)
         data = buf.getvalue()
 
         if compressed:
@@ -379,11 +471,11 @@ class TAG_Compound(TAG_Value, collections.MutableMapping):
         else:
             filename_or_buf.write(data)
 
-    def write_value(self, buf):
+    def write_value(self, buf, codec=BIG_ENDIAN):
         for tag in self.value:
             tag.write_tag(buf)
-            tag.write_name(buf)
-            tag.write_value(buf)
+            tag.write_name(buf, codec)
+            tag.write_value(buf, codec)
 
         buf.write("\x00")
 
@@ -435,6 +527,12 @@ class TAG_Compound(TAG_Value, collections.MutableMapping):
     def get_all(self, key):
         return [v for v in self._value if v.name == key]
 
+    def copy(self):
+        tag = self.__class__.__new__(self.__class__)
+        tag._name = self._name
+        tag._value = [t.copy() for t in self._value]
+        return tag
+
     def isCompound(self):
         return True
 
@@ -476,8 +574,9 @@ class TAG_List(TAG_Value, collections.MutableSequence):
         self.list_type = ctx.data[ctx.offset]
         ctx.offset += 1
 
-        (list_length,) = TAG_Int.fmt.unpack_from(ctx.data, ctx.offset)
-        ctx.offset += TAG_Int.fmt.size
+        int_fmt = ctx.codec.fmts[TAG_INT]
+        (list_length,) = int_fmt.unpack_from(ctx.data, ctx.offset)
+        ctx.offset += int_fmt.size
 
         for i in xrange(list_length):
             tag = tag_classes[self.list_type].load_from(ctx)
@@ -485,16 +584,23 @@ class TAG_List(TAG_Value, collections.MutableSequence):
 
         return self
 
-    def write_value(self, buf):
+    def write_value(self, buf, codec=BIG_ENDIAN):
         buf.write(chr(self.list_type))
-        buf.write(TAG_Int.fmt.pack(len(self.value)))
+        buf.write(codec.fmts[TAG_INT].pack(len(self.value)))
         for i in self.value:
-            i.write_value(buf)
+            i.write_value(buf, codec)
 
     def check_tag(self, value):
         if value.tagID != self.list_type:
             raise TypeError("Invalid type %s for TAG_List(%s)" % (value.__class__, tag_classes[self.list_type]))
 
+    def copy(self):
+        tag = self.__class__.__new__(self.__class__)
+        tag._name = self._name
+        tag.list_type = self.list_type
+        tag._value = [t.copy() for t in self._value]
+        return tag
+
     # --- collection methods ---
 
     def __iter__(self):
@@ -551,11 +657,11 @@ def try_gunzip(data):
     return data
 
 
-def load(filename="", buf=None):
+def load(filename="", buf=None, codec=None):
     """
     Unserialize data from an NBT file and return the root TAG_Compound object. If filename is passed,
     reads from the file, otherwise uses data from buf. Buf can be a buffer object with a read() method or a string
-    containing NBT data.
+    containing NBT data. Pass LITTLE_ENDIAN as codec to read Pocket edition NBT.
     """
     if filename:
         buf = file(filename, "rb")
@@ -563,14 +669,17 @@ def load(filename="", buf=None):
     if hasattr(buf, "read"):
         buf = buf.read()
 
-    return _load_buffer(try_gunzip(buf))
+    if codec is None:
+        codec = current_codec()
+
+    return _load_buffer(try_gunzip(buf), codec)
 
 
 class load_ctx(object):
     pass
 
 
-def _load_buffer(buf):
+def _load_buffer(buf, codec=BIG_ENDIAN):
     if isinstance(buf, str):
         buf = fromstring(buf, 'uint8')
     data = buf
@@ -587,6 +696,7 @@ def _load_buffer(buf):
     ctx = load_ctx()
     ctx.offset = 1
     ctx.data = data
+    ctx.codec = codec
 
     tag_name = load_string(ctx)
     tag = TAG_Compound.load_from(ctx)
@@ -599,61 +709,24 @@ def _load_buffer(buf):
     return tag
 
 
-__all__ = [a.__name__ for a in tag_classes.itervalues()] + ["load", "gunzip"]
+__all__ = [a.__name__ for a in tag_classes.itervalues()] + ["load", "gunzip", "NBTCodec", "BIG_ENDIAN",
+                                                             "LITTLE_ENDIAN"]
 
 
 @contextmanager
 def littleEndianNBT():
     """
     Pocket edition NBT files are encoded in little endian, instead of big endian.
-    This sets all the required paramaters to read little endian NBT, and makes sure they get set back after usage.
+    Makes load() and save() default to LITTLE_ENDIAN for the calling thread until the block exits.
+    Other threads are not affected; prefer passing codec=LITTLE_ENDIAN explicitly.
     :return: None
     """
-
-    # We need to override the function to access the hard-coded endianness.
-    def override_write_string(string, buf):
-        encoded = string.encode('utf-8')
-        buf.write(struct.pack("<h%ds" % (len(encoded),), len(encoded), encoded))
-
-    def reset_write_string(string, buf):
-        encoded = string.encode('utf-8')
-        buf.write(struct.pack(">h%ds" % (len(encoded),), len(encoded), encoded))
-
-    def override_byte_array_write_value(self, buf):
-        value_str = self.value.tostring()
-        buf.write(struct.pack("<I%ds" % (len(value_str),), self.value.size, value_str))
-
-    def reset_byte_array_write_value(self, buf):
-        value_str = self.value.tostring()
-        buf.write(struct.pack(">I%ds" % (len(value_str),), self.value.size, value_str))
-
-    global string_len_fmt
-    string_len_fmt = struct.Struct("<H")
-    TAG_Byte.fmt = struct.Struct("<b")
-    TAG_Short.fmt = struct.Struct("<h")
-    TAG_Int.fmt = struct.Struct("<i")
-    TAG_Long.fmt = struct.Struct("<q")
-    TAG_Float.fmt = struct.Struct("<f")
-    TAG_Double.fmt = struct.Struct("<d")
-    TAG_Int_Array.dtype = numpy.dtype("<u4")
-    TAG_Long_Array.dtype = numpy.dtype("<q")
-    TAG_Short_Array.dtype = numpy.dtype("<u2")
-    global write_string
-    write_string = override_write_string
-    TAG_Byte_Array.write_value = override_byte_array_write_value
-    yield
-    string_len_fmt = struct.Struct(">H")
-    TAG_Byte.fmt = struct.Struct(">b")
-    TAG_Short.fmt = struct.Struct(">h")
-    TAG_Int.fmt = struct.Struct(">i")
-    TAG_Long.fmt = struct.Struct(">q")
-    TAG_Float.fmt = struct.Struct(">f")
-    TAG_Double.fmt = struct.Struct(">d")
-    TAG_Int_Array.dtype = numpy.dtype(">u4")
-    TAG_Long_Array.dtype = numpy.dtype(">q")
-    TAG_Short_Array.dtype = numpy.dtype(">u2")
-    write_string = reset_write_string
-    TAG_Byte_Array.write_value = reset_byte_array_write_value
+    previous = current_codec()
+    _codec_state.codec = LITTLE_ENDIAN
+    try:
+        yield
+    finally:
+        _codec_state.codec = previous
 
 
 def nested_string(tag, indent_string="  ", indent=0):
@@ -689,7 +762,8 @@ try:
 #     else:
         from _nbt import (load, TAG_Byte, TAG_Short, TAG_Int, TAG_Long, TAG_Float, TAG_Double, TAG_String,
                           TAG_Byte_Array, TAG_List, TAG_Compound, TAG_Int_Array, TAG_Long_Array, TAG_Short_Array, NBTFormatError,
-                          littleEndianNBT, nested_string, gunzip, hexdump)
+                          NBTCodec, BIG_ENDIAN, LITTLE_ENDIAN, current_codec, littleEndianNBT, nested_string, gunzip,
+                          hexdump)
 except ImportError as err:
     log.error("Failed to import Cythonized nbt file. Running on (very slow) pure-python nbt fallback.")
     log.error("(Did you forget to run 'setup.py build_ext --inplace'?)")
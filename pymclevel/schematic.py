@@ -5,8 +5,11 @@ Created on Jul 22, 2011
 """
 import atexit
 from contextlib import closing
+import gzip
 import os
 import shutil
+import struct
+import tempfile
 import zipfile
 from logging import getLogger
 
@@ -17,17 +20,79 @@ from level import MCLevel, EntityLevel
 from materials import alphaMaterials, MCMaterials, namedMaterials
 from mclevelbase import exhaust
 import nbt
-from numpy import array, swapaxes, uint8, zeros, resize, ndenumerate
+from numpy import append, array, argsort, memmap, swapaxes, uint8, unique, zeros, resize
 from release import TAG as RELEASE_TAG
 import math
-import copy
+from itertools import izip, product
 
 log = getLogger(__name__)
 
-__all__ = ['MCSchematic', 'INVEditChest', 'StructureNBT']
+__all__ = ['MCSchematic', 'DiskBackedSchematic', 'INVEditChest', 'StructureNBT']
 
 DEBUG = True
 
+# Selections with more blocks than this are extracted into a DiskBackedSchematic.
+DISK_BACKED_VOLUME = 1 << 26
+
+
+def _writeByteArray(f, name, length, parts):
+    """ Writes a named TAG_Byte_Array of the given length to the uncompressed NBT stream f, taking its
+    contents from the arrays in parts one at a time. """
+    f.write(struct.pack(">bH", 7, len(name)) + name + struct.pack(">I", length))  # 7 is TAG_Byte_Array
+    for part in parts:
+        f.write(part.tostring())
+
+
+# Bytes taken by the value of each fixed-size tag type, and by each item of each array tag type.
+_tagValueSizes = {1: 1, 2: 2, 3: 4, 4: 8, 5: 4, 6: 8}
+_arrayItemSizes = {7: 1, 11: 4, 12: 8}
+
+
+def _skipTagValue(data, offset, tagID):
+    """ Returns the offset just past the value of the tag of type tagID starting at offset in data. """
+    if tagID in _tagValueSizes:
+        return offset + _tagValueSizes[tagID]
+    if tagID in _arrayItemSizes:
+        (length,) = struct.unpack_from(">I", data, offset)
+        return offset + 4 + length * _arrayItemSizes[tagID]
+    if tagID == 8:  # TAG_String
+        (length,) = struct.unpack_from(">H", data, offset)
+        return offset + 2 + length
+    if tagID == 9:  # TAG_List
+        itemID, length = struct.unpack_from(">bI", data, offset)
+        offset += 5
+        for _ in xrange(length):
+            offset = _skipTagValue(data, offset, itemID)
+        return offset
+    if tagID == 10:  # TAG_Compound
+        while data[offset]:
+            (nameLength,) = struct.unpack_from(">H", data, offset + 1)
+            offset = _skipTagValue(data, offset + 3 + nameLength, data[offset])
+        return offset + 1
+    raise nbt.NBTFormatError("Unknown tag type %d at offset %d" % (tagID, offset))
+
+
+def _mapSchematicFile(path):
+    """ Memory-maps the uncompressed schematic at path. Returns its root tag, loaded without the Blocks,
+    Data and AddBlocks arrays, and a dict of those arrays as views of the mapped file. """
+    data = memmap(path, uint8, 'r+')
+    (nameLength,) = struct.unpack_from(">H", data, 1)
+    offset = 3 + nameLength
+    tags = [data[:offset].tostring()]
+    arrays = {}
+    while data[offset]:
+        tagID = data[offset]
+        (nameLength,) = struct.unpack_from(">H", data, offset + 1)
+        name = data[offset + 3:offset + 3 + nameLength].tostring()
+        end = _skipTagValue(data, offset + 3 + nameLength, tagID)
+        if tagID == 7 and name in ("Blocks", "Data", "AddBlocks"):
+            arrays[name] = data[offset + 7 + nameLength:end]
+        else:
+            tags.append(data[offset:end].tostring())
+        offset = end
+    tags.append("\x00")
+    return nbt.load(buf="".join(tags)), arrays
+
 
 class MCSchematic(EntityLevel):
     materials = alphaMaterials
@@ -81,35 +146,7 @@ class MCSchematic(EntityLevel):
             l = self.root_tag["Length"].value
             h = self.root_tag["Height"].value
 
-            if DEBUG: log.debug(u"Reshaping blocks.")
-            self._Blocks = self.root_tag["Blocks"].value.astype('uint16').reshape(h, l, w)  # _Blocks is y, z, x
-            del self.root_tag["Blocks"]
-            if "AddBlocks" in self.root_tag:
-                if DEBUG: log.debug(u"Processing AddBlocks.")
-                # Use WorldEdit's "AddBlocks" array to load and store the 4 high bits of a block ID.
-                # Unlike Minecraft's NibbleArrays, this array stores the first block's bits in the
-                # 4 high bits of the first byte.
-
-                size = (h * l * w)
-
-                # If odd, add one to the size to make sure the adjacent slices line up.
-                add = zeros(size + (size & 1), 'uint16')
-
-                # Fill the even bytes with data
-                add[::2] = resize(self.root_tag["AddBlocks"].value, add[::2].shape)
-
-                # Copy the low 4 bits to the odd bytes
-                add[1::2] = add[::2] & 0xf
-
-                # Shift the even bytes down
-                add[::2] >>= 4
-
-                # Shift every byte up before merging it with Blocks
-                add <<= 8
-                self._Blocks |= add[:size].reshape(h, l, w)
-                del self.root_tag["AddBlocks"]
-
-            self.root_tag["Data"].value = self.root_tag["Data"].value.reshape(h, l, w)
+            self._readBlockArrays(h, l, w)
 
             if "Biomes" in self.root_tag:
                 if DEBUG: log.debug(u"Processing Biomes.")
@@ -128,14 +165,59 @@ class MCSchematic(EntityLevel):
             root_tag["TileTicks"] = nbt.TAG_List()
             root_tag["Materials"] = nbt.TAG_String(self.materials.name)
 
-            self._Blocks = zeros((shape[1], shape[2], shape[0]), 'uint16')
-            root_tag["Data"] = nbt.TAG_Byte_Array(zeros((shape[1], shape[2], shape[0]), uint8))
+            self._Blocks = self._createArray("Blocks", (shape[1], shape[2], shape[0]), 'uint16')
+            self._Data = self._createArray("Data", (shape[1], shape[2], shape[0]), uint8)
 
             root_tag["Biomes"] = nbt.TAG_Byte_Array(zeros((shape[2], shape[0]), uint8))
 
             self.root_tag = root_tag
 
-        self.root_tag["Data"].value &= 0xF  # discard high bits
+    def _readBlockArrays(self, h, l, w):
+        """ Takes the Blocks, AddBlocks and Data arrays out of the root tag into _Blocks and _Data. """
+        if DEBUG: log.debug(u"Reshaping blocks.")
+        self._Blocks = self.root_tag["Blocks"].value.astype('uint16').reshape(h, l, w)  # _Blocks is y, z, x
+        del self.root_tag["Blocks"]
+        if "AddBlocks" in self.root_tag:
+            if DEBUG: log.debug(u"Processing AddBlocks.")
+            # Use WorldEdit's "AddBlocks" array to load and store the 4 high bits of a block ID.
+            # Unlike Minecraft's NibbleArrays, this array stores the first block's bits in the
+            # 4 high bits of the first byte.
+
+            size = (h * l * w)
+
+            # If odd, add one to the size to make sure the adjacent slices line up.
+            add = zeros(size + (size & 1), 'uint16')
+
+            # Fill the even bytes with data
+            add[::2] = resize(self.root_tag["AddBlocks"].value, add[::2].shape)
+
+            # Copy the low 4 bits to the odd bytes
+            add[1::2] = add[::2] & 0xf
+
+            # Shift the even bytes down
+            add[::2] >>= 4
+
+            # Shift every byte up before merging it with Blocks
+            add <<= 8
+            self._Blocks |= add[:size].reshape(h, l, w)
+            del self.root_tag["AddBlocks"]
+
+        self._Data = self.root_tag["Data"].value.reshape(h, l, w)  # _Data is y, z, x
+        self._Data &= 0xF  # discard high bits
+        del self.root_tag["Data"]
+
+    def _createArray(self, name, shape, dtype):
+        """ Allocates the named block array of a new schematic. """
+        return zeros(shape, dtype)
+
+    # Blocks per slab when saving or transforming the block arrays a few layers at a time.
+    _slabVolume = 1 << 20
+
+    def _slabs(self):
+        """ Slices of the y axis that split the block arrays into slabs of an even number of layers, so
+        large schematics are never copied whole. """
+        step = max(2, (self._slabVolume // max(1, self.Length * self.Width)) & ~1)
+        return [slice(y, y + step) for y in xrange(0, self.Height, step)]
 
     def saveToFile(self, filename=None):
         """ save to file named filename, or use self.filename.  XXX NOT THREAD SAFE AT ALL. """
@@ -145,33 +227,33 @@ class MCSchematic(EntityLevel):
             raise IOError, u"Attempted to save an unnamed schematic in place"
 
         self.Materials = self.materials.name
+        self._applyDataTransforms()
 
-        self.root_tag["Blocks"] = nbt.TAG_Byte_Array(self._Blocks.astype('uint8'))
-
-        add = self._Blocks >> 8
-        if add.any():
-            # WorldEdit AddBlocks compatibility.
-            # The first 4-bit value is stored in the high bits of the first byte.
+        slabs = self._slabs()
+        blocks = self._Blocks
+        size = blocks.size
 
-            # Increase odd size by one to align slices.
-            packed_add = zeros(add.size + (add.size & 1), 'uint8')
-            packed_add[:add.size] = add.ravel()
+        with open(filename, 'wb') as fh, closing(gzip.GzipFile(fileobj=fh, mode='wb')) as f:
+            # The block arrays are written after the other tags, slab by slab, in place of the root
+            # compound's end tag.
+            f.write(self.root_tag.save(compressed=False)[:-1])
 
-            # Shift even bytes to the left
-            packed_add[::2] <<= 4
+            _writeByteArray(f, "Blocks", size, (blocks[s].astype(uint8) for s in slabs))
+            _writeByteArray(f, "Data", size, (self._Data[s] for s in slabs))
 
-            # Merge odd bytes into even bytes
-            packed_add[::2] |= packed_add[1::2]
+            if any((blocks[s] >> 8).any() for s in slabs):
+                # WorldEdit AddBlocks compatibility.
+                # The first 4-bit value is stored in the high bits of the first byte.
+                # Every slab but the last has an even size, so the pairs line up across slabs.
+                def packAddBlocks(s):
+                    add = (blocks[s] >> 8).astype(uint8).ravel()
+                    if add.size & 1:
+                        add = append(add, uint8(0))
+                    return (add[::2] << 4) | add[1::2]
 
-            # Save only the even bytes, now that they contain the odd bytes in their lower bits.
-            packed_add = packed_add[0::2]
-            self.root_tag["AddBlocks"] = nbt.TAG_Byte_Array(packed_add)
+                _writeByteArray(f, "AddBlocks", (size + 1) >> 1, (packAddBlocks(s) for s in slabs))
 
-        with open(filename, 'wb') as chunkfh:
-            self.root_tag.save(chunkfh)
-
-        del self.root_tag["Blocks"]
-        self.root_tag.pop("AddBlocks", None)
+            f.write("\x00")
 
     def __str__(self):
         return u"MCSchematic(shape={0}, materials={2}, filename=\"{1}\")".format(self.size, self.filename or u"",
@@ -181,23 +263,39 @@ class MCSchematic(EntityLevel):
     # this will have an impact later on when editing schematics instead of just importing/exporting
     @property
     def Length(self):
-        return self.Blocks.shape[1]
+        return self._Blocks.shape[1]
 
     @property
     def Width(self):
-        return self.Blocks.shape[0]
+        return self._Blocks.shape[2]
 
     @property
     def Height(self):
-        return self.Blocks.shape[2]
+        return self._Blocks.shape[0]
 
     @property
     def Blocks(self):
+        self._applyDataTransforms()
         return swapaxes(self._Blocks, 0, 2)
 
     @property
     def Data(self):
-        return swapaxes(self.root_tag["Data"].value, 0, 2)
+        self._applyDataTransforms()
+        return swapaxes(self._Data, 0, 2)
+
+    # Names of the blockrotation tables not yet applied to Data, in order. Rotations and flips only move
+    # the arrays around, so a sequence of them remaps the data values with one composed table lookup the
+    # next time Blocks or Data is read.
+    _pendingDataTransforms = ()
+
+    def _transformData(self, transform):
+        self._pendingDataTransforms += (transform,)
+
+    def _applyDataTransforms(self):
+        if self._pendingDataTransforms:
+            transforms, self._pendingDataTransforms = self._pendingDataTransforms, ()
+            for s in self._slabs():
+                blockrotation.Transform(self._Blocks[s], self._Data[s], transforms)
 
     @property
     def Entities(self):
@@ -235,27 +333,27 @@ class MCSchematic(EntityLevel):
 
     def _update_shape(self):
         root_tag = self.root_tag
-        shape = self.Blocks.shape
-        root_tag["Height"] = nbt.TAG_Short(shape[2])
-        root_tag["Length"] = nbt.TAG_Short(shape[1])
-        root_tag["Width"] = nbt.TAG_Short(shape[0])
+        root_tag["Height"] = nbt.TAG_Short(self.Height)
+        root_tag["Length"] = nbt.TAG_Short(self.Length)
+        root_tag["Width"] = nbt.TAG_Short(self.Width)
 
     def rotateLeftBlocks(self):
         """
         rotateLeft the blocks direction without there location
         """
-        blockrotation.RotateLeft(self.Blocks, self.Data)
+        self._transformData("rotateLeft")
 
     def rotateLeft(self):
         self._fakeEntities = None
+        self.invalidateEntityIndexes()
         self._Blocks = swapaxes(self._Blocks, 1, 2)[:, ::-1, :]  # x=z; z=-x
         if "Biomes" in self.root_tag:
             self.root_tag["Biomes"].value = swapaxes(self.root_tag["Biomes"].value, 0, 1)[::-1, :]
 
-        self.root_tag["Data"].value = swapaxes(self.root_tag["Data"].value, 1, 2)[:, ::-1, :]  # x=z; z=-x
+        self._Data = swapaxes(self._Data, 1, 2)[:, ::-1, :]  # x=z; z=-x
         self._update_shape()
 
-        blockrotation.RotateLeft(self.Blocks, self.Data)
+        self._transformData("rotateLeft")
 
         log.info(u"Relocating entities...")
         mcedit_ids_get = self.defsIds.mcedit_ids.get
@@ -313,18 +411,19 @@ class MCSchematic(EntityLevel):
         """
         rolls the blocks direction without the block location
         """
-        blockrotation.Roll(self.Blocks, self.Data)
+        self._transformData("roll")
 
     def roll(self):
         " xxx rotate stuff - destroys biomes"
         self.root_tag.pop('Biomes', None)
         self._fakeEntities = None
+        self.invalidateEntityIndexes()
 
         self._Blocks = swapaxes(self._Blocks, 2, 0)[:, :, ::-1]  # x=y; y=-x
-        self.root_tag["Data"].value = swapaxes(self.root_tag["Data"].value, 2, 0)[:, :, ::-1]
+        self._Data = swapaxes(self._Data, 2, 0)[:, :, ::-1]
         self._update_shape()
 
-        blockrotation.Roll(self.Blocks, self.Data)
+        self._transformData("roll")
 
         log.info(u"N/S Roll: Relocating entities...")
         mcedit_ids_get = self.defsIds.mcedit_ids.get
@@ -365,15 +464,16 @@ class MCSchematic(EntityLevel):
                 tileTick["y"].value = newY
 
     def flipVerticalBlocks(self):
-        blockrotation.FlipVertical(self.Blocks, self.Data)
+        self._transformData("flipVertical")
 
     def flipVertical(self):
         " xxx delete stuff "
         self._fakeEntities = None
+        self.invalidateEntityIndexes()
 
-        blockrotation.FlipVertical(self.Blocks, self.Data)
+        self._transformData("flipVertical")
         self._Blocks = self._Blocks[::-1, :, :]  # y=-y
-        self.root_tag["Data"].value = self.root_tag["Data"].value[::-1, :, :]
+        self._Data = self._Data[::-1, :, :]
 
         log.info(u"N/S Flip: Relocating entities...")
         mcedit_ids_get = self.defsIds.mcedit_ids.get
@@ -419,17 +519,18 @@ class MCSchematic(EntityLevel):
                    'BurningSkull': 4}
 
     def flipNorthSouthBlocks(self):
-        blockrotation.FlipNorthSouth(self.Blocks, self.Data)
+        self._transformData("flipNorthSouth")
 
     def flipNorthSouth(self):
         if "Biomes" in self.root_tag:
             self.root_tag["Biomes"].value = self.root_tag["Biomes"].value[::-1, :]
 
         self._fakeEntities = None
+        self.invalidateEntityIndexes()
 
-        blockrotation.FlipNorthSouth(self.Blocks, self.Data)
+        self._transformData("flipNorthSouth")
         self._Blocks = self._Blocks[:, :, ::-1]  # x=-x
-        self.root_tag["Data"].value = self.root_tag["Data"].value[:, :, ::-1]
+        self._Data = self._Data[:, :, ::-1]
 
         northSouthPaintingMap = [0, 3, 2, 1]
 
@@ -497,17 +598,18 @@ class MCSchematic(EntityLevel):
                 tileTick["x"].value = self.Width - tileTick["x"].value - 1
 
     def flipEastWestBlocks(self):
-        blockrotation.FlipEastWest(self.Blocks, self.Data)
+        self._transformData("flipEastWest")
 
     def flipEastWest(self):
         if "Biomes" in self.root_tag:
             self.root_tag["Biomes"].value = self.root_tag["Biomes"].value[:, ::-1]
 
         self._fakeEntities = None
+        self.invalidateEntityIndexes()
 
-        blockrotation.FlipEastWest(self.Blocks, self.Data)
+        self._transformData("flipEastWest")
         self._Blocks = self._Blocks[:, ::-1, :]  # z=-z
-        self.root_tag["Data"].value = self.root_tag["Data"].value[:, ::-1, :]
+        self._Data = self._Data[:, ::-1, :]
 
         eastWestPaintingMap = [2, 1, 0, 3]
 
@@ -615,6 +717,84 @@ class MCSchematic(EntityLevel):
         return chunk
 
 
+class DiskBackedSchematic(MCSchematic):
+    """ A schematic whose Blocks and Data arrays are memory-mapped files in a temporary folder, for
+    selections too large to hold in memory. Chunks read from it are views of the files, so previewing
+    and pasting only page in the parts being used, and saveToFile streams the arrays slab by slab.
+    The folder is removed by close(), or at exit.
+
+    Given a filename, the file is gunzipped into the folder and its Blocks and Data arrays are mapped
+    where they lie. Blocks stays a byte array unless the file has AddBlocks, which are merged into a
+    uint16 copy in the folder. """
+
+    def __init__(self, shape=None, root_tag=None, filename=None, mats='Alpha'):
+        self.tempFolder = tempfile.mkdtemp("schematic")
+        atexit.register(shutil.rmtree, self.tempFolder, True)
+        self._mappedArrays = None
+        if root_tag is None and filename and os.path.exists(filename):
+            root_tag, self._mappedArrays = self._mapFile(filename)
+        super(DiskBackedSchematic, self).__init__(shape, root_tag, filename, mats)
+
+    @classmethod
+    def _isLevel(cls, filename):
+        """ True for gzipped schematics larger than DISK_BACKED_VOLUME bytes once uncompressed. """
+        if os.path.isdir(filename):
+            return False
+        with open(filename, 'rb') as f:
+            if f.read(2) != "\x1f\x8b":
+                return False
+            f.seek(-4, os.SEEK_END)
+            (size,) = struct.unpack("<I", f.read(4))  # gzip stores the uncompressed size last
+        if size < DISK_BACKED_VOLUME:
+            return False
+        with closing(gzip.GzipFile(filename, 'rb')) as f:
+            return f.read(12) == "\x0a\x00\x09Schematic"
+
+    def _mapFile(self, filename):
+        path = os.path.join(self.tempFolder, "schematic.nbt")
+        with open(filename, 'rb') as f:
+            compressed = f.read(2) == "\x1f\x8b"
+        with (closing(gzip.GzipFile(filename, 'rb')) if compressed else open(filename, 'rb')) as src:
+            with open(path, 'wb') as dest:
+                shutil.copyfileobj(src, dest, 1 << 20)
+        return _mapSchematicFile(path)
+
+    def _readBlockArrays(self, h, l, w):
+        if self._mappedArrays is None:
+            return super(DiskBackedSchematic, self)._readBlockArrays(h, l, w)
+
+        arrays, self._mappedArrays = self._mappedArrays, None
+        self._Blocks = arrays["Blocks"].reshape(h, l, w)
+        self._Data = arrays["Data"].reshape(h, l, w)
+        slabs = self._slabs()
+        for s in slabs:
+            if (self._Data[s] > 0xF).any():
+                self._Data[s] &= 0xF  # discard high bits
+
+        if "AddBlocks" in arrays:
+            if DEBUG: log.debug(u"Processing AddBlocks.")
+            # Unpack the high nibbles of each slab into a uint16 array; every slab but the last starts
+            # and ends on a byte boundary of AddBlocks.
+            add = arrays["AddBlocks"]
+            blocks = self._createArray("Blocks", (h, l, w), 'uint16')
+            layer = l * w
+            for s in slabs:
+                start, stop = s.start * layer, min(s.stop, h) * layer
+                packed = add[start >> 1:(stop + 1) >> 1]
+                high = zeros(stop - start + 1, 'uint16')
+                high[:packed.size * 2:2] = packed >> 4
+                high[1:packed.size * 2:2] = packed & 0xf
+                blocks[s] = (high[:stop - start] << 8).reshape(-1, l, w) | self._Blocks[s]
+            self._Blocks = blocks
+
+    def _createArray(self, name, shape, dtype):
+        return memmap(os.path.join(self.tempFolder, name), dtype, 'w+', shape=shape)
+
+    def close(self):
+        self._Blocks = self._Data = None
+        shutil.rmtree(self.tempFolder, True)
+
+
 class INVEditChest(MCSchematic):
     Width = 1
     Height = 1
@@ -743,9 +923,10 @@ class StructureNBT(object):
     def __init__(self, filename=None, root_tag=None, size=None, mats=alphaMaterials):
         self._author = None
         self._blocks = None
+        self._data = None
         self._palette = None
         self._entities = []
-        self._tile_entities = None
+        self._tile_entities = {}
         self._size = None
         self._version = None
         self._mat = mats
@@ -763,19 +944,25 @@ class StructureNBT(object):
                 
             self._palette = self.__toPythonPrimitive(self._root_tag["palette"])
             
-            self._blocks = zeros(self.Size, dtype=tuple)
-            self._blocks.fill((0, 0))
+            self._blocks = zeros(self.Size, 'uint16')
+            self._data = zeros(self.Size, uint8)
             self._entities = []
-            self._tile_entities = zeros(self.Size, dtype=nbt.TAG_Compound)
-            self._tile_entities.fill({})
-            
-            for block in self._root_tag["blocks"]:
-                x, y, z = [p.value for p in block["pos"].value]
-                self._blocks[x, y, z] = self.blockstate.blockstateToID(*self.get_state(block["state"].value))
+
+            # Each palette entry is converted once, then every block is looked up by its state index.
+            translation = array([self.blockstate.blockstateToID(*self.get_state(i)) for i in xrange(len(self._palette))],
+                                'int32').reshape(-1, 2)
+            blocks = self._root_tag["blocks"]
+            positions = array([[p.value for p in block["pos"]] for block in blocks], 'int32').reshape(-1, 3)
+            states = array([block["state"].value for block in blocks], 'int32')
+            x, y, z = positions.T
+            self._blocks[x, y, z] = translation[states, 0].astype('uint16')
+            self._data[x, y, z] = translation[states, 1].astype(uint8)
+
+            for block in blocks:
                 if "nbt" in block:
                     compound = nbt.TAG_Compound()
                     compound.update(block["nbt"])
-                    self._tile_entities[x, y, z] = compound
+                    self._tile_entities[tuple(p.value for p in block["pos"])] = compound
                     
             for e in self._root_tag["entities"]:
                 entity = e["nbt"]
@@ -785,27 +972,22 @@ class StructureNBT(object):
             self._root_tag = nbt.TAG_Compound()
             self._size = size
             
-            self._blocks = zeros(self.Size, dtype=tuple)
-            self._blocks.fill((0, 0))
+            self._blocks = zeros(self.Size, 'uint16')
+            self._data = zeros(self.Size, uint8)
             self._entities = []
-            self._tile_entities = zeros(self.Size, dtype=nbt.TAG_Compound)
-            self._tile_entities.fill({})
             
     def toSchematic(self):
         schem = MCSchematic(shape=self.Size, mats=self._mat)
-        for (x, y, z), value in ndenumerate(self._blocks):
-            b_id, b_data = value
-            schem.Blocks[x, z, y] = b_id
-            schem.Data[x, z, y] = b_data
+        schem.Blocks[:] = swapaxes(self._blocks, 1, 2)
+        schem.Data[:] = swapaxes(self._data, 1, 2)
             
-        for (x, y, z), value in ndenumerate(self._tile_entities):
-            if not value:
-                continue
-            tag = value
+        tileEntities = []
+        for (x, y, z), tag in self._tile_entities.iteritems():
             tag["x"] = nbt.TAG_Int(x)
             tag["y"] = nbt.TAG_Int(y)
             tag["z"] = nbt.TAG_Int(z)
-            schem.addTileEntity(tag)
+            tileEntities.append(tag)
+        schem.addTileEntities(tileEntities)
         
         entity_list = nbt.TAG_List()
         for e in self._entities:
@@ -817,13 +999,12 @@ class StructureNBT(object):
     @classmethod
     def fromSchematic(cls, schematic):
         structure = cls(size=(schematic.Width, schematic.Height, schematic.Length), mats=namedMaterials[getattr(schematic, "Materials", 'Alpha')])
-        schematic = copy.copy(schematic)
-        
-        for (x, z, y), b_id in ndenumerate(schematic.Blocks):
-            data = schematic.Data[x, z, y]
-            structure._blocks[x, y, z] = (b_id, data)
+
+        structure._blocks[:] = swapaxes(schematic.Blocks, 1, 2)
+        structure._data[:] = swapaxes(schematic.Data, 1, 2)
             
         for te in schematic.TileEntities:
+            te = te.copy()
             x, y, z = te["x"].value, te["y"].value, te["z"].value
             del te["x"]
             del te["y"]
@@ -899,13 +1080,9 @@ class StructureNBT(object):
     
     def save(self, filename=""):
         structure_tag = nbt.TAG_Compound()
-        blocks_tag = nbt.TAG_List()
         palette_tag = nbt.TAG_List()
         entities_tag = nbt.TAG_List()
         
-        
-        palette = []
-        
         if not self._author:
             self._author = "MCEdit-Unified v{}".format(RELEASE_TAG)
         
@@ -924,35 +1101,38 @@ class StructureNBT(object):
                                              )
         
         blockstate_api = self.blockstate.material_map.get(self._mat, self.blockstate.material_map[alphaMaterials])
-        for z in xrange(self._blocks.shape[2]):  # For some reason, ndenumerate() didn't work, but this does
-            for x in xrange(self._blocks.shape[0]):
-                for y in xrange(self._blocks.shape[1]):
-                    
-                    value = self._blocks[x, y, z]
-                    name, properties = blockstate_api.idToBlockstate(*value)
-                    blockstate = blockstate_api.stringifyBlockstate(name, properties)
-            
-                    #if blockstate not in index_table:
-                    #    index_table[blockstate] = len(index_table)
-                    #index = index_table[blockstate]
-                    if blockstate not in palette:
-                        palette.append(blockstate)
-                    index = palette.index(blockstate)
-            
-                    block = nbt.TAG_Compound()
-                    block["state"] = nbt.TAG_Int(index)
-                    block["pos"] = nbt.TAG_List(
-                                        [
-                                         nbt.TAG_Int(x),
-                                         nbt.TAG_Int(y),
-                                         nbt.TAG_Int(z)
-                                         ]
-                                        )
-            
-                    if self._tile_entities[x, y, z]:
-                        block["nbt"] = self._tile_entities[x, y, z]
-            
-                    blocks_tag.append(block)
+
+        # Blocks are written in z, x, y order, and palette entries are numbered by first use in that order.
+        ids = self._blocks.transpose(2, 0, 1).ravel()
+        data = self._data.transpose(2, 0, 1).ravel() & 0xf
+        known = ids < blockstate_api.stateIndexes.shape[0]
+        blockstates = zeros(ids.shape, 'uint16')
+        blockstates[known] = blockstate_api.stateIndexes[ids[known], data[known]]
+        keys, first, inverse = unique(blockstates, return_index=True, return_inverse=True)
+
+        # Stringify each distinct blockstate once. Equal strings share a palette entry.
+        palette = []
+        paletteIndex = {}
+        translation = zeros(len(keys), 'int32')
+        for i in argsort(first):
+            name, properties = blockstate_api.states[keys[i]]
+            blockstate = blockstate_api.stringifyBlockstate(name, properties)
+            if blockstate not in paletteIndex:
+                paletteIndex[blockstate] = len(palette)
+                palette.append(blockstate)
+            translation[i] = paletteIndex[blockstate]
+        states = translation[inverse]
+
+        # The tags are only written out, so the blocks share their state and coordinate tags.
+        stateTags = [nbt.TAG_Int(i, "state") for i in xrange(len(palette))]
+        coordTags = [nbt.TAG_Int(i) for i in xrange(max(self.Size))]
+        width, height, length = self.Size
+        blocks_tag = nbt.TAG_List([nbt.TAG_Compound([stateTags[state],
+                                                     nbt.TAG_List([coordTags[x], coordTags[y], coordTags[z]], "pos")])
+                                   for state, (z, x, y) in izip(states.tolist(),
+                                                                product(xrange(length), xrange(width), xrange(height)))])
+        for (x, y, z), tileEntity in self._tile_entities.iteritems():
+            blocks_tag[(z * width + x) * height + y]["nbt"] = tileEntity
         structure_tag["blocks"] = blocks_tag
         
         for blockstate in palette:
@@ -967,7 +1147,7 @@ class StructureNBT(object):
                     props[key] = nbt.TAG_String(value)
                 state["Properties"] = props
                 
-            palette_tag.insert(palette.index(blockstate), state)
+            palette_tag.append(state)
         structure_tag["palette"] = palette_tag
         
         for e in self._entities:
@@ -996,6 +1176,10 @@ class StructureNBT(object):
     @property
     def Blocks(self):
         return self._blocks
+
+    @property
+    def Data(self):
+        return self._data
     
     @property
     def Entities(self):
@@ -1073,7 +1257,12 @@ def extractSchematicFromIter(sourceLevel, box, entities=True, cancelCommandBlock
         return
     newbox, destPoint = p
 
-    tempSchematic = MCSchematic(shape=box.size, mats=sourceLevel.materials)
+    if box.volume > DISK_BACKED_VOLUME:
+        schematicClass = DiskBackedSchematic
+    else:
+        schematicClass = MCSchematic
+
+    tempSchematic = schematicClass(shape=box.size, mats=sourceLevel.materials)
     for i in tempSchematic.copyBlocksFromIter(sourceLevel, newbox, destPoint, entities=entities, biomes=True, first=True, cancelCommandBlockOffset=cancelCommandBlockOffset):
         yield i
 
@@ -1084,8 +1273,6 @@ MCLevel.extractSchematic = extractSchematicFrom
 MCLevel.extractSchematicIter = extractSchematicFromIter
 MCLevel.adjustExtractionParameters = adjustExtractionParameters
 
-import tempfile
-
 
 def extractZipSchematicFrom(sourceLevel, box, zipfilename=None, entities=True):
     return exhaust(extractZipSchematicFromIter(sourceLevel, box, zipfilename, entities))
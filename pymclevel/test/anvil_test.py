@@ -9,6 +9,7 @@ from pymclevel.infiniteworld import MCInfdevOldLevel
 from pymclevel import nbt
 from pymclevel.schematic import MCSchematic
 from pymclevel.box import BoundingBox
+from pymclevel.entity import Entity, TileEntity
 from pymclevel import block_copy
 from templevel import mktemp, TempLevel
 
@@ -23,6 +24,176 @@ class TestAnvilLevelCreate(unittest.TestCase):
         shutil.rmtree(temppath)
 
 
+class TestAnvilFillTileEntities(unittest.TestCase):
+    def setUp(self):
+        self.temppath = mktemp("AnvilFill")
+        self.level = MCInfdevOldLevel(filename=self.temppath, create=True)
+        self.level.createChunksInBox(BoundingBox((0, 0, 0), (48, 0, 48)))
+
+    def tearDown(self):
+        self.level.close()
+        shutil.rmtree(self.temppath)
+
+    def testFillTileEntities(self):
+        level = self.level
+        box = BoundingBox((10, 60, 12), (20, 3, 9))
+        level.fillBlocks(box, level.materials["minecraft:chest"])
+
+        positions = sorted(tuple(t[a].value for a in 'xyz') for t in level.getTileEntitiesInBox(level.bounds))
+        assert positions == sorted((x, y, z) for x, y, z in box.positions)
+
+    def testReplaceTileEntities(self):
+        level = self.level
+        box = BoundingBox((10, 60, 12), (20, 3, 9))
+        level.fillBlocks(box, level.materials["minecraft:chest"])
+        level.fillBlocks(BoundingBox((0, 61, 0), (48, 1, 48)), level.materials.Stone)
+        level.fillBlocks(level.bounds, level.materials["minecraft:furnace"], [level.materials.Stone])
+
+        ids = dict((tuple(t[a].value for a in 'xyz'), t["id"].value) for t in level.getTileEntitiesInBox(level.bounds))
+        assert len(ids) == box.volume + 48 * 48 - box.width * box.length
+        assert ids[10, 61, 12] != ids[10, 60, 12]
+        assert ids[0, 61, 0] == ids[10, 61, 12]
+
+
+    def testTileEntityIndex(self):
+        level = self.level
+        level.fillBlocks(BoundingBox((0, 60, 0), (16, 4, 16)), level.materials["minecraft:hopper"])
+        chunk = level.getChunk(0, 0)
+
+        assert len(chunk.getTileEntitiesInBox(BoundingBox((2, 61, 3), (4, 2, 5)))) == 40
+        assert chunk.tileEntityAt(5, 62, 7)["x"].value == 5
+
+        chunk.removeTileEntitiesInBox(BoundingBox((5, 62, 7), (1, 1, 1)))
+        assert chunk.tileEntityAt(5, 62, 7) is None
+        assert len(level.getTileEntitiesInBox(level.bounds)) == 16 * 4 * 16 - 1
+
+        tileEntity = chunk.tileEntityAt(5, 61, 7).copy()
+        tileEntity["y"].value = 70
+        chunk.TileEntities.append(tileEntity)
+        assert level.tileEntityAt(5, 70, 7) is tileEntity
+
+    def testEntityIndexMovedInPlace(self):
+        level = self.level
+        level.fillBlocks(BoundingBox((0, 60, 0), (16, 1, 16)), level.materials["minecraft:hopper"])
+        chunk = level.getChunk(0, 0)
+        pig = Entity.Create("Pig")
+        Entity.setpos(pig, (2.5, 61, 2.5))
+        chunk.addEntity(pig)
+        oldBox, newBox = BoundingBox((2, 61, 2), (1, 1, 1)), BoundingBox((9, 64, 9), (1, 1, 1))
+        assert chunk.getEntitiesInBox(oldBox) == [pig]
+        assert chunk.tileEntityAt(3, 60, 4) is not None
+
+        Entity.setpos(pig, (9.5, 64, 9.5))
+        assert chunk.getEntitiesInBox(oldBox) == []
+        assert chunk.getEntitiesInBox(newBox) == [pig]
+
+        tileEntity = chunk.tileEntityAt(3, 60, 4)
+        TileEntity.setpos(tileEntity, (3, 62, 4))
+        assert chunk.tileEntityAt(3, 60, 4) is None
+        assert chunk.tileEntityAt(3, 62, 4) is tileEntity
+
+        # Replacing a tag in the middle of the list
+        middle = len(chunk.TileEntities) // 2
+        replacement = TileEntity.Create("Chest", (8, 70, 8))
+        chunk.TileEntities[middle] = replacement
+        assert chunk.tileEntityAt(8, 70, 8) is replacement
+
+        # Writing a position directly needs invalidateEntityIndexes.
+        replacement["y"].value = 71
+        level.invalidateEntityIndexes()
+        assert chunk.tileEntityAt(8, 71, 8) is replacement
+        assert level.tileEntityAt(8, 70, 8) is None
+
+    def testAddTileEntities(self):
+        level = self.level
+        level.fillBlocks(BoundingBox((10, 60, 12), (20, 1, 9)), level.materials["minecraft:chest"])
+
+        tileEntities = []
+        for x, y, z in BoundingBox((20, 60, 12), (20, 2, 1)).positions:
+            tileEntity = TileEntity.Create("Furnace", (x, y, z))
+            tileEntities.append(tileEntity)
+        tileEntities.append(tileEntities[0].copy())
+        level.addTileEntities(tileEntities)
+
+        ids = dict((tuple(TileEntity.pos(t)), t) for t in level.getTileEntitiesInBox(level.bounds))
+        assert len(ids) == 20 * 9 - 10 + 40
+        assert ids[tuple(TileEntity.pos(tileEntities[0]))] is tileEntities[-1]
+        assert ids[tuple(TileEntity.pos(tileEntities[1]))] is tileEntities[1]
+        assert ids[29, 60, 13]["id"].value != ids[29, 60, 12]["id"].value
+
+    def testAddTileEntitiesSaved(self):
+        level = self.level
+        chunk = level.getChunk(1, 1)
+        assert not len(chunk.TileEntities)
+        level.addTileEntities([TileEntity.Create("Chest", (20, 70, 20))])
+        level.saveInPlace()
+        level.close()
+
+        self.level = level = MCInfdevOldLevel(filename=self.temppath)
+        tileEntities = level.getChunk(1, 1).TileEntities
+        assert tileEntities.list_type == nbt.TAG_COMPOUND
+        assert [TileEntity.pos(t) for t in tileEntities] == [[20, 70, 20]]
+
+
+class TestAnvilCopyBlocks(unittest.TestCase):
+    def setUp(self):
+        self.temppaths = [mktemp("AnvilCopySource"), mktemp("AnvilCopyDest")]
+        self.sourceLevel, self.destLevel = [MCInfdevOldLevel(filename=p, create=True) for p in self.temppaths]
+        for level in (self.sourceLevel, self.destLevel):
+            level.createChunksInBox(BoundingBox((0, 0, 0), (64, 0, 64)))
+
+        rand = numpy.random.RandomState(0)
+        for cPos in self.sourceLevel.allChunks:
+            chunk = self.sourceLevel.getChunk(*cPos)
+            chunk.Blocks[:] = rand.randint(1, 5, chunk.Blocks.shape)
+            chunk.chunkChanged(False)
+
+    def tearDown(self):
+        for level, path in zip((self.sourceLevel, self.destLevel), self.temppaths):
+            level.close()
+            shutil.rmtree(path)
+
+    def testUnalignedCopy(self):
+        sourceBox = BoundingBox((5, 10, 7), (40, 100, 37))
+        destPoint = (19, 40, 3)
+
+        getChunk = self.sourceLevel.getChunk
+        fetched = []
+
+        def countingGetChunk(cx, cz):
+            fetched.append((cx, cz))
+            return getChunk(cx, cz)
+
+        self.sourceLevel.getChunk = countingGetChunk
+        self.destLevel.copyBlocksFrom(self.sourceLevel, sourceBox, destPoint)
+        del self.sourceLevel.getChunk
+
+        assert sorted(fetched) == sorted(sourceBox.chunkPositions)
+        source = self.sourceLevel.extractSchematic(sourceBox)
+        dest = self.destLevel.extractSchematic(BoundingBox(destPoint, sourceBox.size))
+        assert (source.Blocks == dest.Blocks).all()
+
+    def testChunkAlignedCopy(self):
+        sourceBox = BoundingBox((16, 0, 0), (32, self.sourceLevel.Height, 48))
+        destPoint = (48, 0, 32)
+        chest = self.sourceLevel.materials["minecraft:chest"]
+        self.sourceLevel.fillBlocks(BoundingBox((20, 70, 5), (1, 1, 1)), chest)
+        self.sourceLevel.saveInPlace()
+
+        destChunk = self.destLevel.getChunk(3, 2)  # in use, so it is copied block by block
+        self.destLevel.copyBlocksFrom(self.sourceLevel, sourceBox, destPoint, create=True)
+        del destChunk
+
+        for cx, cz in sourceBox.chunkPositions:
+            sourceChunk = self.sourceLevel.getChunk(cx, cz)
+            destChunk = self.destLevel.getChunk(cx + 2, cz + 2)
+            assert destChunk.root_tag["Level"]["xPos"].value == cx + 2
+            assert (sourceChunk.Blocks == destChunk.Blocks).all()
+
+        assert self.destLevel.blockAt(52, 70, 37) == chest.ID
+        assert [t["x"].value for t in self.destLevel.getTileEntitiesInBox(self.destLevel.bounds)] == [52]
+
+
 class TestAnvilLevel(unittest.TestCase):
     def setUp(self):
         self.indevLevel = TempLevel("hell.mclevel")
@@ -0,0 +1,129 @@
+import shutil
+import unittest
+import numpy
+
+from pymclevel.infiniteworld import MCInfdevOldLevel
+from pymclevel.box import BoundingBox
+from pymclevel.block_fill import blockRemapTable
+from templevel import mktemp
+
+
+def createLitLevel(lightingEngine):
+    temppath = mktemp("LightingTest")
+    level = MCInfdevOldLevel(filename=temppath, create=True)
+    level.lightingEngine = lightingEngine
+    level.createChunksInBox(BoundingBox((0, 0, 0), (48, level.Height, 48)))
+
+    rand = numpy.random.RandomState(0)
+    for cx, cz in sorted(level.allChunks):
+        chunk = level.getChunk(cx, cz)
+        chunk.Blocks[:, :, :rand.randint(40, 80)] = level.materials.Stone.ID
+        chunk.Blocks[rand.rand(16, 16, level.Height) < 0.2] = level.materials.Air.ID
+        chunk.Blocks[rand.rand(16, 16, level.Height) < 0.01] = level.materials.Glowstone.ID
+        chunk.Blocks[:, :, 100][rand.rand(16, 16) < 0.5] = level.materials.Stone.ID
+        chunk.chunkChanged()
+
+    level.generateLights()
+    return level, temppath
+
+
+class TestLighting(unittest.TestCase):
+    def setUp(self):
+        self.classic, self.classicPath = createLitLevel("classic")
+        self.stitched, self.stitchedPath = createLitLevel("stitched")
+
+    def tearDown(self):
+        for level, path in ((self.classic, self.classicPath), (self.stitched, self.stitchedPath)):
+            level.close()
+            shutil.rmtree(path)
+
+    def assertSameLights(self, level=None):
+        level = level or self.stitched
+        for cPos in self.classic.allChunks:
+            classicChunk = self.classic.getChunk(*cPos)
+            chunk = level.getChunk(*cPos)
+            assert (classicChunk.BlockLight == chunk.BlockLight).all()
+            assert (classicChunk.SkyLight == chunk.SkyLight).all()
+
+    def testStitchedMatchesClassic(self):
+        self.assertSameLights()
+
+    def testStitchedRelight(self):
+        for level in (self.classic, self.stitched):
+            chunk = level.getChunk(1, 1)
+            chunk.Blocks[:, :, 90:95] = level.materials.Glowstone.ID
+            chunk.Blocks[4, 4, :] = level.materials.Air.ID
+            chunk.chunkChanged()
+            level.generateLights([(1, 1)])
+
+        self.assertSameLights()
+
+    def testBoxLighting(self):
+        box = BoundingBox((12, 60, 20), (6, 4, 3))
+        self.classic.fillBlocks(box, self.classic.materials.Glowstone)
+        self.classic.generateLights()
+
+        self.stitched.fillBlocks(box, self.stitched.materials.Glowstone, boxLighting=True)
+        assert not len(self.stitched.chunksNeedingLighting)
+
+        self.assertSameLights()
+
+    def testParallelMatchesClassic(self):
+        level, path = createLitLevel("parallel")
+        try:
+            self.assertSameLights(level)
+        finally:
+            level.close()
+            shutil.rmtree(path)
+
+    def testPendingLighting(self):
+        boxes = [BoundingBox((12, 60, 20), (6, 4, 3)), BoundingBox((14, 62, 21), (6, 4, 3))]
+        for box in boxes:
+            self.classic.fillBlocks(box, self.classic.materials.Glowstone)
+        self.classic.generateLights()
+
+        for box in boxes:
+            self.stitched.fillBlocks(box, self.stitched.materials.Glowstone)
+            self.stitched.queueLighting(box)
+        assert len(self.stitched.pendingLightingBoxes) == 1
+
+        self.stitched.generatePendingLights()
+        assert not self.stitched.pendingLightingBoxes
+        assert not len(self.stitched.chunksNeedingLighting)
+
+        self.assertSameLights()
+
+    def testPendingLightingOnSave(self):
+        box = BoundingBox((14, 60, 14), (4, 4, 4))
+        self.classic.fillBlocks(box, self.classic.materials.Glowstone)
+        self.classic.generateLights()
+
+        # Unload the chunks, so the neighbors of the box have to be read from disk while saving.
+        self.stitched.saveInPlace()
+        self.stitched.unload()
+        self.stitched.fillBlocks(box, self.stitched.materials.Glowstone)
+        self.stitched.queueLighting(box)
+        self.stitched.saveInPlace()
+        assert not self.stitched.pendingLightingBoxes
+
+        self.assertSameLights()
+
+    def testRemapLighting(self):
+        m = self.classic.materials
+        box = BoundingBox((12, 50, 20), (20, 20, 3))
+        mapping = [(m.Stone, m.Glowstone), (m.Air, m.Glass), (m.Glowstone, m.Stone)]
+        blocks = self.stitched.extractSchematic(box).Blocks.copy()
+
+        self.classic.remapBlocks(box, blockRemapTable(mapping))
+        assert len(self.classic.chunksNeedingLighting)
+        self.classic.generateLights()
+
+        changedCounts = self.stitched.remapBlocks(box, blockRemapTable(mapping), boxLighting=True)
+        assert not len(self.stitched.chunksNeedingLighting)
+        assert sum(changedCounts.values()) == box.volume
+        assert sorted(changedCounts) == sorted(box.chunkPositions)
+
+        remapped = self.stitched.extractSchematic(box).Blocks
+        for source, dest in mapping:
+            assert (remapped[blocks == source.ID] == dest.ID).all()
+        self.assertSameLights()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import unittest
+import numpy
+
+from pymclevel import materials
+from pymclevel.materials import MCMaterials
+from templevel import mktemp
+
+
+def createMaterials(name, blocks):
+    mats = MCMaterials()
+    mats.name = name
+    for blockID, blockName in blocks:
+        mats.addBlock(blockID, name=blockName)
+    return mats
+
+
+class TestConversionTables(unittest.TestCase):
+    def setUp(self):
+        self.tableDir = materials.conversionTableDir
+        materials.conversionTableDir = mktemp("ConversionTables")
+        self.source = createMaterials("Source", [(1, "Stone"), (5, "Planks")])
+        self.dest = createMaterials("Dest", [(1, "Stone"), (7, "Planks")])
+
+    def tearDown(self):
+        for key in materials._conversionFuncs.keys():
+            if self.source in key:
+                del materials._conversionFuncs[key]
+        shutil.rmtree(materials.conversionTableDir, True)
+        materials.conversionTableDir = self.tableDir
+
+    def convert(self):
+        materials._conversionFuncs.pop((self.dest, self.source), None)
+        blocks, data = materials.conversionFunc(self.dest, self.source)(numpy.array([1, 5, 9]), numpy.zeros(3, 'uint8'))
+        return list(blocks)
+
+    def testMiss(self):
+        path = materials._conversionTablePath(self.dest, self.source)
+        assert not os.path.exists(path)
+        assert self.convert() == [1, 7, 9]
+        assert os.listdir(materials.conversionTableDir) == [os.path.basename(path)]
+        assert (numpy.load(path) == materials._guessConversionTable(self.dest, self.source)).all()
+
+    def testHit(self):
+        # A cached table is used as is, without guessing it again.
+        path = materials._conversionTablePath(self.dest, self.source)
+        table = materials._guessConversionTable(self.dest, self.source)
+        table[5] = (4, 0)
+        materials._saveConversionTable(path, table)
+        assert self.convert() == [1, 4, 9]
+
+        # Unreadable tables are guessed again and replaced.
+        with open(path, 'wb') as f:
+            f.write("not a table")
+        assert self.convert() == [1, 7, 9]
+        assert materials._loadConversionTable(path) is not None
+
+    def testInvalidation(self):
+        assert self.convert() == [1, 7, 9]
+        oldPath = materials._conversionTablePath(self.dest, self.source)
+        oldDigest = materials._materialsDigest(self.dest)
+
+        # Renaming the destination's planks changes its digest, so the table cached for the old
+        # definitions is no longer used. The source's planks no longer have a match, and become wool.
+        self.dest.names[7][0] = "Glass"
+        assert materials._materialsDigest(self.dest) != oldDigest
+        path = materials._conversionTablePath(self.dest, self.source)
+        assert path != oldPath
+        assert self.convert() == [1, 35, 9]
+        assert sorted(os.listdir(materials.conversionTableDir)) == sorted(os.path.basename(p) for p in (path, oldPath))
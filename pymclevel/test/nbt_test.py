@@ -176,6 +176,90 @@ class TestNBT():
         else:
             assert False
 
+    def testCopy(self):
+        level = self.testCreate()
+        del level["ShortArray"]  # Unofficial tag type, not saved by the pure-python fallback
+        copied = level.copy()
+        assert copied.save(compressed=False) == level.save(compressed=False)
+
+        # Arrays are shared until either side accesses them, then each side gets its own.
+        copied["Map"]["Blocks"].value[0, 0, 0] = 41
+        assert level["Map"]["Blocks"].value[0, 0, 0] == 5
+        level["Map"]["Data"].value[0] = 3
+        assert copied["Map"]["Data"].value[0] == 0
+
+        copied["Entities"][0]["id"].value = "Zombie"
+        assert level["Entities"][0]["id"].value == "Creeper"
+
+        empty = nbt.TAG_List(list_type=nbt.TAG_COMPOUND)
+        assert empty.copy().list_type == nbt.TAG_COMPOUND
+
+    @staticmethod
+    def testCopyExposedArray():
+        """ An array already handed out through value may still be written through that reference after
+        copy(), so neither tag may pick up the other's writes, or lose its own. """
+        tag = nbt.TAG_Byte_Array(numpy.zeros(4, 'uint8'))
+        blocks = tag.value
+        copied = tag.copy()
+        blocks[0] = 1
+        assert copied.value[0] == 0
+        assert tag.value[0] == 1
+        blocks[1] = 2
+        assert tag.value[1] == 2
+
+        shared = nbt.TAG_Int_Array(numpy.zeros(4, '>u4'))
+        copied = shared.copy()
+        ints = copied.value
+        copied.copy()
+        ints[0] = 7
+        assert copied.value[0] == 7 and shared.value[0] == 0
+
+    @staticmethod
+    def testLittleEndian():
+        """Pocket edition NBT is little endian. The codec is passed per call, so both byte orders
+        can be used side by side."""
+        tag = nbt.TAG_Compound()
+        tag["Int"] = nbt.TAG_Int(0x01020304)
+        tag["Name"] = nbt.TAG_String("Steve")
+        tag["IntArray"] = nbt.TAG_Int_Array(numpy.arange(4, dtype='>u4'))
+        tag["List"] = nbt.TAG_List([nbt.TAG_Short(s) for s in (1, -2, 3)])
+
+        big = tag.save(compressed=False)
+        little = tag.save(compressed=False, codec=nbt.LITTLE_ENDIAN)
+        assert big != little
+
+        with nbt.littleEndianNBT():
+            assert tag.save(compressed=False) == little
+        assert tag.save(compressed=False) == big
+
+        for data, codec in ((big, nbt.BIG_ENDIAN), (little, nbt.LITTLE_ENDIAN)):
+            loaded = nbt.load(buf=data, codec=codec)
+            assert loaded["Int"].value == 0x01020304
+            assert loaded["Name"].value == "Steve"
+            assert list(loaded["IntArray"].value) == [0, 1, 2, 3]
+            assert [t.value for t in loaded["List"]] == [1, -2, 3]
+            assert loaded.save(compressed=False, codec=nbt.BIG_ENDIAN) == big
+
+    @staticmethod
+    def testLongStrings():
+        """String lengths are unsigned shorts, so strings between 32768 and 65535 bytes round-trip.
+        Longer strings can't be saved."""
+        for codec in (nbt.BIG_ENDIAN, nbt.LITTLE_ENDIAN):
+            tag = nbt.TAG_Compound()
+            tag["Text"] = nbt.TAG_String(u"\u00e9" * 20000)
+            tag["Max"] = nbt.TAG_String("x" * 0xffff)
+            loaded = nbt.load(buf=tag.save(compressed=False, codec=codec), codec=codec)
+            assert loaded["Text"].value == tag["Text"].value
+            assert loaded["Max"].value == tag["Max"].value
+
+            tag["Max"].value += "x"
+            try:
+                tag.save(compressed=False, codec=codec)
+            except ValueError:
+                pass
+            else:
+                assert False
+
     @staticmethod
     def testSpeed():
         d = join("testfiles", "TileTicks_chunks")
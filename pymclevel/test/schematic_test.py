@@ -1,9 +1,11 @@
 import itertools
 import os
 import unittest
-from pymclevel import mclevel
+import numpy
+from pymclevel import mclevel, blockrotation, schematic as schematicModule
 from templevel import TempLevel, mktemp
-from pymclevel.schematic import MCSchematic
+from pymclevel.schematic import DiskBackedSchematic, MCSchematic, StructureNBT
+from pymclevel.entity import TileEntity
 from pymclevel.box import BoundingBox
 
 __author__ = 'Rio'
@@ -78,3 +80,104 @@ class TestSchematics(unittest.TestCase):
         assert len(invFile.Entities) == 0
         assert len(invFile.TileEntities) == 1
         # raise SystemExit
+
+
+class TestSchematicRotation(unittest.TestCase):
+    def testRotationSequence(self):
+        schematic = MCSchematic(shape=(6, 5, 7))
+        rand = numpy.random.RandomState(0)
+        stairs = schematic.materials["minecraft:oak_stairs"].ID
+        schematic.Blocks[:] = rand.choice([0, 1, stairs], schematic.Blocks.shape)
+        schematic.Data[:] = rand.randint(0, 8, schematic.Data.shape)
+        reference = MCSchematic(shape=(6, 5, 7))
+        reference.Blocks[:] = schematic.Blocks
+        reference.Data[:] = schematic.Data
+
+        transforms = ["rotateLeft", "flipEastWest", "roll", "flipVertical", "rotateLeft"]
+        for transform in transforms:
+            getattr(schematic, transform + "Blocks")()
+            getattr(reference, transform + "Blocks")()
+            reference.Data  # apply each transform on its own
+        assert schematic._pendingDataTransforms == tuple(transforms)
+
+        assert (schematic.Blocks == reference.Blocks).all()
+        assert (schematic.Data == reference.Data).all()
+        assert not schematic._pendingDataTransforms
+
+        table = blockrotation.composedRotationTable(["rotateLeft"] * 4)
+        assert (table[stairs] == numpy.arange(16)).all()
+
+
+class TestDiskBackedSchematic(unittest.TestCase):
+    def testSaveRoundTrip(self):
+        schematic = DiskBackedSchematic(shape=(9, 7, 5))
+        schematic._slabVolume = 40  # several slabs, the last one odd-sized
+        assert isinstance(schematic._Blocks, numpy.memmap)
+
+        rand = numpy.random.RandomState(0)
+        schematic.Blocks[:] = rand.randint(0, 300, schematic.Blocks.shape)
+        schematic.Data[:] = rand.randint(0, 16, schematic.Data.shape)
+        schematic.addTileEntity(TileEntity.Create("Chest", (4, 3, 2)))
+
+        temp = mktemp("diskbacked.schematic")
+        schematic.saveToFile(temp)
+        loaded = MCSchematic(filename=temp)
+        os.remove(temp)
+
+        assert (loaded.Blocks == schematic.Blocks).all()
+        assert (loaded.Data == schematic.Data).all()
+        assert [TileEntity.pos(t) for t in loaded.TileEntities] == [[4, 3, 2]]
+
+        schematic.close()
+        assert not os.path.exists(schematic.tempFolder)
+
+    def testMappedLoad(self):
+        schematic = MCSchematic(shape=(9, 7, 5))
+        rand = numpy.random.RandomState(0)
+        schematic.Data[:] = rand.randint(0, 16, schematic.Data.shape)
+        schematic.addTileEntity(TileEntity.Create("Chest", (4, 3, 2)))
+        temp = mktemp("mapped.schematic")
+
+        for maxID in (256, 300):
+            schematic.Blocks[:] = rand.randint(0, maxID, schematic.Blocks.shape)
+            schematic.saveToFile(temp)
+
+            volume = schematicModule.DISK_BACKED_VOLUME
+            schematicModule.DISK_BACKED_VOLUME = 0
+            try:
+                loaded = mclevel.fromFile(temp)
+            finally:
+                schematicModule.DISK_BACKED_VOLUME = volume
+
+            assert isinstance(loaded, DiskBackedSchematic)
+            assert isinstance(loaded._Data, numpy.memmap)
+            assert loaded._Blocks.dtype == ('uint16' if maxID > 256 else 'uint8')
+            assert (loaded.Blocks == schematic.Blocks).all()
+            assert (loaded.Data == schematic.Data).all()
+            assert [TileEntity.pos(t) for t in loaded.TileEntities] == [[4, 3, 2]]
+            loaded.close()
+
+        os.remove(temp)
+
+
+class TestStructureNBT(unittest.TestCase):
+    def testRoundTrip(self):
+        schematic = MCSchematic(shape=(5, 4, 3))
+        schematic.Blocks[:2] = schematic.materials.Stone.ID
+        schematic.Blocks[2:] = schematic.materials.Dirt.ID
+        schematic.Blocks[1, 1, 1] = schematic.materials["minecraft:oak_stairs"].ID
+        schematic.Data[1, 1, 1] = 6
+        schematic.addTileEntity(TileEntity.Create("Chest", (4, 3, 2)))
+
+        temp = mktemp("roundtrip.nbt")
+        StructureNBT.fromSchematic(schematic).save(temp)
+        structure = StructureNBT(filename=temp)
+        os.remove(temp)
+
+        assert structure.Size == (5, 4, 3)
+        assert len(structure.Palette) == 3
+        roundTrip = structure.toSchematic()
+        assert (roundTrip.Blocks == schematic.Blocks).all()
+        assert (roundTrip.Data == schematic.Data).all()
+        assert [TileEntity.pos(t) for t in roundTrip.TileEntities] == [[4, 3, 2]]
+        assert [TileEntity.pos(t) for t in schematic.TileEntities] == [[4, 3, 2]]
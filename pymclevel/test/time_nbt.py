@@ -1,34 +1,371 @@
-from StringIO import StringIO
+"""
+NBT benchmark suite.
+
+Times load, save, round-trip and partial-query operations on a corpus of chunk-shaped NBT files, for both the
+pure-python and the Cython implementation, and writes the results as JSON.
+
+    python -m pymclevel.test.time_nbt --output nbt_bench.json
+    python -m pymclevel.test.time_nbt --baseline nbt_bench.json --threshold 10
+
+The built-in corpus is generated: entity-heavy, tile-entity-heavy and empty chunks, in both the 1.12 (Blocks/Data)
+and the 1.13 (Palette/BlockStates) section layouts. Pass --corpus to add real chunk files (any file nbt.load can
+read, gzipped or not).
+
+When --baseline is given, exits with status 1 if any operation is slower than in the baseline by more than
+--threshold percent.
+"""
+import argparse
+import gc
+import imp
+import json
+import os
+import sys
+from timeit import default_timer
+
+import numpy
 
 __author__ = 'Rio'
 
-import pymclevel.nbt as nbt
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
-from timeit import timeit
+OPERATIONS = ("load", "save", "roundtrip", "query")
 
-path = "testfiles/TileTicks.nbt"
-test_data = file(path, "rb").read()
 
-test_file = None
-resaved_test_file = None
+# --- Backends ---
 
+def python_backend():
+    """Loads a separate copy of nbt.py with the Cython import disabled."""
+    import pymclevel
+    path = os.path.join(os.path.dirname(pymclevel.__file__), "nbt.py")
+    saved = dict((name, sys.modules.get(name)) for name in ("_nbt", "pymclevel._nbt"))
+    sys.modules["_nbt"] = sys.modules["pymclevel._nbt"] = None
+    try:
+        return imp.load_source("pymclevel._nbt_python_bench", path)
+    finally:
+        for name, module in saved.iteritems():
+            if module is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = module
 
-def load_file():
-    global test_file
-    test_file = nbt.load(buf=test_data)
 
+def cython_backend():
+    try:
+        from pymclevel import _nbt
+    except ImportError:
+        return None
+    return _nbt
 
-def save_file():
-    global resaved_test_file
-    resaved_test_file = test_file.save(compressed=False)
-    # resaved_test_file = test_file.save(buf=s)
-    # resaved_test_file = s.getvalue()
 
+def backends():
+    result = [("python", python_backend())]
+    cython = cython_backend()
+    if cython is not None:
+        result.append(("cython", cython))
+    else:
+        print "Cython nbt not built, only benchmarking the python implementation."
+    return result
 
-print "File: ", path
-print "Load: %0.1f ms" % (timeit(load_file, number=1) * 1000)
-print "Save: %0.1f ms" % (timeit(save_file, number=1) * 1000)
-print "Length: ", len(resaved_test_file)
 
-assert test_data == resaved_test_file
-__author__ = 'Rio'
+# --- Corpus ---
+
+def _item(nbt, rand, slot):
+    item = nbt.TAG_Compound()
+    item["id"] = nbt.TAG_String("minecraft:stone")
+    item["Count"] = nbt.TAG_Byte(int(rand.randint(1, 64)))
+    item["Slot"] = nbt.TAG_Byte(slot)
+    item["Damage"] = nbt.TAG_Short(0)
+    return item
+
+
+def _entity(nbt, rand, cx, cz):
+    ent = nbt.TAG_Compound()
+    ent["id"] = nbt.TAG_String("minecraft:zombie")
+    ent["Pos"] = nbt.TAG_List([nbt.TAG_Double(float(v)) for v in
+                               ((cx << 4) + rand.rand() * 16, 64 + rand.rand() * 32, (cz << 4) + rand.rand() * 16)])
+    ent["Motion"] = nbt.TAG_List([nbt.TAG_Double(0.0) for _ in range(3)])
+    ent["Rotation"] = nbt.TAG_List([nbt.TAG_Float(float(rand.rand() * 360)), nbt.TAG_Float(0.0)])
+    ent["UUIDMost"] = nbt.TAG_Long(long(rand.randint(0, 1 << 30)))
+    ent["UUIDLeast"] = nbt.TAG_Long(long(rand.randint(0, 1 << 30)))
+    ent["Health"] = nbt.TAG_Float(20.0)
+    ent["OnGround"] = nbt.TAG_Byte(1)
+    attributes = nbt.TAG_List()
+    for name in ("generic.maxHealth", "generic.movementSpeed", "generic.followRange", "generic.attackDamage"):
+        attribute = nbt.TAG_Compound()
+        attribute["Name"] = nbt.TAG_String(name)
+        attribute["Base"] = nbt.TAG_Double(float(rand.rand()))
+        attributes.append(attribute)
+    ent["Attributes"] = attributes
+    ent["ArmorItems"] = nbt.TAG_List([_item(nbt, rand, i) for i in range(4)])
+    return ent
+
+
+def _chest(nbt, rand, x, y, z):
+    te = nbt.TAG_Compound()
+    te["id"] = nbt.TAG_String("minecraft:chest")
+    te["x"] = nbt.TAG_Int(x)
+    te["y"] = nbt.TAG_Int(y)
+    te["z"] = nbt.TAG_Int(z)
+    te["Items"] = nbt.TAG_List([_item(nbt, rand, i) for i in range(27)])
+    return te
+
+
+def _command_block(nbt, rand, x, y, z):
+    te = nbt.TAG_Compound()
+    te["id"] = nbt.TAG_String("minecraft:command_block")
+    te["x"] = nbt.TAG_Int(x)
+    te["y"] = nbt.TAG_Int(y)
+    te["z"] = nbt.TAG_Int(z)
+    te["Command"] = nbt.TAG_String("/tp @p[r=%d] ~ ~%d ~" % (rand.randint(1, 20), rand.randint(1, 20)))
+    te["CustomName"] = nbt.TAG_String("@")
+    te["TrackOutput"] = nbt.TAG_Byte(1)
+    te["SuccessCount"] = nbt.TAG_Int(0)
+    return te
+
+
+def _section_1_12(nbt, rand, y):
+    section = nbt.TAG_Compound()
+    section["Y"] = nbt.TAG_Byte(y)
+    section["Blocks"] = nbt.TAG_Byte_Array(rand.randint(0, 5, 4096).astype('uint8'))
+    section["Data"] = nbt.TAG_Byte_Array(rand.randint(0, 255, 2048).astype('uint8'))
+    section["BlockLight"] = nbt.TAG_Byte_Array(numpy.zeros(2048, 'uint8'))
+    section["SkyLight"] = nbt.TAG_Byte_Array(numpy.zeros(2048, 'uint8') + 0xff)
+    return section
+
+
+def _section_1_13(nbt, rand, y):
+    section = nbt.TAG_Compound()
+    section["Y"] = nbt.TAG_Byte(y)
+    palette = nbt.TAG_List()
+    for name in ("air", "stone", "dirt", "grass_block", "oak_log"):
+        state = nbt.TAG_Compound()
+        state["Name"] = nbt.TAG_String("minecraft:" + name)
+        if name in ("grass_block", "oak_log"):
+            properties = nbt.TAG_Compound()
+            properties["axis" if name == "oak_log" else "snowy"] = nbt.TAG_String("y" if name == "oak_log" else "false")
+            state["Properties"] = properties
+        palette.append(state)
+    section["Palette"] = palette
+    # 4 bits per block
+    section["BlockStates"] = nbt.TAG_Long_Array(rand.randint(0, 1 << 62, 256).astype('>q'))
+    section["BlockLight"] = nbt.TAG_Byte_Array(numpy.zeros(2048, 'uint8'))
+    section["SkyLight"] = nbt.TAG_Byte_Array(numpy.zeros(2048, 'uint8') + 0xff)
+    return section
+
+
+def make_chunk(nbt, layout, contents, seed=0):
+    """
+    Builds a chunk root tag shaped like the ones found in region files.
+    :param layout: "1.12" or "1.13"
+    :param contents: "empty", "entities" or "tiles"
+    """
+    rand = numpy.random.RandomState(seed)
+    cx, cz = 3, -7
+    root = nbt.TAG_Compound()
+    level = nbt.TAG_Compound()
+    level["xPos"] = nbt.TAG_Int(cx)
+    level["zPos"] = nbt.TAG_Int(cz)
+    level["LastUpdate"] = nbt.TAG_Long(123456L)
+    level["InhabitedTime"] = nbt.TAG_Long(0L)
+    level["Biomes"] = nbt.TAG_Byte_Array(numpy.ones(256, 'uint8'))
+
+    if layout == "1.12":
+        root["DataVersion"] = nbt.TAG_Int(1343)
+        level["TerrainPopulated"] = nbt.TAG_Byte(1)
+        level["HeightMap"] = nbt.TAG_Int_Array(numpy.zeros(256, '>u4') + 64)
+        make_section = _section_1_12
+    else:
+        root["DataVersion"] = nbt.TAG_Int(1631)
+        level["Status"] = nbt.TAG_String("postprocessed")
+        heightmaps = nbt.TAG_Compound()
+        for name in ("MOTION_BLOCKING", "OCEAN_FLOOR", "WORLD_SURFACE"):
+            heightmaps[name] = nbt.TAG_Long_Array(numpy.zeros(36, '>q'))
+        level["Heightmaps"] = heightmaps
+        make_section = _section_1_13
+
+    if contents == "empty":
+        level["Sections"] = nbt.TAG_List(list_type=10)
+    else:
+        level["Sections"] = nbt.TAG_List([make_section(nbt, rand, y) for y in range(8)])
+
+    entities = nbt.TAG_List(list_type=10)
+    tile_entities = nbt.TAG_List(list_type=10)
+    if contents == "entities":
+        for _ in range(500):
+            entities.append(_entity(nbt, rand, cx, cz))
+    elif contents == "tiles":
+        for i in range(1000):
+            x, z, y = (cx << 4) + i % 16, (cz << 4) + (i >> 4) % 16, 64 + (i >> 8)
+            if i % 4:
+                tile_entities.append(_chest(nbt, rand, x, y, z))
+            else:
+                tile_entities.append(_command_block(nbt, rand, x, y, z))
+    level["Entities"] = entities
+    level["TileEntities"] = tile_entities
+    root["Level"] = level
+    return root
+
+
+def builtin_corpus(nbt):
+    corpus = []
+    for layout in ("1.12", "1.13"):
+        for contents in ("empty", "entities", "tiles"):
+            data = make_chunk(nbt, layout, contents).save(compressed=False)
+            corpus.append(("%s-%s" % (layout, contents), data))
+    return corpus
+
+
+def file_corpus(nbt, directory):
+    corpus = []
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                data = nbt.try_gunzip(f.read()) if hasattr(nbt, "try_gunzip") else f.read()
+            corpus.append((filename, data))
+    return corpus
+
+
+# --- Operations ---
+
+def query(nbt, data):
+    """Loads a chunk and reads only what a chunk scan needs: its position and the tile entities in one column."""
+    level = nbt.load(buf=data)["Level"]
+    x, z = level["xPos"].value << 4, level["zPos"].value << 4
+    return [te for te in level["TileEntities"] if te["x"].value == x and te["z"].value == z]
+
+
+def operation(nbt, name, data):
+    if name == "load":
+        return lambda: nbt.load(buf=data)
+    if name == "save":
+        tag = nbt.load(buf=data)
+        return lambda: tag.save(compressed=False)
+    if name == "roundtrip":
+        return lambda: nbt.load(buf=nbt.load(buf=data).save(compressed=True))
+    if name == "query":
+        return lambda: query(nbt, data)
+    raise ValueError("Unknown operation %s" % name)
+
+
+def measure_allocations(func):
+    """Bytes allocated by one call of func. Uses tracemalloc when available, otherwise the size of the returned
+    object tree, which is what stays allocated after a load."""
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return object_size(func())
+
+
+def object_size(obj):
+    if isinstance(obj, numpy.ndarray):
+        return sys.getsizeof(obj) + obj.nbytes
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple)):
+        return size + sum(object_size(o) for o in obj)
+    if hasattr(obj, "tagID"):
+        value = obj.value
+        if isinstance(value, list):
+            return size + sum(object_size(o) for o in value)
+        return size + object_size(value)
+    return size
+
+
+def time_operation(func, min_time):
+    """Runs func until at least min_time seconds have passed. Returns calls per second."""
+    func()  # warm up caches
+    count = 0
+    gc.disable()
+    try:
+        start = default_timer()
+        elapsed = 0
+        while elapsed < min_time:
+            func()
+            count += 1
+            elapsed = default_timer() - start
+    finally:
+        gc.enable()
+    return count / elapsed
+
+
+def run(corpus_dir=None, min_time=0.5, operations=OPERATIONS):
+    results = []
+    for backend_name, nbt in backends():
+        corpus = builtin_corpus(nbt)
+        if corpus_dir:
+            corpus += file_corpus(nbt, corpus_dir)
+        for corpus_name, data in corpus:
+            for op_name in operations:
+                func = operation(nbt, op_name, data)
+                result = {
+                    "backend": backend_name,
+                    "corpus": corpus_name,
+                    "operation": op_name,
+                    "size": len(data),
+                    "ops_per_sec": time_operation(func, min_time),
+                    "bytes_allocated": measure_allocations(func),
+                }
+                print "%(backend)-7s %(corpus)-16s %(operation)-10s %(ops_per_sec)10.1f ops/s %(bytes_allocated)10d bytes" % result
+                results.append(result)
+    return results
+
+
+def regressions(results, baseline, threshold):
+    """Returns (result, baseline ops/sec) for every result slower than the baseline by more than threshold percent."""
+    old = dict(((r["backend"], r["corpus"], r["operation"]), r["ops_per_sec"]) for r in baseline)
+    slower = []
+    for r in results:
+        old_rate = old.get((r["backend"], r["corpus"], r["operation"]))
+        if old_rate and r["ops_per_sec"] < old_rate * (1 - threshold / 100.0):
+            slower.append((r, old_rate))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark NBT load and save.")
+    parser.add_argument("--corpus", help="directory of extra NBT files to benchmark")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="allowed slowdown against the baseline, in percent (default: %(default)s)")
+    parser.add_argument("--min-time", type=float, default=0.5,
+                        help="minimum time spent on each measurement, in seconds (default: %(default)s)")
+    parser.add_argument("--operation", action="append", choices=OPERATIONS,
+                        help="operation to run, may be repeated (default: all)")
+    args = parser.parse_args(argv)
+
+    results = run(args.corpus, args.min_time, args.operation or OPERATIONS)
+    report = {
+        "python": sys.version.split()[0],
+        "numpy": numpy.__version__,
+        "allocations": "tracemalloc" if tracemalloc is not None else "retained",
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print json.dumps(report, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        slower = regressions(results, baseline, args.threshold)
+        for r, old_rate in slower:
+            print "REGRESSION %s %s %s: %.1f ops/s, was %.1f ops/s (%.1f%% slower)" % (
+                r["backend"], r["corpus"], r["operation"], r["ops_per_sec"], old_rate,
+                100.0 * (1 - r["ops_per_sec"] / old_rate))
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,37 +1,259 @@
+"""
+Lighting benchmark and correctness harness.
+
+Builds synthetic worlds, relights every chunk with each lighting engine in a fresh process, and reports
+chunks per second and peak memory. Each engine's BlockLight and SkyLight are diffed against a reference
+engine, and checked for blocks whose light is not what their neighbors and their own light source give
+them, which catches an engine that stops dispersing too early.
+
+    python -m pymclevel.test.time_relight
+    python -m pymclevel.test.time_relight --world caves --size 24 --engine classic --engine stitched
+    python -m pymclevel.test.time_relight --output relight_bench.json
+
+Worlds:
+    flat     grass on stone, open sky
+    caves    hilly stone riddled with tunnels open to the surface
+    islands  floating islands shading flat ground
+    torches  a grid of torches and glowstone rooms under a roof
+
+Exits with status 1 if any engine's lights differ from the reference, or have blocks that are not
+fully lit.
+"""
+import argparse
+import json
+import multiprocessing
+import shutil
+import sys
+from timeit import default_timer
+
+import numpy
+
+from pymclevel.box import BoundingBox
 from pymclevel.infiniteworld import MCInfdevOldLevel
-from pymclevel import mclevel
-from timeit import timeit
+from pymclevel.lighting import LightingVolume
+from templevel import mktemp
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ENGINES = ("classic", "stitched", "parallel")
+LIGHTS = ("BlockLight", "SkyLight")
+
+
+# --- Worlds ---
+
+def flat(level, chunk, rand):
+    m = level.materials
+    chunk.Blocks[:, :, :60] = m.Stone.ID
+    chunk.Blocks[:, :, 60:63] = m.Dirt.ID
+    chunk.Blocks[:, :, 63] = m.Grass.ID
+
+
+def caves(level, chunk, rand):
+    m = level.materials
+    x, z = numpy.mgrid[0:16, 0:16]
+    cx, cz = chunk.chunkPosition
+    heights = 64 + 8 * numpy.sin(((cx << 4) + x) / 11.0) * numpy.cos(((cz << 4) + z) / 7.0)
+    y = numpy.arange(level.Height)
+    chunk.Blocks[y[numpy.newaxis, numpy.newaxis, :] < heights[:, :, numpy.newaxis]] = m.Stone.ID
+
+    for _ in range(6):
+        # a tunnel of spheres wandering up toward the surface
+        px, py, pz = rand.randint(0, 16), rand.randint(10, 50), rand.randint(0, 16)
+        for _ in range(12):
+            r = rand.randint(2, 4)
+            chunk.Blocks[max(0, px - r):px + r, max(0, pz - r):pz + r, max(0, py - r):py + r] = m.Air.ID
+            px = min(15, max(0, px + rand.randint(-2, 3)))
+            pz = min(15, max(0, pz + rand.randint(-2, 3)))
+            py += rand.randint(0, 4)
+
+    chunk.Blocks[rand.rand(16, 16, level.Height) < 0.0005] = m.Glowstone.ID
+    chunk.Blocks[:, :, 0] = m.Stone.ID
+
+
+def islands(level, chunk, rand):
+    m = level.materials
+    chunk.Blocks[:, :, :40] = m.Stone.ID
+    chunk.Blocks[:, :, 40] = m.Grass.ID
+
+    if rand.rand() < 0.5:
+        x, z = rand.randint(0, 10), rand.randint(0, 10)
+        y = rand.randint(100, 140)
+        w = rand.randint(4, 7)
+        chunk.Blocks[x:x + w, z:z + w, y - 3:y] = m.Stone.ID
+        chunk.Blocks[x + 1:x + w - 1, z + 1:z + w - 1, y - 6:y - 3] = m.Stone.ID
+        chunk.Blocks[x:x + w, z:z + w, y] = m.Grass.ID
+        chunk.Blocks[x + 1:x + 3, z + 1:z + 3, y + 1:y + 4] = m.Leaves.ID
+
+    chunk.Blocks[rand.randint(0, 16), rand.randint(0, 16), 41:44] = m.Water.ID
+
+
+def torches(level, chunk, rand):
+    m = level.materials
+    chunk.Blocks[:, :, :64] = m.Stone.ID
+    chunk.Blocks[:, :, 72] = m.Stone.ID  # a roof, so only the torches light the floor
+    chunk.Blocks[::6, ::6, 64] = m.Torch.ID
+
+    # glowstone rooms underground
+    chunk.Blocks[2:14, 2:14, 30:36] = m.Air.ID
+    chunk.Blocks[7, 7, 35] = m.Glowstone.ID
+    chunk.Blocks[4:6, 4:6, 36:64] = m.Glass.ID
+
+
+WORLDS = {
+    "flat": flat,
+    "caves": caves,
+    "islands": islands,
+    "torches": torches,
+}
+
+
+def create_world(name, size):
+    """Creates a temporary level of size x size chunks filled by the named world generator. Returns the level
+    and its path."""
+    path = mktemp("TimeRelight")
+    level = MCInfdevOldLevel(path, create=True)
+    level.createChunksInBox(BoundingBox((0, 0, 0), (size << 4, level.Height, size << 4)))
+
+    rand = numpy.random.RandomState(0)
+    for cPos in sorted(level.allChunks):
+        chunk = level.getChunk(*cPos)
+        WORLDS[name](level, chunk, rand)
+        chunk.chunkChanged()
+
+    return level, path
+
+
+# --- Checks ---
+
+def unlit_blocks(level, light):
+    """Counts the blocks whose light differs from the brightest of their own light source and the light of each
+    neighbor less their absorption. Blocks outside the level are dark."""
+    volume = LightingVolume(level, level.bounds)
+    values = volume.gather(light).astype('int16')
+    absorption = volume.Absorption.astype('int16')
+
+    if light == "BlockLight":
+        expected = volume.Emission.astype('int16')
+    else:
+        expected = volume.skyLightSeeds().astype('int16')
+
+    padded = numpy.zeros([s + 2 for s in values.shape], 'int16')
+    padded[1:-1, 1:-1, 1:-1] = values
+    for axis in range(3):
+        for offset in (0, 2):
+            neighbor = [slice(1, -1)] * 3
+            neighbor[axis] = slice(offset, offset + values.shape[axis])
+            numpy.maximum(expected, padded[tuple(neighbor)] - absorption, expected)
+
+    return int((expected != values).sum())
+
+
+def peak_memory():
+    """Peak resident memory of this process and of its largest finished child, in megabytes."""
+    if resource is None:
+        return None, None
+    scale = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def relight(world, size, engine, results):
+    """Runs in a child process, so every engine starts with the same memory."""
+    level, path = create_world(world, size)
+    try:
+        start = default_timer()
+        level.generateLights(level.allChunks, engine=engine)
+        elapsed = default_timer() - start
+        peak, workers = peak_memory()
+
+        lights = dict((cPos, tuple(getattr(level.getChunk(*cPos), light).copy() for light in LIGHTS))
+                      for cPos in level.allChunks)
+        results.put({
+            "world": world,
+            "engine": engine,
+            "chunks": len(lights),
+            "seconds": elapsed,
+            "chunks_per_sec": len(lights) / elapsed,
+            "peak_memory_mb": peak and round(peak, 1),
+            "worker_peak_memory_mb": workers and round(workers, 1) if engine == "parallel" else None,
+            "unlit_blocks": dict((light, unlit_blocks(level, light)) for light in LIGHTS),
+            "lights": lights,
+        })
+    finally:
+        level.close()
+        shutil.rmtree(path, True)
+
+
+def run_engine(world, size, engine):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=relight, args=(world, size, engine, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
 
-import templevel
 
-# import logging
-#logging.basicConfig(level=logging.INFO)
+def diff_lights(result, reference):
+    """Counts the blocks of each light that differ from the reference run."""
+    diffs = dict((light, 0) for light in LIGHTS)
+    for cPos, lights in result["lights"].iteritems():
+        for light, values, referenceValues in zip(LIGHTS, lights, reference["lights"][cPos]):
+            diffs[light] += int((values != referenceValues).sum())
+    return diffs
 
 
-def natural_relight():
-    world = mclevel.fromFile("testfiles/AnvilWorld")
-    t = timeit(lambda: world.generateLights(world.allChunks), number=1)
-    print "Relight natural terrain: %d chunks in %.02f seconds (%.02fms per chunk)" % (
-    world.chunkCount, t, t / world.chunkCount * 1000)
+def run(worlds, engines, size, reference):
+    results = []
+    for world in worlds:
+        runs = dict((engine, run_engine(world, size, engine)) for engine in set(engines) | {reference})
+        for engine in engines:
+            result = runs[engine]
+            result["reference"] = reference
+            result["differences"] = diff_lights(result, runs[reference])
+            print ("%(world)-8s %(engine)-9s %(chunks_per_sec)8.1f chunks/s  peak %(peak_memory_mb)6s MB  "
+                   "differences %(differences)s  unlit %(unlit_blocks)s" % result)
+            results.append(result)
+        for result in runs.values():
+            del result["lights"]
+    return results
 
 
-def manmade_relight():
-    t = templevel.TempLevel("TimeRelight", createFunc=lambda f: MCInfdevOldLevel(f, create=True))
+def failures(results):
+    return [r for r in results
+            if any(r["differences"].values()) or any(r["unlit_blocks"].values())]
 
-    world = t.level
-    station = mclevel.fromFile("testfiles/station.schematic")
 
-    times = 2
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark lighting engines and check them against each other.")
+    parser.add_argument("--world", action="append", choices=sorted(WORLDS),
+                        help="world to light, may be repeated (default: all)")
+    parser.add_argument("--engine", action="append", choices=ENGINES,
+                        help="engine to run, may be repeated (default: all)")
+    parser.add_argument("--reference", choices=ENGINES, default="stitched",
+                        help="engine the others are diffed against (default: %(default)s)")
+    parser.add_argument("--size", type=int, default=16, help="world size in chunks along each side (default: %(default)s)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
 
-    for x in range(times):
-        for z in range(times):
-            world.copyBlocksFrom(station, station.bounds, (x * station.Width, 63, z * station.Length), create=True)
+    results = run(args.world or sorted(WORLDS), args.engine or ENGINES, args.size, args.reference)
+    report = {
+        "python": sys.version.split()[0],
+        "numpy": numpy.__version__,
+        "cpus": multiprocessing.cpu_count(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
 
-    t = timeit(lambda: world.generateLights(world.allChunks), number=1)
-    print "Relight manmade building: %d chunks in %.02f seconds (%.02fms per chunk)" % (
-    world.chunkCount, t, t / world.chunkCount * 1000)
+    failed = failures(results)
+    for r in failed:
+        print "MISMATCH %(world)s %(engine)s: differences %(differences)s, unlit %(unlit_blocks)s" % r
+    return 1 if failed else 0
 
 
 if __name__ == '__main__':
-    natural_relight()
-    manmade_relight()
+    sys.exit(main())
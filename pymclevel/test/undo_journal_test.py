@@ -0,0 +1,210 @@
+import os
+import shutil
+import unittest
+import numpy
+
+from pymclevel import nbt
+from pymclevel.infiniteworld import MCInfdevOldLevel
+from pymclevel.box import BoundingBox
+from pymclevel.entity import Entity, TileEntity
+from pymclevel.undo_journal import UndoJournal
+from templevel import mktemp
+
+
+def levelState(level):
+    state = {}
+    for cPos in level.allChunks:
+        chunk = level.getChunk(*cPos)
+        state[cPos] = (chunk.Blocks.copy(), chunk.Data.copy(), chunk.Biomes.copy(),
+                       sorted(t.save(compressed=False) for t in chunk.Entities),
+                       sorted(t.save(compressed=False) for t in chunk.TileEntities))
+    return state
+
+
+class TestUndoJournal(unittest.TestCase):
+    def setUp(self):
+        self.path = mktemp("UndoJournalTest")
+        self.level = MCInfdevOldLevel(filename=self.path, create=True)
+        self.level.createChunksInBox(BoundingBox((0, 0, 0), (48, self.level.Height, 48)))
+
+        rand = numpy.random.RandomState(0)
+        for cx, cz in sorted(self.level.allChunks):
+            chunk = self.level.getChunk(cx, cz)
+            chunk.Blocks[:, :, :64] = rand.choice([1, 4, 5, 12], (16, 16, 64))
+            chunk.Data[:, :, :64] = rand.randint(0, 4, (16, 16, 64))
+            x, y, z = (cx << 4) + 3, 70, (cz << 4) + 5
+            chunk.addTileEntity(TileEntity.Create("Chest", (x, y, z)))
+            pig = Entity.Create("Pig")
+            Entity.setpos(pig, (x + 0.5, y, z + 0.5))
+            chunk.addEntity(pig)
+            chunk.chunkChanged(False)
+
+    def tearDown(self):
+        self.level.close()
+        shutil.rmtree(self.path)
+
+    def testUndo(self):
+        level = self.level
+        original = levelState(level)
+
+        journal = UndoJournal(level)
+        for cPos in level.allChunks:
+            journal.capture(*cPos)
+
+        # a few voxels in one chunk, a whole section in another
+        level.setBlockAt(20, 10, 20, level.materials.Glass.ID)
+        level.setBlockDataAt(21, 10, 20, 7)
+        level.fillBlocks(BoundingBox((32, 16, 32), (16, 16, 16)), level.materials.Air)
+
+        chunk = level.getChunk(0, 0)
+        chunk.removeEntitiesInBox(chunk.bounds)
+        chunk.removeTileEntitiesInBox(chunk.bounds)
+        chunk.addTileEntity(TileEntity.Create("Furnace", (1, 2, 3)))
+        chunk.Biomes[:] = 4
+        chunk.chunkChanged(False)
+
+        journal.finish()
+        edited = levelState(level)
+        assert sorted(journal.allChunks) == [(0, 0), (1, 1), (2, 2)]
+
+        sections = dict((cPos, journal.deltas[cPos].sections) for cPos in journal.allChunks)
+        assert not sections[0, 0]
+        assert len(sections[1, 1]) == 1 and len(sections[1, 1][0].indexes) == 2
+        assert len(sections[2, 2]) == 1 and sections[2, 2][0].indexes is None
+        assert journal.size < 16 * 16 * 16 * 2 * 2
+
+        for redo, expected in ((False, original), (True, edited), (False, original)):
+            journal.apply(redo)
+            state = levelState(level)
+            for cPos, chunkState in expected.iteritems():
+                blocks, data, biomes, entities, tileEntities = state[cPos]
+                assert (chunkState[0] == blocks).all()
+                assert (chunkState[1] == data).all()
+                assert (chunkState[2] == biomes).all()
+                assert chunkState[3] == entities
+                assert chunkState[4] == tileEntities
+
+    def testBackgroundCapture(self):
+        level = self.level
+        original = levelState(level)
+
+        journal = UndoJournal(level)
+        journal.captureInBackground(sorted(level.allChunks))
+        level.fillBlocks(BoundingBox((0, 0, 0), (48, 8, 20)), level.materials.Glass)
+        level.setBlockAt(40, 10, 40, level.materials.Glass.ID)
+        journal.finish()
+
+        assert "getChunk" not in level.__dict__ and "replaceChunkTagData" not in level.__dict__
+        assert sorted(journal.allChunks) == [(0, 0), (0, 1), (1, 0), (1, 1), (2, 0), (2, 1), (2, 2)]
+
+        journal.apply()
+        state = levelState(level)
+        for cPos, chunkState in original.iteritems():
+            assert (chunkState[0] == state[cPos][0]).all()
+            assert (chunkState[1] == state[cPos][1]).all()
+
+    def testHeldTags(self):
+        level = self.level
+        chunk = level.getChunk(1, 1)
+        tileEntity = chunk.TileEntities[0]
+        tileEntity["CustomName"] = nbt.TAG_String("old")
+        chunk.chunkChanged(False)
+
+        # Like a file edit, change a tag held from before the journal started, then hand it to the level.
+        journal = UndoJournal(level)
+        journal.captureInBackground(sorted(level.allChunks))
+        tileEntity["CustomName"].value = "new"
+        level.addTileEntity(tileEntity)
+        journal.finish()
+        assert journal.allChunks == [(1, 1)]
+
+        journal.apply()
+        assert [t["CustomName"].value for t in level.getChunk(1, 1).TileEntities] == ["old"]
+        journal.apply(redo=True)
+        assert [t["CustomName"].value for t in level.getChunk(1, 1).TileEntities] == ["new"]
+
+    def testAlignedCopy(self):
+        level = self.level
+        level.saveInPlace()
+        original = levelState(level)
+        level.unload()
+        sourceBox = BoundingBox((0, 0, 0), (16, level.Height, 32))
+        destBox = BoundingBox((32, 0, 0), sourceBox.size)
+
+        # Chunk-aligned copies replace unloaded chunks with replaceChunkTagData instead of going through getChunk.
+        journal = UndoJournal(level)
+        journal.captureInBackground(destBox.chunkPositions)
+        level.copyBlocksFrom(level, sourceBox, destBox.origin)
+        journal.finish()
+        assert (level.getChunk(2, 0).Blocks == original[0, 0][0]).all()
+        assert sorted(journal.allChunks) == [(2, 0), (2, 1)]
+
+        journal.apply()
+        state = levelState(level)
+        for cPos, chunkState in original.iteritems():
+            assert (chunkState[0] == state[cPos][0]).all()
+            assert chunkState[4] == state[cPos][4]
+
+    def testCompressAndSpill(self):
+        level = self.level
+        original = levelState(level)
+
+        journal = UndoJournal(level)
+        for cPos in level.allChunks:
+            journal.capture(*cPos)
+        level.fillBlocks(BoundingBox((0, 0, 0), (40, 40, 40)), level.materials.Glass)
+        chunk = level.getChunk(1, 1)
+        chunk.removeEntitiesInBox(chunk.bounds)
+        chunk.chunkChanged(False)
+        journal.finish()
+
+        chunks = sorted(journal.allChunks)
+        memorySize = journal.memorySize
+        journal.compress()
+        assert sorted(journal.allChunks) == chunks
+        assert 0 < journal.memorySize < memorySize
+
+        journal.spill(self.path)
+        assert journal.memorySize == 0 and journal.diskSize
+        spillFile = journal._packedFile
+        assert os.path.exists(spillFile)
+
+        journal.apply()
+        assert not os.path.exists(spillFile) and journal.diskSize == 0
+        state = levelState(level)
+        for cPos, chunkState in original.iteritems():
+            assert (chunkState[0] == state[cPos][0]).all()
+            assert chunkState[3] == state[cPos][3]
+
+    def testRestoreIntoEmptyListSaved(self):
+        level = self.level
+        journal = UndoJournal(level)
+        journal.capture(1, 1)
+
+        # Replace the lists with new empty ones, whose type is TAG_Byte until a tag is added.
+        levelTag = level.getChunk(1, 1).root_tag["Level"]
+        levelTag["Entities"] = nbt.TAG_List()
+        levelTag["TileEntities"] = nbt.TAG_List()
+        level.getChunk(1, 1).chunkChanged(False)
+        journal.finish()
+
+        for redo, count in ((False, 1), (True, 0), (False, 1)):
+            journal.apply(redo)
+            level.saveInPlace()
+            level.close()
+
+            self.level = level = MCInfdevOldLevel(filename=self.path)
+            journal.level = level
+            chunk = level.getChunk(1, 1)
+            assert len(chunk.Entities) == count
+            assert len(chunk.TileEntities) == count
+            if count:
+                assert [TileEntity.pos(t) for t in chunk.TileEntities] == [[19, 70, 21]]
+
+    def testUnchanged(self):
+        journal = UndoJournal(self.level)
+        journal.capture(1, 1)
+        journal.capture(10, 10)
+        journal.finish()
+        assert journal.finished
+        assert not journal.chunkCount
@@ -0,0 +1,388 @@
+"""
+Undo journal for edits to an MCInfdevOldLevel.
+
+Before an edit, the journal snapshots the tag data of each chunk the edit may touch. Once the edit is done,
+finish() compares each snapshot with the chunk as the edit left it and keeps only what changed: the old blocks
+and data of each changed 16-block section along with the new ones, either as a sparse list of voxels or dense
+compressed arrays, the old and new biomes if they changed, and the entities, tile entities and tile ticks that
+were removed or added. apply() puts the old values back, and apply(redo=True) the new ones, so undoing and redoing
+cost time and space in proportion to the size of the change, not of the box.
+
+Light is not recorded. Chunks changed by apply() are committed with chunkChanged(False) and should be relit.
+
+captureInBackground() lets the edit start at once: a worker thread snapshots the chunks while the edit runs, and
+until finish() the level's getChunk and replaceChunkTagData snapshot any of them the worker hasn't reached yet
+before going ahead. Chunks already loaded, whose tags the edit may be holding, are snapshotted up front.
+
+A finished journal can be compress()ed into a single zlib string, and spill()ed to a file, to keep a long undo
+history small. It is unpacked again the next time its changes are needed.
+"""
+from collections import Counter
+import cPickle
+import logging
+import os
+import tempfile
+import threading
+import zlib
+
+import numpy
+
+from infiniteworld import AnvilChunkData
+from mclevelbase import exhaust
+import nbt
+
+log = logging.getLogger(__name__)
+
+__all__ = ["UndoJournal"]
+
+# Sections with more changed voxels than this are stored whole.
+SPARSE_VOXELS = 1024
+
+# Names of the chunk tag lists the journal keeps track of.
+TAG_LISTS = ("Entities", "TileEntities", "TileTicks")
+
+# Level methods, taking cx, cz first, through which an edit may change a chunk.
+CAPTURING_METHODS = ("getChunk", "replaceChunkTagData")
+
+
+def packBlocks(blocks, data):
+    """ Packs block IDs and data values into one uint16 array of ID << 4 | data. """
+    packed = blocks.astype('uint16') << 4
+    packed |= data
+    return packed
+
+
+def tagKey(tag):
+    """ The serialized form of tag, which compares equal for equal tags. """
+    return tag.save(compressed=False)
+
+
+def _tagList(levelTag, name):
+    return levelTag[name].value if name in levelTag else []
+
+
+class SectionDelta(object):
+    """ The old and new packed blocks of the voxels changed in one 16-block section of a chunk. indexes holds the
+    flat indexes of the changed voxels in the (16, 16, 16) section, or is None if the whole section is stored. """
+    __slots__ = ('y', 'indexes', '_before', '_after')
+
+    def __init__(self, y, before, after):
+        self.y = y
+        changed = numpy.flatnonzero(before != after)
+        if len(changed) > SPARSE_VOXELS:
+            self.indexes = None
+            self._before = zlib.compress(before.tostring(), 1)
+            self._after = zlib.compress(after.tostring(), 1)
+        else:
+            self.indexes = changed.astype('uint16')
+            self._before = before.ravel()[changed]
+            self._after = after.ravel()[changed]
+
+    def values(self, redo=False):
+        """ The old packed blocks, or the new ones if redo is True. """
+        values = self._after if redo else self._before
+        if self.indexes is None:
+            return numpy.frombuffer(zlib.decompress(values), 'uint16').reshape(16, 16, 16)
+        return values
+
+    @property
+    def size(self):
+        if self.indexes is None:
+            return len(self._before) + len(self._after)
+        return self.indexes.nbytes + self._before.nbytes + self._after.nbytes
+
+    def apply(self, chunk, redo=False):
+        ys = slice(self.y, self.y + 16)
+        packed = packBlocks(chunk.Blocks[..., ys], chunk.Data[..., ys])
+        if self.indexes is None:
+            packed[:] = self.values(redo)
+        else:
+            packed.ravel()[self.indexes] = self.values(redo)
+        chunk.Blocks[..., ys] = packed >> 4
+        chunk.Data[..., ys] = packed & 0xf
+
+
+class ChunkDelta(object):
+    """ What an edit changed in one chunk: a SectionDelta for each changed section, the old and new biomes if they
+    changed, and for each changed tag list, the serialized tags the edit removed and the serialized tags it
+    added. """
+
+    def __init__(self, before, chunk):
+        self.sections = []
+        for y in xrange(0, chunk.world.Height, 16):
+            ys = slice(y, y + 16)
+            old = packBlocks(before.Blocks[..., ys], before.Data[..., ys])
+            new = packBlocks(chunk.Blocks[..., ys], chunk.Data[..., ys])
+            if (old != new).any():
+                self.sections.append(SectionDelta(y, old, new))
+
+        self.biomes = None
+        oldBiomes = before.root_tag["Level"]["Biomes"].value.reshape(16, 16)
+        if (oldBiomes != chunk.Biomes).any():
+            self.biomes = (oldBiomes.copy(), chunk.Biomes.copy())
+
+        self.tags = {}
+        for name in TAG_LISTS:
+            old = Counter(tagKey(t) for t in _tagList(before.root_tag["Level"], name))
+            new = Counter(tagKey(t) for t in _tagList(chunk.root_tag["Level"], name))
+            removed, added = old - new, new - old
+            if removed or added:
+                self.tags[name] = (list(removed.elements()), list(added.elements()))
+
+    def __nonzero__(self):
+        return bool(self.sections or self.biomes is not None or self.tags)
+
+    @property
+    def size(self):
+        size = sum(s.size for s in self.sections)
+        if self.biomes is not None:
+            size += sum(b.nbytes for b in self.biomes)
+        for removed, added in self.tags.itervalues():
+            size += sum(len(k) for k in removed) + sum(len(k) for k in added)
+        return size
+
+    def apply(self, chunk, redo=False):
+        """ Puts the chunk back as it was before the edit, or as the edit left it if redo is True. """
+        for section in self.sections:
+            section.apply(chunk, redo)
+
+        if self.biomes is not None:
+            chunk.Biomes[:] = self.biomes[redo]
+
+        for name, (removed, added) in self.tags.iteritems():
+            restore, remove = (added, removed) if redo else (removed, added)
+            tags = getattr(chunk, name)
+            remove = Counter(remove)
+            kept = []
+            for tag in tags:
+                key = tagKey(tag)
+                if remove[key]:
+                    remove[key] -= 1
+                else:
+                    kept.append(tag)
+            kept.extend(nbt.load(buf=key) for key in restore)
+            # Refill the list through its own methods, so an empty list takes the type of the restored tags.
+            del tags[:]
+            tags.extend(kept)
+
+        if self.tags:
+            chunk.invalidateEntityIndexes()
+        chunk.chunkChanged(False)
+
+
+class UndoJournal(object):
+    """ Records the changes an edit makes to the chunks of an MCInfdevOldLevel. Call capture(), captureIter() or
+    captureInBackground() for the chunks the edit may touch before it starts, and finish() once it is done. """
+
+    def __init__(self, level):
+        self.level = level
+        self.finished = False
+        self._snapshots = {}
+        self._deltas = {}
+        self._chunks = None
+        self._packed = None
+        self._packedFile = None
+        self._packedSize = 0
+
+        self._lock = threading.RLock()
+        self._pending = None
+        self._touched = None
+        self._worker = None
+        self._stopping = False
+        self._levelMethods = None
+
+    def capture(self, cx, cz):
+        """ Snapshots the chunk at (cx, cz) unless it was already captured. Chunks the level doesn't
+        contain are skipped. """
+        if (cx, cz) in self._snapshots or not self.level.containsChunk(cx, cz):
+            return
+        self._snapshots[cx, cz] = zlib.compress(self.level.getChunkTagData(cx, cz), 1)
+
+    def captureIter(self, chunks, chunkCount=-1):
+        for i, (cx, cz) in enumerate(chunks):
+            self.capture(cx, cz)
+            yield i, chunkCount, "Recording undo..."
+
+    def captureInBackground(self, chunks):
+        """ Starts snapshotting chunks on a worker thread and returns at once. Until finish() is called, the
+        level's getChunk and replaceChunkTagData snapshot any of these chunks that hasn't been captured yet before
+        going ahead, so the edit may change any chunk it gets or replaces through them. finish() then only
+        compares the chunks the edit went through them for.
+
+        Chunks already loaded are captured before this returns, since the edit may hold and change their tags
+        before going through the level. """
+        chunks = list(chunks)
+        requested = frozenset(chunks)
+        self._pending = set(chunks)
+        self._touched = set()
+
+        level = self.level
+        for cPos in chunks:
+            if cPos in level._loadedChunkData:
+                self._pending.discard(cPos)
+                self.capture(*cPos)
+
+        self._levelMethods = {}
+        for name in CAPTURING_METHODS:
+            self._levelMethods[name] = level.__dict__.get(name)
+            setattr(level, name, self._capturing(getattr(level, name), requested))
+
+        self._worker = threading.Thread(target=self._captureWorker, args=(chunks,), name="UndoCapture")
+        self._worker.daemon = True
+        self._worker.start()
+
+    def _capturing(self, method, requested):
+        """ Wraps a level method taking cx, cz first, so it captures the chunk before calling method. The lock
+        also keeps method from reading or writing region files while the worker is reading them. """
+        def _method(cx, cz, *args, **kwargs):
+            with self._lock:
+                if (cx, cz) in requested:
+                    if (cx, cz) in self._pending:
+                        self._pending.discard((cx, cz))
+                        self.capture(cx, cz)
+                    self._touched.add((cx, cz))
+                return method(cx, cz, *args, **kwargs)
+
+        return _method
+
+    def _captureWorker(self, chunks):
+        for cPos in chunks:
+            if self._stopping:
+                return
+            with self._lock:
+                if cPos not in self._pending:
+                    continue
+                self._pending.discard(cPos)
+                try:
+                    if not self.level.containsChunk(*cPos):
+                        continue
+                    data = self.level.getChunkTagData(*cPos)
+                except Exception as e:
+                    log.warn(u"Undo journal could not capture chunk {0}: {1!r}".format(cPos, e))
+                    continue
+            # Compress outside the lock, so the edit isn't kept waiting on it.
+            self._snapshots[cPos] = zlib.compress(data, 1)
+
+    def stopCapture(self):
+        """ Stops the worker thread started by captureInBackground() and gives the level its own methods back. """
+        if self._worker is None:
+            return
+        self._stopping = True
+        self._worker.join()
+        self._worker = None
+
+        for name, method in self._levelMethods.iteritems():
+            if method is None:
+                delattr(self.level, name)
+            else:
+                setattr(self.level, name, method)
+        self._levelMethods = None
+
+    def finish(self):
+        """ Replaces the snapshots with the changes made to them since they were taken. """
+        exhaust(self.finishIter())
+
+    def finishIter(self):
+        self.stopCapture()
+        snapshots, self._snapshots = self._snapshots, {}
+        if self._touched is not None:
+            # Chunks the edit never asked for are unchanged.
+            snapshots = dict((cPos, snapshots[cPos]) for cPos in self._touched if cPos in snapshots)
+            self._pending = self._touched = None
+
+        for i, (cPos, data) in enumerate(snapshots.iteritems()):
+            before = AnvilChunkData(self.level, cPos, nbt.load(buf=zlib.decompress(data)))
+            delta = ChunkDelta(before, self.level.getChunk(*cPos))
+            if delta:
+                self._deltas[cPos] = delta
+            yield i, len(snapshots), "Recording undo..."
+
+        self.finished = True
+        log.debug(u"Undo journal: {0} of {1} chunks changed, {2} bytes".format(len(self._deltas), len(snapshots),
+                                                                                self.size))
+
+    @property
+    def capturedCount(self):
+        """ Number of chunks snapshotted and not yet compared. """
+        return len(self._snapshots)
+
+    @property
+    def deltas(self):
+        """ The ChunkDelta of each changed chunk, unpacked first if the journal was compressed. """
+        if self._deltas is None:
+            if self._packedFile is not None:
+                with open(self._packedFile, "rb") as f:
+                    self._packed = f.read()
+                self.discard()
+            self._deltas = cPickle.loads(zlib.decompress(self._packed))
+            self._packed = self._chunks = None
+        return self._deltas
+
+    @property
+    def allChunks(self):
+        """ Positions of the chunks with recorded changes. """
+        if self._deltas is None:
+            return list(self._chunks)
+        return self._deltas.keys()
+
+    @property
+    def chunkCount(self):
+        return len(self.allChunks)
+
+    @property
+    def memorySize(self):
+        """ Bytes held in memory by the journal's snapshots and recorded changes. """
+        if self._deltas is None:
+            return len(self._packed or "")
+        return sum(len(s) for s in self._snapshots.values()) + sum(d.size for d in self._deltas.itervalues())
+
+    @property
+    def diskSize(self):
+        """ Bytes of the file the journal was spilled to. """
+        return self._packedSize if self._packedFile is not None else 0
+
+    @property
+    def size(self):
+        return self.memorySize + self.diskSize
+
+    def compress(self):
+        """ Packs the recorded changes of a finished journal into one zlib string. """
+        if self._deltas is None:
+            return
+        assert self.finished, "Undo journal compressed before it was finished"
+        self._chunks = self._deltas.keys()
+        self._packed = zlib.compress(cPickle.dumps(self._deltas, cPickle.HIGHEST_PROTOCOL), 1)
+        self._deltas = None
+
+    def spill(self, folder=None):
+        """ Compresses the journal and moves it to a file in folder, or in the system's temporary folder. """
+        self.compress()
+        if self._packedFile is not None:
+            return
+        fd, self._packedFile = tempfile.mkstemp(suffix=".undo", dir=folder)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self._packed)
+        self._packedSize = len(self._packed)
+        self._packed = None
+
+    def discard(self):
+        """ Deletes the file the journal was spilled to, if any. A spilled journal can't be applied after this. """
+        if self._packedFile is not None:
+            try:
+                os.remove(self._packedFile)
+            except OSError as e:
+                log.warn(u"Could not remove undo file {0}: {1!r}".format(self._packedFile, e))
+            self._packedFile = None
+            self._packedSize = 0
+
+    def applyIter(self, redo=False):
+        """ Puts back everything the edit changed, or if redo is True, makes the edit's changes again. The journal
+        must be finished first. """
+        assert self.finished, "Undo journal applied before it was finished"
+        status = "Redoing chunk %s..." if redo else "Undoing chunk %s..."
+        for i, (cPos, delta) in enumerate(self.deltas.iteritems()):
+            delta.apply(self.level.getChunk(*cPos), redo)
+            yield i, len(self.deltas), status % (cPos,)
+
+    def apply(self, redo=False):
+        exhaust(self.applyIter(redo))